@@ -7,9 +7,22 @@ import logging
 
 from plasmodesmata_analysis import (
     get_microscopy_collection,
+    add_analysis_arguments,
+    analysis_options,
     __version__
 )
 from analyse_all_series import analyse_all
+from batch import (
+    add_jobs_argument,
+    analyse_files,
+    images_to_analyse,
+    list_images,
+)
+from run_report import add_report_file, stage, unit
+from journal import RunJournal, journal_parameters
+from result_store import run_store
+from service import add_service_argument, submit_files
+from watch import add_watch_arguments, watch_images
 
 # Setup logging with a stream handler.
 logger = logging.getLogger(os.path.basename(__file__))
@@ -19,30 +32,62 @@ ch.setLevel(logging.DEBUG)
 logger.addHandler(ch)
 
 
-def analyse_dir(args):
-    """Analyse all images in an input directory."""
-    for fname in os.listdir(args.input_dir):
-        if not fname.lower().endswith(".lif"):
-            continue
-        logger.info("Analysing image: {}".format(fname))
+def analyse_dir(args, journal=None, store=None):
+    """Analyse all images in an input directory.
+
+    The status of the analysis of each image is recorded in a
+    :class:`journal.RunJournal`, by default one in the output directory.
+    Images that have already been analysed are skipped. The object tables
+    are appended to a :class:`result_store.ResultStore`, by default one in the
+    output directory, if requested.
+
+    With args.watch the input directory is watched for new images, see
+    :mod:`watch`.
+    """
+    options = analysis_options(args)
+    if journal is None:
+        journal = RunJournal(args.output_dir, journal_parameters(
+            args.threshold, args.min_voxel, args.max_voxel, options))
+    if store is None:
+        store = run_store(args.output_dir, options)
+    if args.watch:
+        watch_images(
+            lambda: list_images(args.input_dir, args.output_dir, ".lif"),
+            lambda images: analyse_images(args, images, journal, store),
+            journal, args.poll_interval, args.settle_time, logger)
+        return
+    images = images_to_analyse(args.input_dir, args.output_dir, ".lif",
+                               logger, journal)
+    analyse_images(args, images, journal, store)
+
 
-        def get_dir_name(fname):
-            no_suffix_list = fname.split(".")[0:-1]
-            return ".".join(no_suffix_list)
-        dir_name = get_dir_name(fname)
-        specific_out_dir = os.path.join(args.output_dir, dir_name)
+def analyse_images(args, images, journal, store, main_logger=logger):
+    """Analyse the images of a list of (input file, output directory) tuples.
 
-        # Skip analysis of image if output directory exists.
-        if os.path.isdir(specific_out_dir):
-            logger.info("Directory exists: {}".format(specific_out_dir))
-            logger.info("Skipping: {}".format(fname))
-            continue
-        os.mkdir(specific_out_dir)
+    The images are analysed on the analysis service, on a pool of
+    processes or in turn, depending on the arguments.
+    """
+    options = analysis_options(args)
+    if args.service is not None:
+        submit_files(args.service, images, args.threshold, args.min_voxel,
+                     args.max_voxel, main_logger, options, journal, store)
+        return
+    if args.jobs > 1:
+        analyse_files(images, get_microscopy_collection, args.threshold,
+                      args.min_voxel, args.max_voxel, args.jobs, main_logger,
+                      options, journal, store)
+        return
 
-        fpath = os.path.join(args.input_dir, fname)
-        microscopy_collection = get_microscopy_collection(fpath)
-        analyse_all(microscopy_collection, specific_out_dir, args.threshold,
-                    args.min_voxel, args.max_voxel)
+    for fpath, specific_out_dir in images:
+        main_logger.info("Analysing image: {}".format(os.path.basename(fpath)))
+        if not os.path.isdir(specific_out_dir):
+            os.mkdir(specific_out_dir)
+        with unit(file=fpath):
+            with stage("load"):
+                microscopy_collection = get_microscopy_collection(fpath)
+            analyse_all(microscopy_collection, specific_out_dir,
+                        args.threshold, args.min_voxel, args.max_voxel,
+                        journal, fpath, store, **options)
 
 
 def main():
@@ -56,6 +101,10 @@ def main():
                         help="Minimum voxel volume (default=2)")
     parser.add_argument("--max-voxel", default=50, type=int,
                         help="Maximum voxel volume (default=50)")
+    add_analysis_arguments(parser)
+    add_jobs_argument(parser)
+    add_service_argument(parser)
+    add_watch_arguments(parser)
     args = parser.parse_args()
 
     if not os.path.isdir(args.output_dir):
@@ -68,6 +117,7 @@ def main():
     formatter = logging.Formatter(format_)
     fh.setFormatter(formatter)
     logger.addHandler(fh)
+    add_report_file(args.output_dir)
 
     logger.info("Script version: {}".format(__version__))
     logger.info("Threshold: {}".format(args.threshold))
@@ -6,9 +6,17 @@ import argparse
 import logging
 
 from plasmodesmata_analysis import (
+    add_analysis_arguments,
+    analysis_options,
     __version__
 )
-from analyse_all_images import analyse_dir
+from analyse_all_images import analyse_dir, analyse_images
+from batch import add_jobs_argument, images_to_analyse, list_images
+from run_report import add_report_file
+from journal import RunJournal, journal_parameters
+from result_store import run_store
+from service import add_service_argument
+from watch import add_watch_arguments, watch_images
 
 # Setup logging with a stream handler.
 logger = logging.getLogger(os.path.basename(__file__))
@@ -18,10 +26,51 @@ ch.setLevel(logging.DEBUG)
 logger.addHandler(ch)
 
 
+def line_images(input_dir, output_dir):
+    """Return (input file, output directory) tuples of the images of all lines.
+
+    The images in each subdirectory of the input directory are analysed into
+    the subdirectory of the same name in the output directory, which is
+    created if needed.
+    """
+    images = []
+    for directory in os.listdir(input_dir):
+        if not os.path.isdir(os.path.join(input_dir, directory)):
+            continue
+        specific_out_dir = os.path.join(output_dir, directory)
+        if not os.path.isdir(specific_out_dir):
+            os.mkdir(specific_out_dir)
+        images.extend(list_images(os.path.join(input_dir, directory),
+                                  specific_out_dir, ".lif"))
+    return images
+
+
 def analyse_line(args):
-    """Analyse all series in subdirectories of an input directory."""
+    """Analyse all series in subdirectories of an input directory.
+
+    The status of the analysis of each image is recorded in a single
+    :class:`journal.RunJournal` in the output directory. Likewise the object
+    tables are appended to a single :class:`result_store.ResultStore`, if
+    requested.
+
+    With args.watch the subdirectories are watched for new images, see
+    :mod:`watch`.
+    """
     input_dir = args.input_dir
     output_dir = args.output_dir
+    options = analysis_options(args)
+    journal = RunJournal(output_dir, journal_parameters(
+        args.threshold, args.min_voxel, args.max_voxel, options))
+    store = run_store(output_dir, options)
+    if args.watch:
+        watch_images(
+            lambda: line_images(input_dir, output_dir),
+            lambda images: analyse_images(args, images, journal, store,
+                                          logger),
+            journal, args.poll_interval, args.settle_time, logger)
+        return
+
+    images = []
     for directory in os.listdir(input_dir):
         logger.info("Analysing directory: {}".format(directory))
 
@@ -29,9 +78,20 @@ def analyse_line(args):
         if not os.path.isdir(specific_out_dir):
             os.mkdir(specific_out_dir)
 
+        if args.jobs > 1 or args.service is not None:
+            # Collect the images of all directories to schedule them onto a
+            # single pool of processes.
+            images.extend(images_to_analyse(os.path.join(input_dir, directory),
+                                            specific_out_dir, ".lif", logger,
+                                            journal))
+            continue
+
         args.input_dir = os.path.join(input_dir, directory)
         args.output_dir = specific_out_dir
-        analyse_dir(args)
+        analyse_dir(args, journal, store)
+
+    if images:
+        analyse_images(args, images, journal, store, logger)
 
 
 def main():
@@ -45,6 +105,10 @@ def main():
                         help="Minimum voxel volume (default=2)")
     parser.add_argument("--max-voxel", default=50, type=int,
                         help="Maximum voxel volume (default=50)")
+    add_analysis_arguments(parser)
+    add_jobs_argument(parser)
+    add_service_argument(parser)
+    add_watch_arguments(parser)
     args = parser.parse_args()
 
     if not os.path.isdir(args.output_dir):
@@ -57,6 +121,7 @@ def main():
     formatter = logging.Formatter(format_)
     fh.setFormatter(formatter)
     logger.addHandler(fh)
+    add_report_file(args.output_dir)
 
     logger.info("Script version: {}".format(__version__))
 
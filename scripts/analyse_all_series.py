@@ -5,13 +5,18 @@ import os.path
 import argparse
 import logging
 
-from jicbioimage.core.io import AutoName
-
 from plasmodesmata_analysis import (
     get_microscopy_collection,
-    plasmodesmata_analysis,
+    add_analysis_arguments,
+    analysis_options,
     __version__
 )
+from batch import add_jobs_argument, analyse_files
+from run_report import add_report_file, stage, unit
+from journal import RunJournal, journal_parameters, RUNNING, DONE, FAILED
+from multichannel import analyse_channels
+from result_store import run_store
+from service import add_service_argument, submit_files
 
 
 # Setup logging with a stream handler.
@@ -23,18 +28,42 @@ logger.addHandler(ch)
 
 
 def analyse_all(microscopy_collection, output_dir, threshold, min_voxel,
-                max_voxel):
-    """Analyse all series in input microscopy file."""
-    for s in microscopy_collection.series:
+                max_voxel, journal=None, input_file=None, store=None,
+                **options):
+    """Analyse all series in input microscopy file.
+
+    If a :class:`journal.RunJournal` is given, the status of each series of
+    the input file is recorded in it and series that are done are skipped.
+    If a :class:`result_store.ResultStore` is given, the object table of each
+    series, channel and time point is appended to it.
+
+    Additional keyword arguments are passed on to
+    :func:`multichannel.analyse_channels`.
+    """
+    series_list = microscopy_collection.series
+    if journal is not None:
+        series_list = journal.start_file(input_file, series_list)
+    for s in series_list:
         sub_dir = os.path.join(output_dir, str(s))
         if not os.path.isdir(sub_dir):
             os.mkdir(sub_dir)
 
-        AutoName.directory = sub_dir
-
         logger.info("Analysing series: {}".format(s))
-        plasmodesmata_analysis(microscopy_collection, s, threshold, min_voxel,
-                               max_voxel)
+        if journal is not None:
+            journal.record(input_file, s, RUNNING)
+        try:
+            tables = analyse_channels(microscopy_collection, s, threshold,
+                                      min_voxel, max_voxel, sub_dir,
+                                      **options)
+        except BaseException:
+            if journal is not None:
+                journal.record(input_file, s, FAILED)
+            raise
+        for channel, timepoint, table in tables:
+            if store is not None and table is not None:
+                store.append(table, input_file, s, channel, timepoint)
+        if journal is not None:
+            journal.record(input_file, s, DONE)
 
 
 def main():
@@ -48,6 +77,9 @@ def main():
                         help="Minimum voxel volume (default=2)")
     parser.add_argument("--max-voxel", default=50, type=int,
                         help="Maximum voxel volume (default=50)")
+    add_analysis_arguments(parser)
+    add_jobs_argument(parser)
+    add_service_argument(parser)
     args = parser.parse_args()
 
     dir_name = os.path.basename(args.input_file).split(".")[0]
@@ -67,12 +99,36 @@ def main():
     formatter = logging.Formatter(format_)
     fh.setFormatter(formatter)
     logger.addHandler(fh)
+    add_report_file(specific_out_dir)
 
     logger.info("Script version: {}".format(__version__))
 
-    microscopy_collection = get_microscopy_collection(args.input_file)
-    analyse_all(microscopy_collection, specific_out_dir, args.threshold,
-                args.min_voxel, args.max_voxel)
+    options = analysis_options(args)
+    journal = RunJournal(specific_out_dir, journal_parameters(
+        args.threshold, args.min_voxel, args.max_voxel, options))
+    if journal.file_done(args.input_file):
+        logger.info("Already analysed: {}".format(args.input_file))
+        return
+
+    store = run_store(specific_out_dir, options)
+    if args.service is not None:
+        submit_files(args.service, [(args.input_file, specific_out_dir)],
+                     args.threshold, args.min_voxel, args.max_voxel, logger,
+                     options, journal, store)
+        return
+    if args.jobs > 1:
+        analyse_files([(args.input_file, specific_out_dir)],
+                      get_microscopy_collection, args.threshold,
+                      args.min_voxel, args.max_voxel, args.jobs, logger,
+                      options, journal, store)
+        return
+
+    with unit(file=args.input_file):
+        with stage("load"):
+            microscopy_collection = get_microscopy_collection(args.input_file)
+        analyse_all(microscopy_collection, specific_out_dir, args.threshold,
+                    args.min_voxel, args.max_voxel, journal, args.input_file,
+                    store, **options)
 
 if __name__ == "__main__":
     main()
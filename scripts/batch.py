@@ -0,0 +1,287 @@
+"""Analyse (file, series) work units on a pool of worker processes.
+
+Each input file is first loaded into a microscopy collection in a worker
+process. Every series of the loaded file is then scheduled as a separate work
+unit. Each worker process is replaced after a single unit, so that memory does
+not build up across units.
+
+Log records emitted while a unit runs are sent back to the main process and
+handled by its logger, so that they end up in the main log file. The records
+of the run report, see :mod:`run_report`, are forwarded in the same way. A
+file or series that fails is logged and skipped rather than aborting the run.
+"""
+
+import os
+import os.path
+import logging
+import threading
+import multiprocessing
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import run_report
+from journal import RUNNING, DONE, FAILED
+from multichannel import analyse_channels
+
+logger = logging.getLogger(os.path.basename(__file__))
+logger.setLevel(logging.DEBUG)
+logger.propagate = False
+
+
+def add_jobs_argument(parser):
+    """Add the --jobs option to an argument parser."""
+    parser.add_argument("-j", "--jobs", default=1, type=int,
+                        help="number of worker processes (default=1)")
+
+
+def list_images(input_dir, output_dir, suffix):
+    """Return list of (input file, output directory) tuples of all images.
+
+    :param suffix: file name suffix of the images, e.g. ".lif"
+    """
+    images = []
+    for fname in os.listdir(input_dir):
+        if not fname.lower().endswith(suffix):
+            continue
+
+        def get_dir_name(fname):
+            no_suffix_list = fname.split(".")[0:-1]
+            return ".".join(no_suffix_list)
+        dir_name = get_dir_name(fname)
+        specific_out_dir = os.path.join(output_dir, dir_name)
+        fpath = os.path.join(input_dir, fname)
+        images.append((fpath, specific_out_dir))
+    return images
+
+
+def images_to_analyse(input_dir, output_dir, suffix, main_logger, journal):
+    """Return list of (input file, output directory) tuples to analyse.
+
+    Images whose series are all done according to the journal are skipped.
+
+    :param suffix: file name suffix of the images, e.g. ".lif"
+    :param main_logger: logger reporting the skipped images
+    :param journal: :class:`journal.RunJournal`
+    """
+    images = []
+    for fpath, specific_out_dir in list_images(input_dir, output_dir,
+                                               suffix):
+        # Skip analysis of image if it is done.
+        if journal.file_done(fpath):
+            main_logger.info("Already analysed: {}".format(specific_out_dir))
+            main_logger.info("Skipping: {}".format(os.path.basename(fpath)))
+            continue
+
+        images.append((fpath, specific_out_dir))
+    return images
+
+
+class _RecordCollector(logging.Handler):
+    """Logging handler that keeps the records emitted by a work unit."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        # Format the message and the traceback up front so that the record
+        # can be pickled and sent back to the main process.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+
+def _run_unit(function, args, description):
+    """Run a work unit, returning (success, result, log records)."""
+    collector = _RecordCollector()
+    logger.addHandler(collector)
+    # The report file handlers inherited from the main process are replaced,
+    # so that the main process is the only one writing to the report file.
+    report_handlers = run_report.logger.handlers
+    run_report.logger.handlers = [collector]
+    try:
+        result = function(*args)
+        success = True
+    except Exception:
+        logger.exception("Failed: {}".format(description))
+        result = None
+        success = False
+    finally:
+        logger.removeHandler(collector)
+        run_report.logger.handlers = report_handlers
+    return success, result, collector.records
+
+
+def _load(load_collection, fpath, output_dir):
+    logger.info("Analysing image: {}".format(os.path.basename(fpath)))
+    if not os.path.isdir(output_dir):
+        os.mkdir(output_dir)
+    with run_report.unit(file=fpath), run_report.stage("load"):
+        return load_collection(fpath)
+
+
+def _load_unit(task):
+    fpath, output_dir = task[1:]
+    success, collection, records = _run_unit(_load, task, fpath)
+    return fpath, output_dir, success, collection, records
+
+
+def analyse_series(microscopy_collection, series, output_dir, threshold,
+                   min_voxel, max_voxel, options, series_dir=True):
+    """Analyse a series writing the output to a series specific directory.
+
+    :param options: dictionary of additional keyword arguments for
+                    :func:`multichannel.analyse_channels`
+    :param series_dir: whether to write the output to a sub-directory of the
+                       output directory named after the series, rather than
+                       to the output directory itself
+    :returns: list of (channel, timepoint, object table) tuples; the tables
+              are None unless requested in the options
+    """
+    sub_dir = output_dir
+    if series_dir:
+        sub_dir = os.path.join(output_dir, str(series))
+    if not os.path.isdir(sub_dir):
+        os.mkdir(sub_dir)
+    logger.info("Analysing series: {}".format(series))
+    return analyse_channels(microscopy_collection, series, threshold,
+                            min_voxel, max_voxel, sub_dir, **options)
+
+
+def _series_unit(task):
+    fpath, series = task[0], task[2]
+    description = "{} series {}".format(fpath, series)
+    with run_report.unit(file=fpath):
+        success, tables, records = _run_unit(analyse_series, task[1:],
+                                             description)
+    return fpath, series, success, records, tables
+
+
+def analyse_files(files, load_collection, threshold, min_voxel, max_voxel,
+                  jobs, main_logger, options=None, journal=None, store=None,
+                  pool=None, report_logger=None, series=None):
+    """Analyse all series of the input files on a pool of processes.
+
+    :param files: iterable of (input file path, output directory) tuples
+    :param load_collection: function returning the microscopy collection of
+                            an input file; needs to be picklable
+    :param jobs: number of worker processes
+    :param main_logger: logger handling the records emitted in the workers
+    :param options: dictionary of additional keyword arguments for
+                    :func:`multichannel.analyse_channels`
+    :param journal: :class:`journal.RunJournal` recording the status of the
+                    units; series that are done are skipped
+    :param store: :class:`result_store.ResultStore` to append the object
+                  tables of the series to
+    :param pool: :class:`multiprocessing.Pool` to use instead of a pool of
+                 jobs processes created for these files; it is left open
+    :param report_logger: logger handling the run report records emitted in
+                          the workers, by default :data:`run_report.logger`
+    :param series: index of the only series to analyse of each file, whose
+                   output is written to the output directory of the file
+                   itself; None to analyse all series, each in a
+                   sub-directory
+    :returns: list of descriptions of the failed work units
+    """
+    if report_logger is None:
+        report_logger = run_report.logger
+
+    def handle(records):
+        for record in records:
+            if record.name == run_report.logger.name:
+                report_logger.handle(record)
+            else:
+                main_logger.handle(record)
+
+    def record(fpath, series, status):
+        if journal is not None:
+            journal.record(fpath, series, status)
+
+    if options is None:
+        options = {}
+
+    failures = []
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(processes=jobs, maxtasksperchild=1)
+
+    # The files are taken from the iterable by a feeder thread, which
+    # submits at most jobs loads ahead of those handled below, so that the
+    # files can be produced, e.g. converted, while others are analysed and
+    # the series of the loaded files are submitted in between.
+    loads = Queue()
+    slots = threading.BoundedSemaphore(jobs)
+    feed_errors = []
+
+    def feed():
+        try:
+            for fpath, output_dir in files:
+                slots.acquire()
+                loads.put(pool.apply_async(
+                    _load_unit, ((load_collection, fpath, output_dir),)))
+        except BaseException as e:
+            feed_errors.append(e)
+        finally:
+            loads.put(None)
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+    try:
+        series_results = []
+        while True:
+            load = loads.get()
+            if load is None:
+                break
+            fpath, output_dir, success, collection, records = load.get()
+            slots.release()
+            handle(records)
+            if not success:
+                failures.append(fpath)
+                record(fpath, None, FAILED)
+                continue
+            series_list = collection.series
+            if series is not None:
+                series_list = [series]
+            if journal is not None:
+                series_list = journal.start_file(fpath, series_list)
+            for s in series_list:
+                task = (fpath, collection, s, output_dir, threshold,
+                        min_voxel, max_voxel, options, series is None)
+                series_results.append(pool.apply_async(_series_unit, (task,)))
+                record(fpath, s, RUNNING)
+        if feed_errors:
+            raise(feed_errors[0])
+
+        for async_result in series_results:
+            fpath, series, success, records, tables = async_result.get()
+            handle(records)
+            if success:
+                for channel, timepoint, table in tables:
+                    if store is not None and table is not None:
+                        store.append(table, fpath, series, channel,
+                                     timepoint)
+                record(fpath, series, DONE)
+            else:
+                failures.append("{} series {}".format(fpath, series))
+                record(fpath, series, FAILED)
+        if own_pool:
+            pool.close()
+    except BaseException:
+        if own_pool:
+            pool.terminate()
+        raise
+    finally:
+        if own_pool:
+            pool.join()
+
+    for failure in failures:
+        main_logger.error("Failed: {}".format(failure))
+    return failures
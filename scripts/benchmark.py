@@ -0,0 +1,290 @@
+"""Benchmark the stages of the analysis on synthetic z-stacks.
+
+The z-stacks are generated deterministically from a random seed, so that the
+same images are analysed in every run. They consist of a noisy background,
+small bright spots of varying size, standing in for the plasmodesmata, and a
+few large bright blobs, standing in for stomata. No microscopy files or
+bfconvert are needed.
+
+Each stage is timed several times and the fastest time is reported, together
+with the throughput in voxels and objects per second. The results can be
+saved to a JSON file and later runs compared against it; the benchmark then
+exits with an error if any stage is slower than the baseline by more than the
+tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+import numpy as np
+
+from jicbioimage.core.image import Image
+
+from plasmodesmata_analysis import (
+    SeriesStack,
+    segment3D,
+    filter_small,
+    filter_large,
+    filter_by_size,
+    size_categories,
+    annotate3D,
+    write_csv,
+    plasmodesmata_analysis,
+)
+from object_statistics import ObjectStatistics
+from preview import write_preview
+from sparse_objects import SparseObjects
+
+#: Shape (rows, columns, z-slices) of the z-stacks at each scale.
+SCALES = {
+    "small": (256, 256, 16),
+    "medium": (512, 512, 32),
+    "large": (1024, 1024, 32),
+}
+
+THRESHOLD = 15000
+MIN_VOXEL = 2
+MAX_VOXEL = 50
+
+#: Slowdowns shorter than this many seconds are treated as timing noise.
+RESOLUTION = 0.005
+
+
+def synthetic_stack(shape, spot_density=2e-4, spot_radius=1.0,
+                    spot_radius_sd=0.4, num_stomata=4, stomata_radius=12,
+                    seed=0):
+    """Return a synthetic 16-bit z-stack of a leaf.
+
+    :param shape: (rows, columns, z-slices) of the z-stack
+    :param spot_density: number of spots per voxel
+    :param spot_radius: mean radius of the spots in voxels
+    :param spot_radius_sd: standard deviation of the spot radius
+    :param num_stomata: number of large blobs
+    :param stomata_radius: radius of the large blobs in voxels
+    :param seed: seed of the random number generator
+    :returns: uint16 :class:`numpy.ndarray` with z as the last axis
+    """
+    random_state = np.random.RandomState(seed)
+    stack = random_state.normal(3000, 1000, shape)
+
+    num_spots = int(spot_density * np.prod(shape))
+    centres = [random_state.uniform(0, size, num_spots) for size in shape]
+    radii = np.clip(random_state.normal(spot_radius, spot_radius_sd,
+                                        num_spots), 0.5, None)
+    peaks = random_state.uniform(20000, 40000, num_spots)
+    blobs = zip(zip(*centres), radii, peaks)
+
+    centres = [random_state.uniform(0, size, num_stomata) for size in shape]
+    radii = np.ones(num_stomata) * stomata_radius
+    peaks = np.ones(num_stomata) * 30000
+    blobs = list(blobs) + list(zip(zip(*centres), radii, peaks))
+
+    for centre, radius, peak in blobs:
+        extent = int(np.ceil(2 * radius))
+        bounds = [(max(int(c) - extent, 0), min(int(c) + extent + 1, size))
+                  for c, size in zip(centre, shape)]
+        grid = np.ogrid[tuple(slice(lo, hi) for lo, hi in bounds)]
+        distance = sum((g - c) ** 2 for g, c in zip(grid, centre))
+        blob = peak * np.exp(-distance / (2. * radius ** 2))
+        region = tuple(slice(lo, hi) for lo, hi in bounds)
+        stack[region] = np.maximum(stack[region], blob)
+
+    return np.clip(stack, 0, 65535).astype(np.uint16)
+
+
+class ArrayProxyImage(object):
+    """Lightweight image in an :class:`ArrayCollection`."""
+
+    def __init__(self, array, zslice):
+        self.array = array
+        self.zslice = zslice
+
+    @property
+    def image(self):
+        return Image.from_array(self.array[:, :, self.zslice])
+
+
+class ArrayCollection(object):
+    """Microscopy collection with a single series held in memory."""
+
+    def __init__(self, array):
+        self.array = array
+
+    @property
+    def series(self):
+        return [0]
+
+    def zstack_proxy_iterator(self, s=0, c=0, t=0):
+        for z in range(self.array.shape[2]):
+            yield ArrayProxyImage(self.array, z)
+
+    def zstack_array(self, s=0, c=0, t=0):
+        return self.array
+
+
+def best_time(function, repeats):
+    """Return the shortest wall time of calling the function."""
+    times = []
+    for i in range(repeats):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def benchmark_scale(scale, shape, repeats, output_dir):
+    """Return list of result dictionaries of the stages at a scale."""
+    array = synthetic_stack(shape)
+    collection = ArrayCollection(array)
+    stack = SeriesStack(collection, 0)
+    segmentation = segment3D(stack, THRESHOLD)
+    kept, small, large = filter_by_size(segmentation, MIN_VOXEL, MAX_VOXEL)
+    num_objects = len(segmentation.identifiers)
+    objects = SparseObjects.from_labels(segmentation)
+    categories = size_categories(objects.statistics(array).voxel_counts(),
+                                 MIN_VOXEL, MAX_VOXEL)
+    csv_fpath = os.path.join(output_dir, "benchmark.csv")
+
+    def analysis():
+        plasmodesmata_analysis(collection, 0, THRESHOLD, MIN_VOXEL,
+                               MAX_VOXEL, output_dir)
+
+    stages = [
+        ("segment3D", lambda: segment3D(stack, THRESHOLD)),
+        ("segment3D_4threads", lambda: segment3D(stack, THRESHOLD, 4)),
+        ("segment3D_sigma", lambda: segment3D(
+            stack, THRESHOLD, local=("sigma", 25, 3.0))),
+        ("filter_small", lambda: filter_small(segmentation, MIN_VOXEL)),
+        ("filter_large", lambda: filter_large(segmentation, MAX_VOXEL)),
+        ("filter_by_size", lambda: filter_by_size(segmentation, MIN_VOXEL,
+                                                  MAX_VOXEL)),
+        ("statistics", lambda: ObjectStatistics.from_segmentation(
+            segmentation, array)),
+        ("write_csv", lambda: write_csv(kept, array, csv_fpath)),
+        ("annotate3D", lambda: annotate3D(
+            stack, [(kept, "plasmodesmata"), (small, "small_removed"),
+                    (large, "large_removed")], output_dir)),
+        ("write_preview", lambda: write_preview(
+            stack, objects, categories, output_dir)),
+        ("end_to_end", analysis),
+    ]
+
+    results = []
+    voxels = int(np.prod(shape))
+    for name, function in stages:
+        seconds = best_time(function, repeats)
+        results.append(dict(scale=scale, stage=name, seconds=seconds,
+                            voxels=voxels, objects=num_objects,
+                            voxels_per_second=voxels / seconds,
+                            objects_per_second=num_objects / seconds))
+    return results
+
+
+def environment():
+    """Return description of the machine and library versions."""
+    import scipy
+    return dict(python=platform.python_version(),
+                platform=platform.platform(),
+                processor=platform.processor(),
+                numpy=np.__version__,
+                scipy=scipy.__version__)
+
+
+def compare(results, baseline, tolerance):
+    """Return list of the results slower than the baseline.
+
+    :param tolerance: allowed fractional slowdown, e.g. 0.25
+    """
+    reference = dict(((r["scale"], r["stage"]), r["seconds"])
+                     for r in baseline["results"])
+    regressions = []
+    for result in results:
+        key = (result["scale"], result["stage"])
+        if key not in reference:
+            continue
+        result["baseline_seconds"] = reference[key]
+        slowdown = result["seconds"] - reference[key]
+        if (result["seconds"] > reference[key] * (1 + tolerance)
+                and slowdown > RESOLUTION):
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scales", default="small,medium",
+                        help="comma separated scales to run, from {} "
+                             "(default=small,medium)".format(
+                                 ",".join(sorted(SCALES))))
+    parser.add_argument("--repeats", default=3, type=int,
+                        help="number of times each stage is timed "
+                             "(default=3)")
+    parser.add_argument("--save", default=None,
+                        help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None,
+                        help="compare the results to this JSON file")
+    parser.add_argument("--tolerance", default=0.25, type=float,
+                        help="allowed fractional slowdown relative to the "
+                             "baseline (default=0.25)")
+    args = parser.parse_args()
+
+    scales = args.scales.split(",")
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error("Unknown scale: {}".format(scale))
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+
+    output_dir = tempfile.mkdtemp(prefix="plasmodesmata-benchmark-")
+    results = []
+    try:
+        for scale in scales:
+            results.extend(benchmark_scale(scale, SCALES[scale],
+                                           args.repeats, output_dir))
+    finally:
+        shutil.rmtree(output_dir)
+
+    regressions = []
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+
+    row = "{:<8} {:<18} {:>10} {:>14} {:>14} {:>10}"
+    print(row.format("scale", "stage", "seconds", "voxels/s", "objects/s",
+                     "baseline"))
+    for result in results:
+        reference = "-"
+        if "baseline_seconds" in result:
+            reference = "{:.3f}".format(result["baseline_seconds"])
+        print(row.format(result["scale"], result["stage"],
+                         "{:.3f}".format(result["seconds"]),
+                         "{:.3g}".format(result["voxels_per_second"]),
+                         "{:.3g}".format(result["objects_per_second"]),
+                         reference))
+
+    if args.save is not None:
+        with open(args.save, "w") as fh:
+            json.dump(dict(environment=environment(), results=results), fh,
+                      indent=2, sort_keys=True)
+
+    if regressions:
+        if baseline.get("environment") != environment():
+            print("Warning: the baseline was recorded in another "
+                  "environment")
+        for result in regressions:
+            print("Regression: {} {} took {:.3f}s, baseline {:.3f}s".format(
+                result["scale"], result["stage"], result["seconds"],
+                result["baseline_seconds"]))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
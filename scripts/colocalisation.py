@@ -0,0 +1,73 @@
+"""Co-localised intensity of the other channels in the objects of a channel.
+
+The voxels of the objects segmented in one channel are looked up in the
+intensity arrays of the other channels of the same series and time point.
+For each object and other channel the sum and mean of the other channel and
+the Pearson correlation between the two channels over the voxels of the
+object are computed, grouped by object in a single pass over the voxels.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _pearson(x, y, starts, counts):
+    """Return the correlation of x and y within each group of voxels."""
+    dx = x - np.repeat(np.add.reduceat(x, starts) / counts, counts)
+    dy = y - np.repeat(np.add.reduceat(y, starts) / counts, counts)
+    covariance = np.add.reduceat(dx * dy, starts)
+    variance = np.add.reduceat(dx * dx, starts) * np.add.reduceat(dy * dy,
+                                                                 starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return covariance / np.sqrt(variance)
+
+
+def colocalisation_table(objects, reference, others):
+    """Return the columns of the co-localised intensities of the objects.
+
+    The correlation is NaN for objects in which either channel is constant.
+
+    :param objects: :class:`sparse_objects.SparseObjects` of the segmented
+                    channel
+    :param reference: intensity array of the segmented channel
+    :param others: list of (channel, intensity array) tuples of the other
+                   channels
+    :returns: ordered dictionary of column arrays, one row per object in
+              identifier order
+    """
+    table = OrderedDict()
+    table["id"] = objects.identifiers
+    starts = objects.offsets[:-1]
+    counts = objects.voxel_counts()
+    x = np.asarray(reference).ravel()[objects.indices].astype(float)
+    for channel, intensity in others:
+        y = np.asarray(intensity).ravel()[objects.indices].astype(float)
+        if len(objects) > 0:
+            sums = np.add.reduceat(y, starts)
+            pearson = _pearson(x, y, starts, counts)
+        else:
+            sums = pearson = np.zeros(0)
+        table["c{}_sum".format(channel)] = sums
+        table["c{}_mean".format(channel)] = sums / counts
+        table["c{}_pearson".format(channel)] = pearson
+    return table
+
+
+def write_colocalisation_csv(table, keep, fname):
+    """Write out a csv file with the co-localised intensities.
+
+    :param table: columns returned by :func:`colocalisation_table`
+    :param keep: boolean array indexed by identifier
+    :param fname: output file name
+    """
+    flags = keep[table["id"]]
+    names = list(table.keys())
+    formats = ["{:d}"] + ["{:.0f}" if name.endswith("_sum") else "{:.4f}"
+                          for name in names[1:]]
+    with open(fname, "w") as fh:
+        fh.write("{}\n".format(",".join(names)))
+        columns = [table[name][flags].tolist() for name in names]
+        for values in zip(*columns):
+            fh.write("{}\n".format(",".join(
+                f.format(v) for f, v in zip(formats, values))))
@@ -0,0 +1,643 @@
+"""Inspect and prune the cache of converted microscopy files.
+
+Converted microscopy files are stored in a cache shared by all the analysis
+scripts. Entries are keyed by a hash of the content of the input file and the
+version of the converter, so that a changed input file or an upgraded
+bfconvert results in a new conversion.
+
+Entries are created in a temporary directory and published with an atomic
+rename. File locks ensure that concurrent runs do not convert the same file
+twice and that entries in use are not evicted. When a new entry takes the
+total size of the cache over a cap the least recently used entries are
+evicted.
+
+The cache directory defaults to data/cache in the project and can be set using
+the PLASMODESMATA_CACHE environment variable. The size cap can be set using
+the PLASMODESMATA_CACHE_SIZE environment variable, e.g. "200G".
+"""
+
+import os
+import os.path
+import re
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+try:
+    import fcntl
+except ImportError:
+    # File locking is not available on Windows.
+    fcntl = None
+
+from jicbioimage.core.image import MicroscopyCollection, MicroscopyImage
+from jicbioimage.core.io import BFConvertWrapper
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_DIRECTORY = os.path.abspath(os.path.join(HERE, "..", "data", "cache"))
+
+METADATA = "metadata.json"
+MANIFEST = "manifest.json"
+SERIES = "series.json"
+
+#: Names of the images written by bfconvert, see :func:`unpack`.
+IMAGE_FNAME = re.compile(r"^S(\d+)_C(\d+)_Z(\d+)_T(\d+)\.tif$")
+
+MICROMETRES_PER_UNIT = {u"nm": 1e-3, u"\u00b5m": 1., u"um": 1., u"mm": 1e3}
+LAST_USED = "last_used"
+SIZE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+_converter_version = None
+
+# Threads of this process converting or locking the same entry take turns.
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+_thread_locks_pid = os.getpid()
+
+
+def _thread_lock(lock_fpath):
+    """Return the lock taken by the threads of this process using an entry."""
+    global _thread_locks, _thread_locks_lock, _thread_locks_pid
+    if _thread_locks_pid != os.getpid():
+        # Locks held by other threads when this process was forked are never
+        # released in it.
+        _thread_locks = {}
+        _thread_locks_lock = threading.Lock()
+        _thread_locks_pid = os.getpid()
+    with _thread_locks_lock:
+        return _thread_locks.setdefault(lock_fpath, threading.Lock())
+
+
+def parse_size(size):
+    """Return number of bytes from a size such as "200G"."""
+    size = size.strip().upper()
+    if size and size[-1] in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[size[-1]])
+    return int(size)
+
+
+def format_size(num_bytes):
+    """Return human readable size."""
+    for suffix in ["", "K", "M", "G"]:
+        if num_bytes < 1024:
+            return "{:.1f}{}".format(num_bytes, suffix)
+        num_bytes = num_bytes / 1024.
+    return "{:.1f}T".format(num_bytes)
+
+
+def converter_version():
+    """Return the version reported by bfconvert."""
+    global _converter_version
+    if _converter_version is None:
+        try:
+            p = subprocess.Popen(["bfconvert", "-version"],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+            stdout, stderr = p.communicate()
+        except OSError as e:
+            msg = 'bfconvert tool not found in PATH\n{}'.format(e)
+            raise(RuntimeError(msg))
+        _converter_version = stdout.decode("utf-8", "replace").strip()
+    return _converter_version
+
+
+if hasattr(os, "replace"):
+    _replace = os.replace
+else:
+    def _replace(src, dst):
+        """Rename a file, replacing an existing destination also on Windows.
+        """
+        if os.name == "nt" and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def directory_size(directory):
+    """Return the total size of the files in a directory."""
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        for fname in files:
+            total += os.path.getsize(os.path.join(root, fname))
+    return total
+
+
+class _Lock(object):
+    """Advisory file lock, shared or exclusive."""
+
+    def __init__(self, fpath):
+        self.fh = open(fpath, "a")
+
+    def acquire(self, exclusive=True, blocking=True):
+        """Acquire the lock, returning False if it is held elsewhere."""
+        if fcntl is None:
+            return True
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            flags = flags | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self.fh, flags)
+        except IOError:
+            return False
+        return True
+
+    def release(self):
+        self.fh.close()
+
+
+class CacheEntry(object):
+    """Entry of the conversion cache, locked against eviction while in use.
+
+    The shared lock on the entry is released by :meth:`release`, at the end
+    of a with block, or when the entry is garbage collected. An unpickled
+    entry takes the lock again.
+
+    :param directory: path to the entry directory
+    :param lock_fpath: path to the lock file of the entry
+    :param lock: shared :class:`_Lock` on the entry
+    """
+
+    def __init__(self, directory, lock_fpath, lock):
+        self.directory = directory
+        self.lock_fpath = lock_fpath
+        self._lock = lock
+
+    def __enter__(self):
+        return self.directory
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def __getstate__(self):
+        return dict(directory=self.directory, lock_fpath=self.lock_fpath)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = _Lock(self.lock_fpath)
+        self._lock.acquire(exclusive=False)
+
+    def release(self):
+        """Release the lock on the entry."""
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
+
+
+class ConversionCache(object):
+    """Content addressed cache of converted microscopy files."""
+
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            directory = os.environ.get("PLASMODESMATA_CACHE",
+                                       DEFAULT_DIRECTORY)
+        if max_bytes is None and "PLASMODESMATA_CACHE_SIZE" in os.environ:
+            max_bytes = parse_size(os.environ["PLASMODESMATA_CACHE_SIZE"])
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock_dir = os.path.join(directory, ".locks")
+        for d in [self.directory, self.lock_dir]:
+            try:
+                os.makedirs(d)
+            except OSError:
+                if not os.path.isdir(d):
+                    raise
+
+    def _lock(self, name):
+        return _Lock(os.path.join(self.lock_dir, name + ".lock"))
+
+    def content_hash(self, fpath, blocksize=1024*1024):
+        """Return the md5 hex digest of a file.
+
+        Digests are remembered by path, size and modification time so that
+        unchanged files are only read once.
+        """
+        stat = os.stat(fpath)
+        memo_key = "{}:{}:{}".format(os.path.realpath(fpath), stat.st_size,
+                                     stat.st_mtime)
+        memo_fpath = os.path.join(self.directory, "hashes.json")
+        lock = self._lock("hashes")
+        lock.acquire(exclusive=False)
+        try:
+            memo = self._read_json(memo_fpath, {})
+        finally:
+            lock.release()
+        if memo_key in memo:
+            return memo[memo_key]
+
+        md5_hash = hashlib.md5()
+        with open(fpath, "rb") as fh:
+            buf = fh.read(blocksize)
+            while len(buf) > 0:
+                md5_hash.update(buf)
+                buf = fh.read(blocksize)
+        hexdigest = md5_hash.hexdigest()
+
+        lock = self._lock("hashes")
+        lock.acquire()
+        try:
+            memo = self._read_json(memo_fpath, {})
+            memo[memo_key] = hexdigest
+            self._write_json(memo_fpath, memo)
+        finally:
+            lock.release()
+        return hexdigest
+
+    @staticmethod
+    def _read_json(fpath, default):
+        if not os.path.isfile(fpath):
+            return default
+        with open(fpath) as fh:
+            return json.load(fh)
+
+    def _write_json(self, fpath, data):
+        """Write json file atomically."""
+        fd, tmp_fpath = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(data, fh)
+        _replace(tmp_fpath, fpath)
+
+    def _prune_hashes(self, entries):
+        """Forget the digests of files without an entry in the cache."""
+        memo_fpath = os.path.join(self.directory, "hashes.json")
+        digests = set(e.get("content_hash") for e in entries)
+        lock = self._lock("hashes")
+        lock.acquire()
+        try:
+            memo = self._read_json(memo_fpath, {})
+            pruned = dict((k, v) for k, v in memo.items() if v in digests)
+            if len(pruned) < len(memo):
+                self._write_json(memo_fpath, pruned)
+        finally:
+            lock.release()
+
+    def key(self, fpath, kind):
+        """Return the cache key of a conversion of the input file."""
+        version = converter_version()
+        key_hash = hashlib.md5()
+        for part in [self.content_hash(fpath), kind, version]:
+            key_hash.update(part.encode("utf-8"))
+        return key_hash.hexdigest()
+
+    def get(self, fpath, kind, convert):
+        """Return the entry of the converted input file.
+
+        The conversion is only run if the cache does not hold the entry yet.
+        The entry is locked against eviction until it is released, e.g.::
+
+            with cache.get(fpath, "unpacked", unpack) as entry_dir:
+                ...
+
+        The cache is only trimmed to its size cap when a new entry is added.
+
+        :param fpath: path to the input microscopy file
+        :param kind: name of the type of conversion
+        :param convert: function taking the input file and a directory to
+                        write the converted files to
+        :returns: :class:`CacheEntry`
+        """
+        key = self.key(fpath, kind)
+        entry_dir = os.path.join(self.directory, key)
+        lock_fpath = os.path.join(self.lock_dir, key + ".lock")
+        created = False
+        with _thread_lock(lock_fpath):
+            # An existing entry only needs a shared lock, so that processes
+            # using the same entry do not wait for each other.
+            lock = self._lock(key)
+            lock.acquire(exclusive=False)
+            if not os.path.isdir(entry_dir):
+                lock.release()
+                lock = self._lock(key)
+                lock.acquire()
+                try:
+                    if not os.path.isdir(entry_dir):
+                        self._create(fpath, kind, convert, entry_dir)
+                        created = True
+                except BaseException:
+                    lock.release()
+                    raise
+                # Downgrade to a shared lock held while the entry is in use.
+                lock.acquire(exclusive=False)
+            self._touch(entry_dir)
+        entry = CacheEntry(entry_dir, lock_fpath, lock)
+
+        if created and self.max_bytes is not None:
+            self.evict(self.max_bytes)
+        return entry
+
+    def _create(self, fpath, kind, convert, entry_dir):
+        """Convert the input file into a new entry."""
+        tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            convert(fpath, tmp_dir)
+            # The size of the converted files is recorded so that listing the
+            # entries does not need to walk them.
+            metadata = dict(source=os.path.abspath(fpath), kind=kind,
+                            converter=converter_version(),
+                            content_hash=self.content_hash(fpath),
+                            created=time.time(),
+                            size=directory_size(tmp_dir))
+            with open(os.path.join(tmp_dir, METADATA), "w") as fh:
+                json.dump(metadata, fh)
+            os.rename(tmp_dir, entry_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    @staticmethod
+    def _touch(entry_dir):
+        """Record the time the entry was last used."""
+        with open(os.path.join(entry_dir, LAST_USED), "w") as fh:
+            fh.write("{}\n".format(time.time()))
+
+    def entries(self):
+        """Return list of dictionaries describing the entries."""
+        entries = []
+        for key in os.listdir(self.directory):
+            if key.startswith("."):
+                continue
+            entry_dir = os.path.join(self.directory, key)
+            metadata_fpath = os.path.join(entry_dir, METADATA)
+            if not os.path.isfile(metadata_fpath):
+                continue
+            entry = self._read_json(metadata_fpath, {})
+            last_used_fpath = os.path.join(entry_dir, LAST_USED)
+            if os.path.isfile(last_used_fpath):
+                entry["last_used"] = os.path.getmtime(last_used_fpath)
+            else:
+                entry["last_used"] = entry.get("created", 0)
+            entry["key"] = key
+            if "size" not in entry:
+                entry["size"] = directory_size(entry_dir)
+            entries.append(entry)
+        return sorted(entries, key=lambda e: e["last_used"])
+
+    def remove(self, key):
+        """Remove an entry unless it is in use; return True if removed."""
+        lock = self._lock(key)
+        try:
+            if not lock.acquire(blocking=False):
+                return False
+            entry_dir = os.path.join(self.directory, key)
+            tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+            os.rename(entry_dir, os.path.join(tmp_dir, key))
+            shutil.rmtree(tmp_dir)
+            return True
+        finally:
+            lock.release()
+
+    def remove_stale_temporaries(self, max_age=24*60*60):
+        """Remove temporary directories left behind by interrupted runs."""
+        for name in os.listdir(self.directory):
+            fpath = os.path.join(self.directory, name)
+            if (name.startswith(".tmp-")
+                    and time.time() - os.path.getmtime(fpath) > max_age):
+                if os.path.isdir(fpath):
+                    shutil.rmtree(fpath, ignore_errors=True)
+                else:
+                    os.remove(fpath)
+
+    def evict(self, max_bytes):
+        """Evict least recently used entries until the cache fits max_bytes.
+
+        The remembered digests of the input files of the evicted entries are
+        forgotten.
+
+        :returns: list of the evicted entries
+        """
+        self.remove_stale_temporaries()
+        entries = self.entries()
+        total = sum(e["size"] for e in entries)
+        evicted = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            if self.remove(entry["key"]):
+                total -= entry["size"]
+                evicted.append(entry)
+        if evicted:
+            self._prune_hashes([e for e in entries if e not in evicted])
+        return evicted
+
+
+def unpack(input_file, output_dir, series=None, channel=None):
+    """Unpack a microscopy file into individual images with a manifest.
+
+    The filenames of the manifest are relative to the output directory, as
+    the cache renames the directory once the conversion is done, see
+    :func:`manifest_collection`.
+
+    :param series: only unpack this series
+    :param channel: only unpack this channel
+    """
+    wrapper = BFConvertWrapper(None)
+    cmd = wrapper.run_command(input_file, output_dir)
+    for option, value in [("-series", series), ("-channel", channel)]:
+        if value is not None:
+            cmd[1:1] = [option, str(value)]
+    try:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        stdout, stderr = p.communicate()
+    except OSError as e:
+        msg = 'bfconvert tool not found in PATH\n{}'.format(e)
+        raise(RuntimeError(msg))
+    if p.returncode != 0 or len(stderr) > 0:
+        raise(RuntimeError(stderr))
+    entries = []
+    for fname in sorted(os.listdir(output_dir)):
+        match = IMAGE_FNAME.match(fname)
+        if match is None:
+            continue
+        s, c, z, t = [int(n) for n in match.groups()]
+        # Label the images with the series and channel of the input file.
+        if series is not None:
+            s = series
+        if channel is not None:
+            c = channel
+        entries.append(dict(filename=fname, series=s, channel=c, zslice=z,
+                            timepoint=t))
+    # The z-stacks are read in the order of the manifest.
+    entries.sort(key=lambda e: (e["series"], e["channel"], e["timepoint"],
+                                e["zslice"]))
+    with open(os.path.join(output_dir, MANIFEST), "w") as fh:
+        json.dump(entries, fh)
+
+
+def unpack_series(series, channel):
+    """Return function unpacking a series and channel of a microscopy file.
+
+    The function can be passed to :meth:`ConversionCache.get`.
+    """
+    def convert(input_file, output_dir):
+        unpack(input_file, output_dir, series, channel)
+    return convert
+
+
+def ome_voxel_spacing(ome_xml):
+    """Return the voxel spacing of each image in OME-XML metadata.
+
+    :param ome_xml: OME-XML text
+    :returns: list with the (row, column, z) spacing in micrometres of each
+              image, or None for images without physical sizes
+    """
+    spacings = []
+    for pixels in re.findall(r"<(?:\w+:)?Pixels\b([^>]*)>", ome_xml):
+        attributes = dict(re.findall(r'(\w+)="([^"]*)"', pixels))
+        spacing = []
+        for axis in "YXZ":
+            size = attributes.get("PhysicalSize" + axis)
+            unit = attributes.get("PhysicalSize{}Unit".format(axis),
+                                  u"\u00b5m")
+            if size is None or unit not in MICROMETRES_PER_UNIT:
+                spacing = None
+                break
+            spacing.append(float(size) * MICROMETRES_PER_UNIT[unit])
+        spacings.append(tuple(spacing) if spacing is not None else None)
+    return spacings
+
+
+def describe(input_file, output_dir):
+    """Write the dimensions of the series of a microscopy file to a json file.
+
+    The dimensions are read with showinf, without reading the images. The
+    series.json file holds a list with the SizeZ, SizeC and SizeT and the
+    voxel spacing, see :func:`ome_voxel_spacing`, of each series.
+    """
+    cmd = ["showinf", "-nopix", "-no-upgrade", "-omexml", input_file]
+    try:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        stdout, stderr = p.communicate()
+    except OSError as e:
+        msg = 'showinf tool not found in PATH\n{}'.format(e)
+        raise(RuntimeError(msg))
+    if p.returncode != 0:
+        raise(RuntimeError(stderr))
+    text = stdout.decode("utf-8", "replace")
+    sizes = dict((d, [int(n) for n in re.findall(r"Size{} = (\d+)".format(d),
+                                                 text)])
+                 for d in "ZCT")
+    series = [dict(zip("ZCT", dims))
+              for dims in zip(sizes["Z"], sizes["C"], sizes["T"])]
+    spacings = ome_voxel_spacing(text)
+    for n, dims in enumerate(series):
+        dims["spacing"] = spacings[n] if n < len(spacings) else None
+    if not series:
+        raise(RuntimeError("No series found by showinf in {}".format(
+            input_file)))
+    with open(os.path.join(output_dir, SERIES), "w") as fh:
+        json.dump(series, fh)
+
+
+def manifest_collection(entry_dir):
+    """Return the microscopy collection of the manifest of a cache entry.
+
+    The filenames of the manifest are looked up in the entry directory.
+    """
+    collection = MicroscopyCollection()
+    with open(os.path.join(entry_dir, MANIFEST)) as fh:
+        for entry in json.load(fh):
+            fname = os.path.basename(entry.pop("filename"))
+            collection.append(MicroscopyImage(os.path.join(entry_dir, fname),
+                                              entry))
+    return collection
+
+
+def unpacked_collection(input_file, cache=None):
+    """Return microscopy collection unpacked into the conversion cache.
+
+    The :class:`CacheEntry` of the images is kept in the cache_entry
+    attribute of the collection, so that the images are not evicted while
+    the collection is in use.
+    """
+    if cache is None:
+        cache = ConversionCache()
+    entry = cache.get(input_file, "unpacked", unpack)
+    collection = manifest_collection(entry.directory)
+    collection.cache_entry = entry
+    return collection
+
+
+def convert_ahead(items, convert, converters=1, ahead=None):
+    """Yield (item, error) tuples, converting the items ahead of their use.
+
+    The conversions run on a pool of threads, each running a converter
+    subprocess, while the items already converted are being used. At most
+    ahead items are converted, or being converted, before they are used.
+
+    :param items: iterable of items passed to convert
+    :param convert: function converting an item, e.g. into the cache
+    :param converters: number of concurrent conversions
+    :param ahead: number of items converted ahead; defaults to converters
+    :returns: iterator of (item, exception or None) tuples in input order
+    """
+    if ahead is None:
+        ahead = converters
+    items = iter(items)
+    pool = ThreadPool(converters)
+    pending = deque()
+
+    def submit():
+        for item in items:
+            pending.append((item, pool.apply_async(convert, (item,))))
+            return
+
+    try:
+        for i in range(ahead):
+            submit()
+        while pending:
+            item, result = pending.popleft()
+            error = None
+            try:
+                result.get()
+            except Exception as e:
+                error = e
+            submit()
+            yield item, error
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cache-dir", default=None,
+                        help="cache directory (default={})".format(
+                            DEFAULT_DIRECTORY))
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("list", help="list the entries")
+    prune_parser = subparsers.add_parser(
+        "prune", help="evict least recently used entries")
+    prune_parser.add_argument("max_size",
+                              help="maximum cache size, e.g. 200G")
+    subparsers.add_parser("clear", help="remove all entries not in use")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("No command given")
+
+    cache = ConversionCache(args.cache_dir)
+    if args.command == "list":
+        entries = cache.entries()
+        for entry in entries:
+            last_used = time.strftime("%Y-%m-%d %H:%M",
+                                      time.localtime(entry["last_used"]))
+            print("{}  {:>8}  {}  {:<8}  {}".format(
+                entry["key"], format_size(entry["size"]), last_used,
+                entry.get("kind", ""), entry.get("source", "")))
+        print("Total: {}".format(
+            format_size(sum(e["size"] for e in entries))))
+    elif args.command == "prune":
+        for entry in cache.evict(parse_size(args.max_size)):
+            print("Evicted: {}".format(entry.get("source", entry["key"])))
+    elif args.command == "clear":
+        for entry in cache.evict(0):
+            print("Evicted: {}".format(entry.get("source", entry["key"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Journal of the (file, series) units of a batch run.
+
+The journal is a JSON lines file in the output directory of a run. Every
+change in the status of a unit is appended to it as a record holding the
+status, a fingerprint of the input file and the analysis parameters. The
+status of a unit is that of its last record.
+
+A unit is pending once the series of its file are known, running while it
+is being analysed and done or failed afterwards. When a run is restarted only
+the units that are not done, or that were done with another input file or
+other parameters, are analysed again.
+"""
+
+import os
+import os.path
+import json
+import time
+
+JOURNAL_FNAME = "journal.jsonl"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+LOADED = "loaded"
+
+#: Options of the analysis that do not change its output. The slab size is
+#: not one of them, as the slab-wise segmentation numbers the objects
+#: differently, see :mod:`streaming`.
+EXECUTION_OPTIONS = ["annotation_threads", "segmentation_threads"]
+
+
+def journal_parameters(threshold, min_voxel, max_voxel, options):
+    """Return the parameters determining the output of the analysis."""
+    parameters = dict(threshold=threshold, min_voxel=min_voxel,
+                      max_voxel=max_voxel)
+    for key, value in options.items():
+        if key not in EXECUTION_OPTIONS:
+            parameters[key] = value
+    # Round trip through json so that tuples compare equal to the lists read
+    # back from the journal.
+    return json.loads(json.dumps(parameters))
+
+
+def fingerprint(fpath):
+    """Return fingerprint of a file from its size and modification time."""
+    stat = os.stat(fpath)
+    return "{}:{}".format(stat.st_size, int(stat.st_mtime))
+
+
+class RunJournal(object):
+    """Journal of the status of the (file, series) units of a run.
+
+    The journal is only written to by the main process of a run.
+    """
+
+    def __init__(self, directory, parameters):
+        self.fpath = os.path.join(directory, JOURNAL_FNAME)
+        self.parameters = parameters
+        self.units = {}
+        self._fingerprints = {}
+        if os.path.isfile(self.fpath):
+            with open(self.fpath) as fh:
+                for line in fh:
+                    # Skip a line cut short by an interrupted run.
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.units[(record["file"], record["series"])] = record
+
+    def fingerprint(self, input_file):
+        """Return the fingerprint of the input file, computed once per run."""
+        if input_file not in self._fingerprints:
+            self._fingerprints[input_file] = fingerprint(input_file)
+        return self._fingerprints[input_file]
+
+    def refresh(self, input_file):
+        """Recompute the fingerprint of an input file that may have changed."""
+        self._fingerprints.pop(os.path.abspath(input_file), None)
+
+    def record(self, input_file, series, status, **data):
+        """Append the status of a unit to the journal.
+
+        :param series: series of the unit; None for the file as a whole
+        """
+        input_file = os.path.abspath(input_file)
+        record = dict(file=input_file, series=series, status=status,
+                      fingerprint=self.fingerprint(input_file),
+                      parameters=self.parameters, time=time.time())
+        record.update(data)
+        with open(self.fpath, "a") as fh:
+            fh.write("{}\n".format(json.dumps(record, sort_keys=True)))
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.units[(input_file, series)] = record
+
+    def is_current(self, input_file, series, status):
+        """Return True if the unit has the status for this input and run."""
+        input_file = os.path.abspath(input_file)
+        record = self.units.get((input_file, series))
+        return (record is not None
+                and record["status"] == status
+                and record["fingerprint"] == self.fingerprint(input_file)
+                and record["parameters"] == self.parameters)
+
+    def is_done(self, input_file, series):
+        """Return True if the unit is done with this input and parameters."""
+        return self.is_current(input_file, series, DONE)
+
+    def file_done(self, input_file):
+        """Return True if all the series of the input file are done."""
+        if not self.is_current(input_file, None, LOADED):
+            return False
+        record = self.units[(os.path.abspath(input_file), None)]
+        return all(self.is_done(input_file, s) for s in record["series_list"])
+
+    def start_file(self, input_file, series_list):
+        """Record the series of a loaded file as pending.
+
+        :returns: list of the series that are not done yet
+        """
+        self.record(input_file, None, LOADED, series_list=list(series_list))
+        todo = [s for s in series_list if not self.is_done(input_file, s)]
+        for s in todo:
+            self.record(input_file, s, PENDING)
+        return todo
@@ -0,0 +1,112 @@
+"""Microscopy collection unpacking each series and channel on demand.
+
+A drop-in replacement for a jicbioimage MicroscopyCollection of a whole
+microscopy file. The series of the file and their dimensions are read with
+showinf, without unpacking any images. A series and channel is only unpacked,
+into its own entry of the shared conversion cache, when its images are first
+used. Analysing a single series of a large multi-series file therefore only
+unpacks that series, and the analysis of the first series of a file can
+start before the others are unpacked.
+
+The cache entries of the unpacked series and channels are locked against
+eviction until the collection is released or garbage collected.
+"""
+
+import json
+import os.path
+
+from conversion_cache import (
+    SERIES,
+    ConversionCache,
+    describe,
+    manifest_collection,
+    unpack_series,
+)
+
+
+class LazyCollection(object):
+    """Collection of the images of a microscopy file, unpacked on demand.
+
+    :param input_file: path to the microscopy file
+    :param cache: :class:`conversion_cache.ConversionCache`
+    """
+
+    def __init__(self, input_file, cache=None):
+        if cache is None:
+            cache = ConversionCache()
+        self.input_file = input_file
+        self.cache = cache
+        with cache.get(input_file, "series", describe) as entry_dir:
+            with open(os.path.join(entry_dir, SERIES)) as fh:
+                self.dimensions = json.load(fh)
+        self._collections = {}
+        self._entries = {}
+
+    def __getstate__(self):
+        # The unpacked collections are looked up again after unpickling.
+        state = self.__dict__.copy()
+        state["_collections"] = {}
+        state["_entries"] = {}
+        return state
+
+    def release(self):
+        """Release the cache entries of the unpacked series and channels."""
+        for entry in self._entries.values():
+            entry.release()
+        self._entries = {}
+        self._collections = {}
+
+    def collection(self, s=0, c=0):
+        """Return the MicroscopyCollection of a series and channel.
+
+        The series and channel is unpacked into the cache on first use.
+        """
+        if (s, c) not in self._collections:
+            entry = self.cache.get(self.input_file,
+                                   "unpacked-s{}-c{}".format(s, c),
+                                   unpack_series(s, c))
+            self._entries[(s, c)] = entry
+            self._collections[(s, c)] = manifest_collection(entry.directory)
+        return self._collections[(s, c)]
+
+    @property
+    def series(self):
+        """Return list of series in the collection."""
+        return list(range(len(self.dimensions)))
+
+    def channels(self, s=0):
+        """Return list of channels of a series."""
+        return list(range(self.dimensions[s]["C"]))
+
+    def zslices(self, s=0):
+        """Return list of z-slices of a series."""
+        return list(range(self.dimensions[s]["Z"]))
+
+    def timepoints(self, s=0):
+        """Return list of time points of a series."""
+        return list(range(self.dimensions[s]["T"]))
+
+    def voxel_spacing(self, s=0):
+        """Return the (row, column, z) voxel spacing of a series in microns.
+
+        :returns: tuple, or None if the file does not record it
+        """
+        spacing = self.dimensions[s].get("spacing")
+        return tuple(spacing) if spacing is not None else None
+
+    def proxy_image(self, s=0, c=0, z=0, t=0):
+        """Return a :class:`jicbioimage.core.image.ProxyImage` instance."""
+        return self.collection(s, c).proxy_image(s=s, c=c, z=z, t=t)
+
+    def zstack_proxy_iterator(self, s=0, c=0, t=0):
+        """Return zstack :class:`jicbioimage.core.image.ProxyImage` iterator.
+        """
+        return self.collection(s, c).zstack_proxy_iterator(s=s, c=c, t=t)
+
+    def zstack_array(self, s=0, c=0, t=0):
+        """Return zstack as a :class:`numpy.ndarray`."""
+        return self.collection(s, c).zstack_array(s=s, c=c, t=t)
+
+    def image(self, s=0, c=0, z=0, t=0):
+        """Return image as a :class:`jicbioimage.core.image.Image`."""
+        return self.collection(s, c).image(s=s, c=c, z=z, t=t)
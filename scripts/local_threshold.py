@@ -0,0 +1,86 @@
+"""Thresholds corrected for the local background of each z-slice.
+
+An absolute threshold picks up background where the illumination of a tile
+is bright and loses dim spots where it is dark. The local methods compare
+each voxel with the background in a square window of its z-slice instead:
+
+``mean``
+    the intensity minus the mean of the window is above the threshold
+``tophat``
+    the intensity minus the grey opening of the window, the white top-hat,
+    is above the threshold
+``sigma``
+    the intensity is above the mean plus k standard deviations of the window,
+    and above the threshold
+
+The window means are computed with separable running box filters and the
+openings with separable running minimum and maximum filters, so that the
+cost grows linearly with the number of voxels whatever the window size. The
+z-slices are corrected one at a time, so that any slab of z-slices can be
+thresholded on its own.
+"""
+
+import numpy as np
+import scipy.ndimage as nd
+
+#: Segmentation methods; "abs" is the absolute threshold.
+METHODS = ["abs", "mean", "tophat", "sigma"]
+
+#: Default window width in pixels.
+WINDOW = 25
+
+#: Default number of standard deviations of the sigma method.
+K = 3.0
+
+
+def halo(local):
+    """Return the number of neighbouring rows a local threshold depends on.
+
+    :param local: (method, window, k) tuple, or None
+    """
+    if local is None or local[0] == "abs":
+        return 0
+    method, window, k = local
+    if method == "tophat":
+        # The opening is an erosion followed by a dilation.
+        return 2 * (window // 2)
+    return window // 2
+
+
+def _window_mean(image, window):
+    return nd.uniform_filter(image, size=window, mode="reflect")
+
+
+def _foreground2D(image, threshold, local):
+    method, window, k = local
+    image = np.asarray(image, dtype=float)
+    if method == "mean":
+        return image - _window_mean(image, window) > threshold
+    if method == "tophat":
+        background = nd.maximum_filter(nd.minimum_filter(image, size=window),
+                                       size=window)
+        return image - background > threshold
+    if method == "sigma":
+        mean = _window_mean(image, window)
+        variance = _window_mean(image * image, window) - mean * mean
+        sd = np.sqrt(np.maximum(variance, 0))
+        return np.logical_and(image > mean + k * sd, image > threshold)
+    raise(ValueError("Unknown threshold method: {}".format(method)))
+
+
+def foreground(intensity, threshold, local=None):
+    """Return boolean array of the voxels above the threshold.
+
+    :param intensity: 2D image or 3D array with z as the last axis
+    :param threshold: intensity cutoff
+    :param local: (method, window, k) tuple, or None for the absolute
+                  threshold
+    """
+    if local is None or local[0] == "abs":
+        return np.greater(intensity, threshold)
+    if intensity.ndim == 2:
+        return _foreground2D(intensity, threshold, local)
+    mask = np.zeros(intensity.shape, dtype=bool)
+    for z in range(intensity.shape[2]):
+        mask[:, :, z] = _foreground2D(intensity[:, :, z], threshold, local)
+    return mask
@@ -0,0 +1,95 @@
+"""Analyse several channels and time points of a series in one pass.
+
+The z-stacks of all the channels of a time point are read once and shared:
+each chosen channel is segmented, on a thread per channel, and the intensities
+of the other channels are measured in its objects, see :mod:`colocalisation`.
+The output of each channel and time point is written to a ``c<c>_t<t>``
+directory in the output directory of the series.
+"""
+
+import os
+import os.path
+from multiprocessing.pool import ThreadPool
+
+from plasmodesmata_analysis import SeriesStack, plasmodesmata_analysis
+from run_report import current_unit, stage, unit
+
+
+def channel_dirname(channel, timepoint):
+    """Return name of the output directory of a channel and time point."""
+    return "c{}_t{}".format(channel, timepoint)
+
+
+def _selection(selected, available):
+    if selected == "all":
+        return list(available)
+    missing = set(selected) - set(available)
+    if missing:
+        raise(ValueError("No such channel or time point: {}".format(
+            ", ".join(str(i) for i in sorted(missing)))))
+    return list(selected)
+
+
+def analyse_channels(microscopy_collection, series, threshold, min_voxel,
+                     max_voxel, output_dir, channels=None, timepoints=None,
+                     **options):
+    """Analyse the chosen channels and time points of a series.
+
+    Without channels and timepoints only channel 0 at time point 0 is
+    analysed, and the output is written to the output directory itself, as
+    by :func:`plasmodesmata_analysis.plasmodesmata_analysis`.
+
+    :param channels: list of the channels to segment, or "all"; by default
+                     channel 0
+    :param timepoints: list of the time points to analyse, or "all"; by
+                       default time point 0
+    :returns: list of (channel, timepoint, object table) tuples
+    """
+    if channels is None and timepoints is None:
+        table = plasmodesmata_analysis(microscopy_collection, series,
+                                       threshold, min_voxel, max_voxel,
+                                       output_dir, **options)
+        return [(0, 0, table)]
+    if options.get("slab_size"):
+        raise(ValueError("Co-localisation needs the z-stacks in memory"))
+
+    all_channels = microscopy_collection.channels(series)
+    channels = _selection(channels or [0], all_channels)
+    timepoints = _selection(timepoints or [0],
+                            microscopy_collection.timepoints(series))
+    context = current_unit()
+
+    def read(stack):
+        stack.array
+
+    results = []
+    pool = ThreadPool(len(all_channels))
+    try:
+        for t in timepoints:
+            stacks = dict((c, SeriesStack(microscopy_collection, series, c, t))
+                          for c in all_channels)
+            with unit(series=series, timepoint=t), stage("read_channels"):
+                pool.map(read, stacks.values())
+
+            def analyse(c):
+                sub_dir = os.path.join(output_dir, channel_dirname(c, t))
+                if not os.path.isdir(sub_dir):
+                    os.mkdir(sub_dir)
+                others = [(other, stacks[other].array)
+                          for other in all_channels if other != c]
+                # The records of the worker threads are tagged like those of
+                # the calling thread.
+                with unit(**context), unit(channel=c, timepoint=t):
+                    table = plasmodesmata_analysis(
+                        microscopy_collection, series, threshold, min_voxel,
+                        max_voxel, sub_dir, stack=stacks[c],
+                        colocalise=others, **options)
+                return c, t, table
+
+            results.extend(pool.map(analyse, channels))
+            for stack in stacks.values():
+                stack.release()
+    finally:
+        pool.close()
+        pool.join()
+    return results
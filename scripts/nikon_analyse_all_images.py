@@ -5,15 +5,20 @@ import os.path
 import argparse
 import logging
 import subprocess
-import json
-import errno
 
-import tifffile
-
-from jicbioimage.core.image import MicroscopyCollection
-
-from plasmodesmata_analysis import __version__
+from plasmodesmata_analysis import (
+    add_analysis_arguments,
+    analysis_options,
+    __version__
+)
 from analyse_all_series import analyse_all
+from batch import add_jobs_argument, analyse_files, images_to_analyse
+from run_report import add_report_file, stage, unit
+from journal import FAILED, RunJournal, journal_parameters
+from result_store import run_store
+from ome_tiff_collection import OmeTiffCollection
+from conversion_cache import ConversionCache, convert_ahead
+from service import add_service_argument, submit_files
 
 # Setup logging with a stream handler.
 logger = logging.getLogger(os.path.basename(__file__))
@@ -22,133 +27,119 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
 logger.addHandler(ch)
 
+OME_TIF_BASENAME = 'converted.ome.tif'
+
 
 def convert_to_ome_tiff(input_filename, output_filename):
     """Convert the given file to an OME-TIF file, using bfconvert. If bfconvert
-    is not available on the path, an error will be raised."""
+    is not available on the path, or fails to convert the file, an error will
+    be raised."""
 
     bfconvert = 'bfconvert'
 
     cmd = [bfconvert, input_filename, output_filename]
 
     try:
-        #p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-        #                     stderr=subprocess.PIPE)
-        #stderr = p.stderr.read()
-        subprocess.call(cmd)
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        stdout, stderr = p.communicate()
     except OSError as e:
         msg = 'bfconvert tool not found in PATH\n{}'.format(e)
         raise(RuntimeError(msg))
+    if p.returncode != 0:
+        msg = 'bfconvert failed to convert {} (exit code {})\n{}'.format(
+            input_filename, p.returncode, stderr.decode("utf-8", "replace"))
+        raise(RuntimeError(msg))
 
 
-def generate_manifest_entry(fpath, s, c, z, t):
-
-    entry = {"filename" : fpath,
-             "series" : s,
-             "channel": c,
-             "zslice" : z,
-             "timepoint" : t}
-
-    return entry
-
-
-def split_ome_tif(input_filename, output_path):
-    """Split an OME-TIF file into multiple individual images, then create a
-    manifest.json file such that these can be read as a jicbioimage
-    MicroscopyCollection."""
-
-    all_images_array = tifffile.imread(input_filename)
-
-    components = len(all_images_array.shape)
-
-    if components == 4:
-        zdim, cdim, xdim, ydim = all_images_array.shape
-    elif components == 3:
-        zdim, xdim, ydim = all_images_array.shape
-        cdim = 1
-    else:
-        raise(IndexError("Unexpected OME-TIF image dimensions"))
-
-    entries = []
-
-    s = 0
-    t = 0
-    for c in range(cdim):
-        for z in range(zdim):
-            filename_template = "S{}_C{}_Z{}_T{}.tif"
-            filename = filename_template.format(s, c, z, t)
-            fq_filename = os.path.join(output_path, filename)
-            entry = generate_manifest_entry(fq_filename, s, c, z, t)
-            entries.append(entry)
-            if components == 4:
-                image = all_images_array[z,c,:,:]
-            else:
-                image = all_images_array[z,:,:]
-            tifffile.imsave(fq_filename, image)
-
-    manifest_fpath = os.path.join(output_path, 'manifest.json')
-    with open(manifest_fpath, 'w') as fh:
-        json.dump(entries, fh)
-
-    return manifest_fpath
-
-
-def mkdir_p(path):
-    try:
-        os.makedirs(path)
-    except OSError as exc:
-        if exc.errno == errno.EEXIST:
-            pass
-        else:
-            raise
-
-
-def convert_and_split(input_filename, backend_path='data/tconv'):
-    """Convert the given bioimage file into a directory of TIF files with
-    accompanying manifest, suitable for loading into a jicbioimage
-    MicroscopyCollection object."""
-
-    fq_backend_path = os.path.join(os.getcwd(), backend_path)
-
-    basename = os.path.basename(input_filename)
-    sanified_basename = basename.replace(" ", "_")
-    fq_cache_path = os.path.join(fq_backend_path, sanified_basename)
-
-    mkdir_p(fq_cache_path)
-    ome_tif_basename = 'converted.ome.tif'
-    fq_output_filename = os.path.join(fq_cache_path, ome_tif_basename)
-
+def convert_into(input_filename, output_dir):
+    """Convert the given file to an OME-TIF file in the output directory."""
+    fq_output_filename = os.path.join(output_dir, OME_TIF_BASENAME)
+    convert_to_ome_tiff(input_filename, fq_output_filename)
     if not os.path.isfile(fq_output_filename):
-        convert_to_ome_tiff(input_filename, fq_output_filename)
-
-    return split_ome_tif(fq_output_filename, fq_cache_path)
-
-
-def analyse_dir(args):
-    """Analyse all images in an input directory."""
-    for fname in os.listdir(args.input_dir):
-        if not fname.lower().endswith(".nd2"):
-            continue
-        logger.info("Analysing image: {}".format(fname))
-
-        def get_dir_name(fname):
-            no_suffix_list = fname.split(".")[0:-1]
-            return ".".join(no_suffix_list)
-        dir_name = get_dir_name(fname)
-        specific_out_dir = os.path.join(args.output_dir, dir_name)
+        msg = 'bfconvert failed to convert {}'.format(input_filename)
+        raise(RuntimeError(msg))
 
-        # Skip analysis of image if output directory exists.
-        if os.path.isdir(specific_out_dir):
-            logger.info("Directory exists: {}".format(specific_out_dir))
-            logger.info("Skipping: {}".format(fname))
-            continue
-        os.mkdir(specific_out_dir)
 
-        fpath = os.path.join(args.input_dir, fname)
-        manifest_path = convert_and_split(fpath, 'nikon_backend')
-        microscopy_collection = MicroscopyCollection(manifest_path)
-        analyse_all(microscopy_collection, specific_out_dir, args.threshold,
-                    args.min_voxel, args.max_voxel)
+def convert(input_filename, cache=None):
+    """Convert the given bioimage file into an OME-TIF file in the shared
+    conversion cache, unless it has already been converted, and return the
+    :class:`conversion_cache.CacheEntry` holding it."""
+
+    if cache is None:
+        cache = ConversionCache()
+    return cache.get(input_filename, "ome-tiff", convert_into)
+
+
+def load_microscopy_collection(input_filename):
+    """Return microscopy collection from a Nikon input file.
+
+    The images are served from the memory-mapped OME-TIF file, without
+    splitting it into individual images."""
+    entry = convert(input_filename)
+    return OmeTiffCollection(os.path.join(entry.directory, OME_TIF_BASENAME),
+                             entry)
+
+
+def _convert_image(image):
+    with unit(file=image[0]), stage("convert"):
+        convert(image[0]).release()
+
+
+def analyse_dir(args, journal=None, store=None):
+    """Analyse all images in an input directory.
+
+    The status of the analysis of each image is recorded in a
+    :class:`journal.RunJournal`, by default one in the output directory.
+    Images that have already been analysed are skipped. The object tables
+    are appended to a :class:`result_store.ResultStore`, by default one in the
+    output directory, if requested.
+
+    The images are converted to OME-TIF by args.converters concurrent
+    bfconvert processes ahead of their analysis, or by the workers of the
+    analysis service as they load them if args.service is given.
+    """
+    options = analysis_options(args)
+    if journal is None:
+        journal = RunJournal(args.output_dir, journal_parameters(
+            args.threshold, args.min_voxel, args.max_voxel, options))
+    if store is None:
+        store = run_store(args.output_dir, options)
+    images = images_to_analyse(args.input_dir, args.output_dir, ".nd2",
+                               logger, journal)
+    if args.service is not None:
+        submit_files(args.service, images, args.threshold, args.min_voxel,
+                     args.max_voxel, logger, options, journal, store,
+                     load_collection=load_microscopy_collection)
+        return
+    converted = convert_ahead(images, _convert_image, args.converters)
+
+    # Images that failed to convert are logged and recorded as failed rather
+    # than aborting the run or being converted again.
+    def convertible():
+        for (fpath, specific_out_dir), error in converted:
+            if error is not None:
+                logger.error("Failed to convert {}: {}".format(fpath, error))
+                journal.record(fpath, None, FAILED)
+                continue
+            yield fpath, specific_out_dir
+
+    if args.jobs > 1:
+        analyse_files(convertible(), load_microscopy_collection,
+                      args.threshold, args.min_voxel, args.max_voxel,
+                      args.jobs, logger, options, journal, store)
+        return
+
+    for fpath, specific_out_dir in convertible():
+        logger.info("Analysing image: {}".format(os.path.basename(fpath)))
+        if not os.path.isdir(specific_out_dir):
+            os.mkdir(specific_out_dir)
+        with unit(file=fpath):
+            with stage("load"):
+                microscopy_collection = load_microscopy_collection(fpath)
+            analyse_all(microscopy_collection, specific_out_dir,
+                        args.threshold, args.min_voxel, args.max_voxel,
+                        journal, fpath, store, **options)
 
 
 def main():
@@ -162,6 +153,14 @@ def main():
                         help="Minimum voxel volume (default=2)")
     parser.add_argument("--max-voxel", default=50, type=int,
                         help="Maximum voxel volume (default=50)")
+    add_analysis_arguments(parser)
+    add_jobs_argument(parser)
+    add_service_argument(parser)
+    parser.add_argument("--converters", default=1, type=int,
+                        help="number of concurrent bfconvert processes "
+                             "converting images ahead of their analysis, "
+                             "unless run on the analysis service "
+                             "(default=1)")
     args = parser.parse_args()
 
     if not os.path.isdir(args.output_dir):
@@ -174,6 +173,7 @@ def main():
     formatter = logging.Formatter(format_)
     fh.setFormatter(formatter)
     logger.addHandler(fh)
+    add_report_file(args.output_dir)
 
     logger.info("Script version: {}".format(__version__))
     logger.info("Threshold: {}".format(args.threshold))
@@ -0,0 +1,159 @@
+"""Per-object voxel count and intensity statistics of segmentations."""
+
+import numpy as np
+import scipy.ndimage as nd
+
+from jicbioimage.core.util.color import pretty_color
+
+
+def _reduce_sorted(identifiers, voxels, sums, mins, maxs):
+    """Return the reductions of rows already sorted by identifier."""
+    if identifiers.size == 0:
+        empty = np.array([], dtype=int)
+        return identifiers, empty, empty, mins[:0], maxs[:0]
+    starts = np.flatnonzero(np.concatenate(
+        ([True], identifiers[1:] != identifiers[:-1])))
+    return (identifiers[starts],
+            np.add.reduceat(voxels, starts),
+            np.add.reduceat(sums, starts, dtype=np.int64),
+            np.minimum.reduceat(mins, starts),
+            np.maximum.reduceat(maxs, starts))
+
+
+def labelled_reductions(labels, values):
+    """Return identifiers, voxels, sum, min and max of every label.
+
+    The reductions are computed from a single sort of the foreground voxels.
+    The returned arrays are sorted by identifier.
+
+    :param labels: array of identifiers; zero represents the background
+    :param values: intensity array of the same shape as labels
+    :returns: tuple of arrays
+    """
+    labels = np.asarray(labels).ravel()
+    values = np.asarray(values).ravel()
+    foreground = labels != 0
+    labels = labels[foreground]
+    values = values[foreground]
+    order = np.argsort(labels, kind="mergesort")
+    labels = labels[order]
+    values = values[order]
+    ones = np.ones(labels.size, dtype=int)
+    return _reduce_sorted(labels, ones, values, values, values)
+
+
+def combine_reductions(identifiers, voxels, sums, mins, maxs):
+    """Return reductions with the rows of repeated identifiers combined."""
+    order = np.argsort(identifiers, kind="mergesort")
+    return _reduce_sorted(identifiers[order], voxels[order], sums[order],
+                          mins[order], maxs[order])
+
+
+def object_geometry(segmentation3D, identifiers):
+    """Return the centroids and bounding boxes of the objects.
+
+    :param segmentation3D: array of identifiers; zero represents the
+                           background
+    :param identifiers: array of the identifiers of the objects
+    :returns: (centroids, lower, upper) arrays of shape (n, 3); the bounding
+              box includes both the lower and the upper coordinates
+    """
+    labels = np.asarray(segmentation3D)
+    identifiers = np.asarray(identifiers, dtype=int)
+    coords = np.nonzero(labels)
+    foreground = labels[coords]
+    size = int(identifiers.max()) + 1 if identifiers.size > 0 else 1
+    counts = np.bincount(foreground, minlength=size)[identifiers]
+    centroids = np.zeros((len(identifiers), labels.ndim))
+    for axis, c in enumerate(coords):
+        sums = np.bincount(foreground, weights=c, minlength=size)
+        centroids[:, axis] = sums[identifiers] / counts
+
+    slices = nd.find_objects(labels)
+    lower = np.zeros((len(identifiers), labels.ndim), dtype=int)
+    upper = np.zeros((len(identifiers), labels.ndim), dtype=int)
+    for n, i in enumerate(identifiers.tolist()):
+        lower[n] = [s.start for s in slices[i - 1]]
+        upper[n] = [s.stop - 1 for s in slices[i - 1]]
+    return centroids, lower, upper
+
+
+class ObjectStatistics(object):
+    """Voxel count and intensity statistics of every object in a segmentation.
+
+    The statistics are stored in arrays sorted by identifier.
+    """
+
+    def __init__(self, identifiers, voxels, sum, min, max, background_voxels):
+        self.identifiers = identifiers
+        self.voxels = voxels
+        self.sum = sum
+        self.min = min
+        self.max = max
+        self.mean = sum / voxels.astype(float)
+        self.background_voxels = background_voxels
+
+    @classmethod
+    def from_segmentation(cls, segmentation3D, intensity):
+        """Return statistics from a single pass over the intensities.
+
+        :param segmentation3D: :class:`jicbioimage.core.image.SegmentedImage`
+        :param intensity: intensity array of the same shape
+        :returns: :class:`ObjectStatistics`
+        """
+        reductions = labelled_reductions(segmentation3D, intensity)
+        background_voxels = np.asarray(segmentation3D).size - np.sum(
+            reductions[1])
+        return cls(*reductions, background_voxels=background_voxels)
+
+    def voxel_counts(self):
+        """Return array with the number of voxels of each identifier.
+
+        The array is indexed by identifier, with the background at index 0.
+        """
+        size = 1
+        if self.identifiers.size > 0:
+            size = int(self.identifiers[-1]) + 1
+        counts = np.zeros(size, dtype=int)
+        counts[self.identifiers] = self.voxels
+        counts[0] = self.background_voxels
+        return counts
+
+    def identifier_order(self, keep):
+        """Return the identifiers flagged in keep in segmentation order.
+
+        The order matches that of iterating over the
+        :attr:`jicbioimage.core.image.SegmentedImage.identifiers` of the
+        segmentation with only the kept identifiers.
+        """
+        flags = keep[self.identifiers]
+        unique = self.identifiers[flags].tolist()
+        if self.background_voxels > 0 or not np.all(flags):
+            unique.insert(0, 0)
+        return set(unique) - set([0])
+
+    def rows(self, keep):
+        """Yield dictionaries with the statistics of the kept objects."""
+        columns = [self.voxels.tolist(), self.sum.tolist(),
+                   self.min.tolist(), self.max.tolist(), self.mean.tolist()]
+        index = dict((i, n) for n, i in enumerate(self.identifiers.tolist()))
+        for i in self.identifier_order(keep):
+            n = index[i]
+            yield dict(id=i, rgb=str(pretty_color(i)), voxels=columns[0][n],
+                       sum=int(columns[1][n]), min=int(columns[2][n]),
+                       max=int(columns[3][n]), mean=float(columns[4][n]))
+
+
+def write_statistics_csv(statistics, keep, fname):
+    """Write out a csv file with the statistics of the kept objects.
+
+    :param statistics: :class:`ObjectStatistics`
+    :param keep: boolean array indexed by identifier
+    :param fname: output file name
+    """
+    header = ["id", "rgb", "voxels", "sum", "min", "max", "mean"]
+    row = '{id:d},"{rgb}",{voxels:d},{sum:d},{min:d},{max:d},{mean:.3f}\n'
+    with open(fname, "w") as fh:
+        fh.write("{}\n".format(",".join(header)))
+        for data in statistics.rows(keep):
+            fh.write(row.format(**data))
@@ -0,0 +1,166 @@
+"""Microscopy collection served directly from a memory-mapped OME-TIF file.
+
+A drop-in replacement for a jicbioimage MicroscopyCollection built from a
+manifest of split images. The images are read from the pages of the OME-TIF
+file on demand, so that the file does not need to be split into individual
+images first.
+
+bfconvert writes the directory of each page next to its image data, so the
+images are not one contiguous block. Each uncompressed page is instead
+memory-mapped at its own data offset; other pages, e.g. compressed ones, are
+read with tifffile when they are used.
+"""
+
+import numpy as np
+import tifffile
+
+from jicbioimage.core.image import Image
+
+from conversion_cache import ome_voxel_spacing
+
+
+def page_layout(page, byteorder):
+    """Return the location of the image data of a TIFF page in its file.
+
+    :param page: :class:`tifffile.TiffPage` or :class:`tifffile.TiffFrame`
+    :param byteorder: byte order of the file, "<" or ">"
+    :returns: (offset, dtype, shape) tuple, or None unless the image data is
+              uncompressed and stored in one block
+    """
+    # The pages after the first of a series may be read as frames, which
+    # share the compression, data type and shape of a key page.
+    keyframe = getattr(page, "keyframe", None) or page
+    if int(keyframe.compression) != 1 or keyframe.is_tiled:
+        return None
+    offsets = list(page.dataoffsets)
+    counts = list(page.databytecounts)
+    for offset, count, following in zip(offsets, counts, offsets[1:]):
+        if offset + count != following:
+            return None
+    dtype = np.dtype(keyframe.dtype).newbyteorder(byteorder)
+    shape = tuple(keyframe.shape)
+    if sum(counts) < dtype.itemsize * int(np.prod(shape)):
+        return None
+    return offsets[0], dtype.str, shape
+
+
+class OmeTiffProxyImage(object):
+    """Lightweight image in an :class:`OmeTiffCollection`."""
+
+    def __init__(self, collection, series, channel, zslice, timepoint):
+        self.collection = collection
+        self.series = series
+        self.channel = channel
+        self.zslice = zslice
+        self.timepoint = timepoint
+
+    def __repr__(self):
+        template = "<OmeTiffProxyImage(s={}, c={}, z={}, t={}) object at {}>"
+        return template.format(
+            self.series,
+            self.channel,
+            self.zslice,
+            self.timepoint,
+            hex(id(self)))
+
+    @property
+    def image(self):
+        """Underlying :class:`jicbioimage.core.image.Image` instance."""
+        return Image.from_array(self.collection.plane(self.channel,
+                                                      self.zslice))
+
+
+class OmeTiffCollection(object):
+    """Collection of the images in an OME-TIF file.
+
+    The OME-TIF file is expected to hold a single series and time point with
+    the images ordered by z-slice and channel, as written by bfconvert. The
+    images of uncompressed pages are memory-mapped, see :func:`page_layout`.
+
+    :param fpath: path to the OME-TIF file
+    :param cache_entry: :class:`conversion_cache.CacheEntry` holding the
+                        file, kept locked against eviction while the
+                        collection is in use
+    """
+
+    def __init__(self, fpath, cache_entry=None):
+        self.fpath = fpath
+        self.cache_entry = cache_entry
+        self._data = None
+        with tifffile.TiffFile(fpath) as tif:
+            shape = tif.series[0].shape
+            page = tif.pages[0]
+            description = (getattr(page, "description", None)
+                           or getattr(page, "image_description", b""))
+            self.layouts = [page_layout(p, tif.byteorder) for p in tif.pages]
+        if isinstance(description, bytes):
+            description = description.decode("utf-8", "replace")
+        spacings = ome_voxel_spacing(description)
+        self.spacing = spacings[0] if spacings else None
+        if len(shape) == 4:
+            self.zdim, self.cdim = shape[:2]
+        elif len(shape) == 3:
+            self.zdim, self.cdim = shape[0], 1
+        else:
+            raise(IndexError("Unexpected OME-TIF image dimensions"))
+
+    def __getstate__(self):
+        # The memory-map is re-opened after unpickling.
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    @property
+    def data(self):
+        """Memory-mapped bytes of the whole OME-TIF file."""
+        if self._data is None:
+            self._data = np.memmap(self.fpath, dtype=np.uint8, mode="r")
+        return self._data
+
+    def plane(self, c=0, z=0):
+        """Return the 2D image of the channel and z-slice as an array."""
+        n = z * self.cdim + c
+        layout = self.layouts[n]
+        if layout is None:
+            return tifffile.imread(self.fpath, key=n)
+        offset, dtype, shape = layout
+        array = np.ndarray(shape, dtype, buffer=self.data, offset=offset)
+        return array.astype(array.dtype.newbyteorder("="))
+
+    @property
+    def series(self):
+        """Return list of series in the collection."""
+        return [0]
+
+    def channels(self, s=0):
+        """Return list of channels in the collection."""
+        return list(range(self.cdim))
+
+    def zslices(self, s=0):
+        """Return list of z-slices in the collection."""
+        return list(range(self.zdim))
+
+    def timepoints(self, s=0):
+        """Return list of time points in the collection."""
+        return [0]
+
+    def voxel_spacing(self, s=0):
+        """Return the (row, column, z) voxel spacing in microns, or None."""
+        return self.spacing
+
+    def proxy_image(self, s=0, c=0, z=0, t=0):
+        """Return a :class:`OmeTiffProxyImage` instance."""
+        return OmeTiffProxyImage(self, s, c, z, t)
+
+    def zstack_proxy_iterator(self, s=0, c=0, t=0):
+        """Return zstack :class:`OmeTiffProxyImage` iterator."""
+        for z in range(self.zdim):
+            yield self.proxy_image(s=s, c=c, z=z, t=t)
+
+    def zstack_array(self, s=0, c=0, t=0):
+        """Return zstack as a :class:`numpy.ndarray`."""
+        return np.dstack([self.plane(c, z) for z in range(self.zdim)])
+
+    def image(self, s=0, c=0, z=0, t=0):
+        """Return image as a :class:`jicbioimage.core.image.Image`."""
+        return self.proxy_image(s=s, c=c, z=z, t=t).image
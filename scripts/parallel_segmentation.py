@@ -0,0 +1,133 @@
+"""Multi-threaded thresholding and labelling of z-stacks held in memory.
+
+The z-stack is split into chunks of consecutive rows, which are contiguous in
+memory. The chunks are thresholded and labelled concurrently on a pool of
+threads; both steps run in NumPy and SciPy code that releases the GIL. Objects
+that touch across the seam between two chunks are then joined using a
+union-find over the labels of the seam faces, as in :mod:`streaming`.
+
+The identifiers are numbered in the order of the first voxel of each object,
+as when labelling the whole stack at once with :func:`scipy.ndimage.label`.
+:func:`connected_components_numbering` renumbers them as
+:func:`jicbioimage.segment.connected_components` does with the installed
+scikit-image. With a local threshold, see :mod:`local_threshold`, each chunk
+is thresholded with enough rows of its neighbours for the window of the
+threshold, so that the foreground is the same as that of the whole stack.
+"""
+
+import re
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import scipy.ndimage as nd
+import skimage
+
+from local_threshold import foreground, halo
+from streaming import STRUCTURE, UnionFind, boundary_pairs
+
+
+def _version(version_string):
+    """Return (major, minor) tuple of integers of a version string."""
+    return tuple(int(n) for n in re.findall(r"\d+", version_string)[:2])
+
+
+#: Before scikit-image 0.12 :func:`skimage.measure.label` numbered the
+#: objects from zero and labelled the background -1;
+#: :func:`jicbioimage.segment.connected_components` then gives the first
+#: object the identifier after the last one.
+FIRST_OBJECT_LAST = _version(skimage.__version__) < (0, 12)
+
+
+def connected_components_numbering(labels, first_object_last=None):
+    """Renumber labels in place as connected_components numbers them.
+
+    :param labels: array of labels numbered from one in the order of the
+                   first voxel of each object, as by
+                   :func:`scipy.ndimage.label`; zero represents the
+                   background
+    :param first_object_last: whether to number the objects as with
+                              scikit-image before 0.12; None for the
+                              installed version
+    :returns: the labels
+    """
+    if first_object_last is None:
+        first_object_last = FIRST_OBJECT_LAST
+    num = int(labels.max()) if labels.size else 0
+    if not first_object_last or num == 0:
+        return labels
+    lookup = np.arange(-1, num, dtype=labels.dtype)
+    if not labels.all():
+        # The background is labelled zero and the first object comes last.
+        lookup[0] = 0
+        lookup[1] = num
+    # Without any background the first object is labelled zero, i.e. it
+    # becomes the background, as in connected_components.
+    np.take(lookup, labels, out=labels)
+    return labels
+
+
+def chunk_bounds(size, num_chunks):
+    """Return list of (start, stop) tuples splitting range(size) evenly."""
+    edges = np.linspace(0, size, min(num_chunks, size) + 1).astype(int)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def parallel_label(intensity, threshold, threads, local=None):
+    """Return the labels of the voxels above the threshold.
+
+    :param intensity: 3D array
+    :param threshold: intensity cutoff
+    :param threads: number of threads, and of chunks of rows
+    :param local: (method, window, k) tuple of a local threshold, or None
+                  for the absolute threshold
+    :returns: int32 array of labels; zero represents the background
+    """
+    if threads < 2:
+        labels, num = nd.label(foreground(intensity, threshold, local),
+                               structure=STRUCTURE, output=np.int32)
+        return labels
+
+    labels = np.zeros(intensity.shape, dtype=np.int32)
+    bounds = chunk_bounds(intensity.shape[0], threads)
+
+    def label_chunk(chunk):
+        start, stop = chunk
+        margin = halo(local)
+        lower = max(start - margin, 0)
+        upper = min(stop + margin, intensity.shape[0])
+        mask = foreground(intensity[lower:upper], threshold, local)
+        mask = mask[start - lower:stop - lower]
+        return nd.label(mask, structure=STRUCTURE,
+                        output=labels[start:stop])
+
+    def offset_chunk(args):
+        (start, stop), offset = args
+        chunk = labels[start:stop]
+        np.add(chunk, offset, out=chunk, where=chunk != 0)
+
+    def relabel_chunk(args):
+        (start, stop), lookup = args
+        chunk = labels[start:stop]
+        np.take(lookup, chunk, out=chunk)
+
+    pool = ThreadPool(threads)
+    try:
+        nums = pool.map(label_chunk, bounds)
+        offsets = np.cumsum([0] + nums).tolist()
+        pool.map(offset_chunk, zip(bounds[1:], offsets[1:-1]))
+
+        # Join the objects touching across the seams between the chunks.
+        union_find = UnionFind(offsets[-1] + 1)
+        for (start, stop) in bounds[1:]:
+            for a, b in boundary_pairs(labels[start - 1], labels[start]):
+                union_find.union(int(a), int(b))
+        roots = union_find.roots()
+        unique_roots, compact = np.unique(roots[1:], return_inverse=True)
+        if len(unique_roots) != offsets[-1]:
+            lookup = np.zeros(offsets[-1] + 1, dtype=np.int32)
+            lookup[1:] = compact + 1
+            pool.map(relabel_chunk, [(b, lookup) for b in bounds])
+    finally:
+        pool.close()
+        pool.join()
+    return labels
@@ -0,0 +1,162 @@
+"""Summarise the segmentation for many thresholds and voxel size bounds.
+
+The objects at all the thresholds of the sweep are computed from a single
+labelling of the z-stack. The voxels above the lowest threshold are sorted by
+decreasing intensity and added to the labelling one threshold at a time, in
+the manner of a component tree. At each threshold only the newly added voxels
+are joined with their neighbours; the objects of the previous threshold are
+merged rather than labelled again from scratch.
+
+The voxel size bounds are then applied to the table of object sizes of each
+threshold, so that every combination of parameters is summarised without
+segmenting the z-stack again.
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from object_statistics import ObjectStatistics, combine_reductions
+from streaming import STRUCTURE
+
+#: Offsets of the neighbours of a voxel in the connectivity of the labelling.
+NEIGHBOUR_OFFSETS = [tuple(offset) for offset in np.argwhere(STRUCTURE) - 1
+                     if np.any(offset != 0)]
+
+SWEEP_HEADER = ["threshold", "min_voxel", "max_voxel", "plasmodesmata",
+                "small_removed", "large_removed", "voxels", "mean_voxels",
+                "mean_intensity", "max_intensity"]
+
+
+def _neighbour_edges(flat_labels, flat_offsets, voxels):
+    """Return the labels of the voxels and of their labelled neighbours."""
+    sources = []
+    targets = []
+    for flat_offset in flat_offsets:
+        neighbour_labels = flat_labels[voxels + flat_offset]
+        labelled = neighbour_labels != 0
+        sources.append(flat_labels[voxels[labelled]])
+        targets.append(neighbour_labels[labelled])
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def threshold_statistics(intensity, thresholds):
+    """Yield the object statistics at each threshold, highest first.
+
+    The objects are those of thresholding the intensities with each absolute
+    cutoff and labelling the connected components, as done by
+    :func:`plasmodesmata_analysis.segment3D`, up to a permutation of the
+    identifiers.
+
+    :param intensity: 3D intensity array
+    :param thresholds: list of absolute intensity cutoffs
+    :returns: iterator of (threshold, :class:`ObjectStatistics`) tuples
+    """
+    intensity = np.asarray(intensity)
+    thresholds = sorted(set(thresholds), reverse=True)
+    flat_intensity = intensity.ravel()
+
+    # Voxels above the lowest threshold in order of decreasing intensity.
+    voxels = np.flatnonzero(flat_intensity > thresholds[-1])
+    order = np.argsort(flat_intensity[voxels], kind="mergesort")[::-1]
+    voxels = voxels[order]
+    values = flat_intensity[voxels]
+
+    # The labels are padded with background, so that the neighbours of a
+    # voxel are at fixed offsets in the flattened array.
+    padded_shape = tuple(size + 2 for size in intensity.shape)
+    voxels = np.ravel_multi_index(
+        [c + 1 for c in np.unravel_index(voxels, intensity.shape)],
+        padded_shape)
+    strides = np.cumprod((1,) + padded_shape[:0:-1])[::-1]
+    flat_offsets = [int(np.dot(offset, strides))
+                    for offset in NEIGHBOUR_OFFSETS]
+    flat_labels = np.zeros(np.prod(padded_shape), dtype=np.int32)
+    empty = np.array([], dtype=int)
+    reductions = (empty, empty, empty, values[:0], values[:0])
+    num_objects = 0
+    added = 0
+    for threshold in thresholds:
+        stop = added + np.count_nonzero(values[added:] > threshold)
+        new_voxels = voxels[added:stop]
+        new_values = values[added:stop]
+        num_nodes = num_objects + len(new_voxels) + 1
+        flat_labels[new_voxels] = np.arange(num_objects + 1, num_nodes)
+
+        # Merge the new voxels with each other and with the existing objects.
+        sources, targets = _neighbour_edges(flat_labels, flat_offsets,
+                                            new_voxels)
+        graph = coo_matrix((np.ones(len(sources), dtype=np.int8),
+                            (sources, targets)), shape=(num_nodes, num_nodes))
+        _, components = connected_components(graph, directed=False)
+        unique_components, compact = np.unique(components[1:],
+                                               return_inverse=True)
+        lookup = np.zeros(num_nodes, dtype=np.int32)
+        lookup[1:] = compact + 1
+        flat_labels[voxels[:stop]] = lookup[flat_labels[voxels[:stop]]]
+
+        ones = np.ones(len(new_voxels), dtype=int)
+        identifiers, counts, sums, mins, maxs = [
+            np.concatenate(pair) for pair in zip(
+                reductions,
+                (np.arange(num_objects + 1, num_nodes), ones, new_values,
+                 new_values, new_values))]
+        reductions = combine_reductions(lookup[identifiers], counts, sums,
+                                        mins, maxs)
+        num_objects = len(unique_components)
+        added = stop
+        yield threshold, ObjectStatistics(
+            *reductions, background_voxels=intensity.size - stop)
+
+
+def sweep_rows(intensity, thresholds, min_voxels, max_voxels):
+    """Yield dictionaries summarising each combination of parameters.
+
+    :param intensity: 3D intensity array
+    :param thresholds: list of absolute intensity cutoffs
+    :param min_voxels: list of minimum voxel volumes
+    :param max_voxels: list of maximum voxel volumes
+    """
+    for threshold, statistics in threshold_statistics(intensity, thresholds):
+        for min_voxel in sorted(set(min_voxels)):
+            for max_voxel in sorted(set(max_voxels)):
+                # Same categories as plasmodesmata_analysis.size_categories.
+                small = statistics.voxels < min_voxel
+                large = np.logical_and(statistics.voxels > max_voxel,
+                                       np.logical_not(small))
+                kept = np.logical_not(np.logical_or(small, large))
+                num_kept = int(np.sum(kept))
+                voxels = int(np.sum(statistics.voxels[kept]))
+                mean_voxels = 0.
+                mean_intensity = 0.
+                max_intensity = 0
+                if num_kept > 0:
+                    mean_voxels = voxels / float(num_kept)
+                    mean_intensity = np.sum(statistics.sum[kept]) / float(
+                        voxels)
+                    max_intensity = int(np.max(statistics.max[kept]))
+                yield dict(threshold=threshold, min_voxel=min_voxel,
+                           max_voxel=max_voxel, plasmodesmata=num_kept,
+                           small_removed=int(np.sum(small)),
+                           large_removed=int(np.sum(large)), voxels=voxels,
+                           mean_voxels=mean_voxels,
+                           mean_intensity=mean_intensity,
+                           max_intensity=max_intensity)
+
+
+def write_sweep_csv(intensity, thresholds, min_voxels, max_voxels, fname):
+    """Write out a csv file summarising each combination of parameters.
+
+    The rows are ordered by increasing threshold, minimum and maximum voxel
+    volume.
+    """
+    rows = sorted(sweep_rows(intensity, thresholds, min_voxels, max_voxels),
+                  key=lambda r: (r["threshold"], r["min_voxel"],
+                                 r["max_voxel"]))
+    row = ("{threshold:d},{min_voxel:d},{max_voxel:d},{plasmodesmata:d},"
+           "{small_removed:d},{large_removed:d},{voxels:d},"
+           "{mean_voxels:.3f},{mean_intensity:.3f},{max_intensity:d}\n")
+    with open(fname, "w") as fh:
+        fh.write("{}\n".format(",".join(SWEEP_HEADER)))
+        for data in rows:
+            fh.write(row.format(**data))
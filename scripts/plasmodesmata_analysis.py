@@ -11,38 +11,108 @@ are filtered out based on a maximum allowed voxel size.
 """
 
 import os.path
+import logging
 import argparse
 import warnings
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
+import scipy.ndimage as nd
 
 from jicbioimage.core.transform import transformation
-from jicbioimage.core.io import DataManager, FileBackend, AutoName, AutoWrite
+from jicbioimage.core.io import AutoWrite
 from jicbioimage.core.util.array import normalise
 from jicbioimage.core.util.color import pretty_color
 from jicbioimage.segment import SegmentedImage, connected_components
-from jicbioimage.illustrate import AnnotatedImage
+
+from colocalisation import colocalisation_table, write_colocalisation_csv
+from lazy_collection import LazyCollection
+from local_threshold import METHODS, WINDOW, K, foreground
+from object_statistics import ObjectStatistics, write_statistics_csv
+from parallel_segmentation import (
+    connected_components_numbering,
+    parallel_label,
+)
+from parameter_sweep import write_sweep_csv
+from preview import write_preview
+from run_report import stage, unit
+from sparse_objects import SparseObjects
+from spatial_index import (
+    INDEX_FNAME,
+    SpatialIndex,
+    spatial_table,
+    write_spatial_csv,
+)
+from result_store import (
+    RESULTS_FNAME,
+    object_table as make_object_table,
+    run_store,
+)
+from streaming import CollectionSlabReader, segment_slabs
 
 
 __version__ = "0.7.3"
 
 AutoWrite.on = False
-HERE = os.path.dirname(os.path.realpath(__file__))
+CROSS = nd.generate_binary_structure(2, 1)
 
 # Suppress spurious scikit-image warnings.
 warnings.filterwarnings("ignore", module="skimage.io._io")
 
 
 def get_microscopy_collection(input_file):
-    """Return microscopy collection from input file."""
-    data_dir = os.path.abspath(os.path.join(HERE, "..", "data"))
-    if not os.path.isdir(data_dir):
-        os.mkdir(data_dir)
-    backend_dir = os.path.join(data_dir, 'unpacked')
-    file_backend = FileBackend(backend_dir)
-    data_manager = DataManager(file_backend)
-    microscopy_collection = data_manager.load(input_file)
-    return microscopy_collection
+    """Return microscopy collection from input file.
+
+    Each series and channel of the input file is unpacked into the shared
+    conversion cache when it is first used, see :mod:`lazy_collection`.
+    """
+    return LazyCollection(input_file)
+
+
+class SeriesStack(object):
+    """Intensity z-stack of a series shared by all stages of the analysis.
+
+    The z-stack is read from the microscopy collection on first access and
+    kept in memory until :meth:`release` is called.
+    """
+
+    def __init__(self, microscopy_collection, series, channel=0, timepoint=0):
+        self.microscopy_collection = microscopy_collection
+        self.series = series
+        self.channel = channel
+        self.timepoint = timepoint
+        self._array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.release()
+
+    @property
+    def array(self):
+        """Z-stack as a :class:`numpy.ndarray` with z as the last axis."""
+        if self._array is None:
+            self._array = self.microscopy_collection.zstack_array(
+                s=self.series, c=self.channel, t=self.timepoint)
+        return self._array
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def zslices(self):
+        """Return list of z-slice indices."""
+        return list(range(self.shape[2]))
+
+    def zslice(self, z):
+        """Return the 2D image of the z-slice."""
+        return self.array[:, :, z]
+
+    def release(self):
+        """Free the memory held by the z-stack."""
+        self._array = None
 
 
 @transformation
@@ -51,114 +121,510 @@ def threshold_abs(image, threshold):
     return image > threshold
 
 
-def segment3D(microscopy_collection, series, threshold):
-    """Return segmented plasmodesmata in 3D."""
-    zstack = microscopy_collection.zstack_array(s=series)
-    segmentation = np.zeros(zstack.shape, dtype=bool)
-    ziterator = microscopy_collection.zstack_proxy_iterator(s=series)
-    for z, proxy_image in enumerate(ziterator):
-        image = proxy_image.image
-        image = threshold_abs(image, threshold)
-        segmentation[:, :, z] = image
+@transformation
+def threshold_local(image, threshold, local):
+    """Return thresholded image corrected for the local background."""
+    return foreground(image, threshold, local)
+
+
+def segment3D(stack, threshold, threads=1, local=None):
+    """Return segmented plasmodesmata in 3D.
+
+    The z-stack array is thresholded and labelled directly, with more than
+    one thread in chunks on a pool of threads, see
+    :mod:`parallel_segmentation`, and the objects are numbered as by
+    :func:`jicbioimage.segment.connected_components`. The jicbioimage
+    transformations, which wrap each z-slice in an image with a history, are
+    only used if AutoWrite is on, e.g. to write out the intermediate images
+    when debugging.
+
+    :param stack: :class:`SeriesStack`
+    :param threshold: intensity cutoff
+    :param threads: number of threads
+    :param local: (method, window, k) tuple of a local threshold, see
+                  :mod:`local_threshold`, or None for the absolute threshold
+    :returns: :class:`jicbioimage.core.image.SegmentedImage`
+    """
+    if not AutoWrite.on:
+        labels = parallel_label(stack.array, threshold, threads, local)
+        return SegmentedImage.from_array(
+            connected_components_numbering(labels))
+    segmentation = np.zeros(stack.shape, dtype=bool)
+    for z in stack.zslices:
+        if local is None:
+            segmentation[:, :, z] = threshold_abs(stack.zslice(z), threshold)
+        else:
+            segmentation[:, :, z] = threshold_local(stack.zslice(z),
+                                                    threshold, local)
     return connected_components(segmentation, background=0)
 
 
+def voxel_counts(segmentation3D):
+    """Return array with the number of voxels of each identifier.
+
+    The array is indexed by identifier and computed in a single pass over the
+    segmentation.
+    """
+    return np.bincount(segmentation3D.ravel())
+
+
+class IdentifierSelection(object):
+    """Segmentation restricted to a set of identifiers.
+
+    The selection is applied to the indexed part of the segmentation only, so
+    that z-slices can be selected without copying the whole volume.
+    """
+
+    def __init__(self, segmentation3D, keep):
+        self.segmentation3D = segmentation3D
+        self.lookup = np.arange(len(keep), dtype=segmentation3D.dtype)
+        self.lookup[np.logical_not(keep)] = 0
+
+    def __getitem__(self, index):
+        return self.lookup[self.segmentation3D[index]]
+
+
+def select_identifiers(segmentation3D, keep):
+    """Return segmentation with only the identifiers flagged in keep.
+
+    :param segmentation3D: :class:`jicbioimage.core.image.SegmentedImage`
+    :param keep: boolean array indexed by identifier
+    :returns: :class:`jicbioimage.core.image.SegmentedImage`
+    """
+    selection = IdentifierSelection(segmentation3D, keep)
+    return SegmentedImage.from_array(selection[:])
+
+
+def size_categories(counts, min_voxel, max_voxel):
+    """Return kept, small and large boolean arrays indexed by identifier."""
+    small = counts < min_voxel
+    large = np.logical_and(counts > max_voxel, np.logical_not(small))
+    kept = np.logical_not(np.logical_or(small, large))
+    return kept, small, large
+
+
+def filter_by_size(segmentation3D, min_voxel, max_voxel):
+    """Return kept, small removed and large removed segmentations.
+
+    Equivalent to applying :func:`filter_small` followed by
+    :func:`filter_large`, but the region sizes are only computed once.
+    """
+    counts = voxel_counts(segmentation3D)
+    return tuple(select_identifiers(segmentation3D, category) for category
+                 in size_categories(counts, min_voxel, max_voxel))
+
+
 def filter_large(segmentation3D, max_voxel):
     """Remove large regions."""
-    removed = segmentation3D.copy()
-    for i in segmentation3D.identifiers:
-        region = segmentation3D.region_by_identifier(i)
-        if region.area > max_voxel:
-            segmentation3D[region] = 0
-        else:
-            removed[region] = 0
-    return segmentation3D, removed
+    large = voxel_counts(segmentation3D) > max_voxel
+    return (select_identifiers(segmentation3D, np.logical_not(large)),
+            select_identifiers(segmentation3D, large))
 
 
 def filter_small(segmentation3D, min_voxel):
     """Remove small regions."""
-    removed = segmentation3D.copy()
-    for i in segmentation3D.identifiers:
-        region = segmentation3D.region_by_identifier(i)
-        if region.area < min_voxel:
-            segmentation3D[region] = 0
-        else:
-            removed[region] = 0
-    return segmentation3D, removed
+    small = voxel_counts(segmentation3D) < min_voxel
+    return (select_identifiers(segmentation3D, np.logical_not(small)),
+            select_identifiers(segmentation3D, small))
+
+
+def color_lookup(identifiers):
+    """Return array mapping identifiers to their pretty colors."""
+    identifiers = list(identifiers)
+    lookup = np.zeros((max(identifiers + [0]) + 1, 3), dtype=np.uint8)
+    for i in identifiers:
+        lookup[i] = pretty_color(i)
+    return lookup
+
+
+def grayscale(image):
+    """Return image normalised to the uint8 range."""
+    return (normalise(image) * 255).astype(np.uint8)
+
+
+def object_borders(zslice):
+    """Return the outlines of all the dilated regions in a 2D segmentation.
+
+    Equivalent to taking ``region.dilate(1).border`` of every region, but
+    computed for all regions at once. Outline pixels carry the identifier of
+    their region; all other pixels are zero. Where the outlines of two
+    regions meet the larger identifier is used.
+    """
+    background = zslice.max() + 1
+    high = nd.maximum_filter(zslice, footprint=CROSS, mode="constant", cval=0)
+    low = nd.minimum_filter(np.where(zslice == 0, background, zslice),
+                            footprint=CROSS, mode="constant", cval=background)
+    low[low == background] = 0
+
+    # In a slice of a 3D segmentation neighbouring regions are at least two
+    # pixels apart, so each dilated pixel belongs to at most two regions, low
+    # and high. A pixel is on the outline of a region if one of its four
+    # neighbours is not part of the dilated region.
+    padded_low = np.pad(low, 1, mode="constant")
+    padded_high = np.pad(high, 1, mode="constant")
+    lacks_low = np.zeros(zslice.shape, dtype=bool)
+    lacks_high = np.zeros(zslice.shape, dtype=bool)
+    rows, cols = zslice.shape
+    for r, c in [(0, 1), (2, 1), (1, 0), (1, 2)]:
+        neighbour_low = padded_low[r:r + rows, c:c + cols]
+        neighbour_high = padded_high[r:r + rows, c:c + cols]
+        lacks_low |= np.logical_and(neighbour_low != low,
+                                    neighbour_high != low)
+        lacks_high |= np.logical_and(neighbour_low != high,
+                                     neighbour_high != high)
+
+    borders = np.where(np.logical_and(lacks_low, low != 0), low, 0)
+    use_high = np.logical_and(lacks_high, high != 0)
+    borders[use_high] = high[use_high]
+    return borders
+
+
+def annotation_array(gray, zslice, colors):
+    """Return RGB array with the region outlines drawn on the gray image."""
+    annotation = np.dstack([gray, gray, gray])
+    borders = object_borders(zslice)
+    mask = borders != 0
+    annotation[mask] = colors[borders[mask]]
+    return annotation
 
 
 @transformation
 def annotate(image, segmentation):
     """Return annotated image."""
-    uint8_normalised = normalise(image) * 255
-    annotation = AnnotatedImage.from_grayscale(uint8_normalised)
-    for i in segmentation.identifiers:
-        region = segmentation.region_by_identifier(i)
-        annotation.mask_region(region.dilate(1).border,
-                               color=pretty_color(i))
-    return annotation
+    from jicbioimage.illustrate import AnnotatedImage
+    colors = color_lookup(segmentation.identifiers)
+    annotation = annotation_array(grayscale(image), segmentation, colors)
+    return annotation.view(AnnotatedImage)
+
 
+def annotate3D(stack, segmentations, output_dir, colors=None, threads=4):
+    """Write out annotated PNG files for each z-slice in the stack.
 
-def annotate3D(microscopy_collection, series, segmentation3D, name):
-    for z in microscopy_collection.zslices(series):
-        image = microscopy_collection.image(s=series, z=z)
-        zslice = segmentation3D[:, :, z]
-        segmentation = SegmentedImage.from_array(zslice)
-        annotation = annotate(image, segmentation)
-        fname = "z{:03d}_{}.png".format(z, name)
-        fpath = os.path.join(AutoName.directory, fname)
-        with open(fpath, "wb") as fh:
-            fh.write(annotation.png())
+    Each z-slice is normalised once and used for all the segmentations. The
+    z-slices are rendered and encoded on a pool of threads.
+
+    :param stack: :class:`SeriesStack`
+    :param segmentations: list of (segmentation3D, name) tuples
+    :param output_dir: directory to write the PNG files to
+    :param colors: array mapping identifiers to colors, see
+                   :func:`color_lookup`
+    :param threads: number of threads
+    """
+    # Only import the illustration stack when annotations are written.
+    from jicbioimage.illustrate import AnnotatedImage
+
+    if colors is None:
+        identifiers = set()
+        for segmentation3D, name in segmentations:
+            identifiers.update(np.unique(segmentation3D[:]).tolist())
+        colors = color_lookup(identifiers)
+
+    def write_zslice(z):
+        gray = grayscale(stack.zslice(z))
+        for segmentation3D, name in segmentations:
+            annotation = annotation_array(gray, segmentation3D[:, :, z],
+                                          colors).view(AnnotatedImage)
+            fname = "z{:03d}_{}.png".format(z, name)
+            fpath = os.path.join(output_dir, fname)
+            with open(fpath, "wb") as fh:
+                fh.write(annotation.png())
+
+    if threads < 2:
+        for z in stack.zslices:
+            write_zslice(z)
+        return
+    pool = ThreadPool(threads)
+    try:
+        pool.map(write_zslice, stack.zslices)
+    finally:
+        pool.close()
+        pool.join()
 
 
 def write_csv(segmentation3D, intensity, fname):
     """Write out a csv file with information about each spot."""
-    header = ["id", "rgb", "voxels", "sum", "min", "max", "mean"]
-    row = '{id:d},"{rgb}",{voxels:d},{sum:d},{min:d},{max:d},{mean:.3f}\n'
-    with open(fname, "w") as fh:
-        fh.write("{}\n".format(",".join(header)))
-        for i in segmentation3D.identifiers:
-            region = segmentation3D.region_by_identifier(i)
-            values = intensity[region]
-            data = dict(id=i, rgb=str(pretty_color(i)), voxels=region.area,
-                        sum=int(np.sum(values)), min=int(np.min(values)),
-                        max=int(np.max(values)), mean=float(np.mean(values)))
-            fh.write(row.format(**data))
+    statistics = ObjectStatistics.from_segmentation(segmentation3D, intensity)
+    keep = np.ones(int(np.max(segmentation3D)) + 1, dtype=bool)
+    write_statistics_csv(statistics, keep, fname)
 
 
 def plasmodesmata_analysis(microscopy_collection, series, threshold,
-                           min_voxel, max_voxel):
+                           min_voxel, max_voxel, output_dir, stack=None,
+                           annotate_removed=True, annotation_threads=4,
+                           slab_size=None, sweep=None, object_table=False,
+                           segmentation_threads=1, annotate_images=True,
+                           spatial=None, annotate_slices=False,
+                           preview_pyramid=False, local_threshold=None,
+                           colocalise=None):
     """Analyse the plasmodesmata in a 3D image.
 
-    Segmentation of the image is done using an absolute threshold.
+    Segmentation of the image is done using an absolute threshold, or if
+    local_threshold is a (method, window, k) tuple using a threshold corrected
+    for the local background, see :mod:`local_threshold`.
 
     Large unwanted regions, such as stomata, remaining from the thresholding
     are filtered out based on a maximum allowed voxel size.
-    """
-    segmentation = segment3D(microscopy_collection, series, threshold)
-
-    # Filter out small and large regions.
-    segmentation, small_removed = filter_small(segmentation, min_voxel)
-    segmentation, large_removed = filter_large(segmentation, max_voxel)
 
-    # Create annotated images.
-    annotate3D(microscopy_collection, series, segmentation, "plasmodesmata")
-    annotate3D(microscopy_collection, series, small_removed, "small_removed")
-    annotate3D(microscopy_collection, series, large_removed, "large_removed")
-
-    # Write out data to CSV files.
-    csv_fn = os.path.join(AutoName.directory, "plasmodesmata.csv")
-    write_csv(segmentation, microscopy_collection.zstack_array(s=series),
-              csv_fn)
-    csv_fn = os.path.join(AutoName.directory, "small.removed.csv")
-    write_csv(small_removed, microscopy_collection.zstack_array(s=series),
-              csv_fn)
-    csv_fn = os.path.join(AutoName.directory, "large.removed.csv")
-    write_csv(large_removed, microscopy_collection.zstack_array(s=series),
-              csv_fn)
+    The annotated images and CSV files are written to the output directory.
+    The z-stack is read once and shared by all stages of the analysis. If no
+    :class:`SeriesStack` is supplied one is created and released as soon as
+    the last stage is done with it; a supplied stack is left to the caller.
+
+    Annotated images are only written if annotate_images is True, and the
+    small and large removed regions are only annotated if annotate_removed is
+    also True. By default a single preview.png of the maximum intensity
+    projection of the z-stack is written, with the three categories outlined
+    in different colours, and if preview_pyramid is True also its tile
+    pyramid, see :mod:`preview`. Annotated images of every z-slice are only
+    written if annotate_slices is True.
+
+    If a slab_size is given the z-stack is instead segmented out-of-core, in
+    slabs of slab_size z-slices, see :mod:`streaming`. The stack argument is
+    then ignored.
+
+    If a sweep of (thresholds, min_voxels, max_voxels) lists is given, the
+    objects of every combination of these and the chosen parameters are
+    summarised in sweep.csv, see :mod:`parameter_sweep`. The full output is
+    only written for the chosen parameters.
+
+    If object_table is True the table of all objects, including their
+    centroids, bounding boxes and filter category, is returned, see
+    :func:`result_store.object_table`.
+
+    The in-memory z-stack is segmented on segmentation_threads threads, see
+    :func:`segment3D`.
+
+    If spatial is a (radius, cluster distance) tuple, the nearest neighbour
+    distance, density and cluster of each plasmodesma are written to
+    spatial.csv, and its spatial index to spatial_index.npz, see
+    :mod:`spatial_index`. Distances are in microns if the collection records
+    the voxel spacing of the series.
+
+    If colocalise is a list of (channel, intensity array) tuples of the other
+    channels of the series, their intensities in the plasmodesmata are
+    written to colocalisation.csv, see :mod:`colocalisation`. The channels
+    and time points of a series are analysed together with
+    :func:`multichannel.analyse_channels`.
+    """
+    if sweep is not None and slab_size:
+        raise(ValueError("A parameter sweep needs the z-stack in memory"))
+    if sweep is not None and local_threshold is not None:
+        raise(ValueError("A parameter sweep needs the absolute threshold"))
+    if colocalise and slab_size:
+        raise(ValueError("Co-localisation needs the z-stacks in memory"))
+    with unit(series=series), stage("series") as counts:
+        if slab_size:
+            stack = CollectionSlabReader(microscopy_collection, series)
+            labels_fpath = os.path.join(output_dir, "labels.npy")
+            with stage("segment", slab_size=slab_size):
+                labels, statistics = segment_slabs(
+                    stack, threshold, slab_size, labels_fpath,
+                    local_threshold)
+                objects = SparseObjects.from_labels(labels, slab_size)
+                del labels
+                os.remove(labels_fpath)
+        else:
+            release_stack = stack is None
+            if stack is None:
+                stack = SeriesStack(microscopy_collection, series)
+            # Read the z-stack up front, so that decoding is timed on its own.
+            with stage("read"):
+                stack.array
+            if sweep is not None:
+                thresholds, min_voxels, max_voxels = sweep
+                with stage("sweep"):
+                    write_sweep_csv(stack.array,
+                                    list(thresholds) + [threshold],
+                                    list(min_voxels) + [min_voxel],
+                                    list(max_voxels) + [max_voxel],
+                                    os.path.join(output_dir, "sweep.csv"))
+            # Only the voxels of the objects are kept after labelling.
+            with stage("segment"):
+                objects = SparseObjects.from_labels(
+                    segment3D(stack, threshold, segmentation_threads,
+                              local_threshold))
+
+            # Calculate statistics of all objects from the object voxels.
+            with stage("statistics"):
+                statistics = objects.statistics(stack.array)
+        counts["voxels"] = int(np.prod(stack.shape))
+        counts["objects"] = len(statistics.identifiers)
+
+        # Filter out small and large regions.
+        with stage("filter") as filter_counts:
+            categories = size_categories(statistics.voxel_counts(),
+                                         min_voxel, max_voxel)
+            kept, small, large = categories
+            for name, category in zip(["plasmodesmata", "small_removed",
+                                       "large_removed"], categories):
+                filter_counts[name] = int(np.sum(category[1:]))
+        counts.update(filter_counts)
+
+        if spatial is not None:
+            radius, cluster_distance = spatial
+            with stage("spatial"):
+                spacing = None
+                if hasattr(microscopy_collection, "voxel_spacing"):
+                    spacing = microscopy_collection.voxel_spacing(series)
+                centroids, lower, upper = objects.geometry()
+                flags = kept[objects.identifiers]
+                index = SpatialIndex(objects.identifiers[flags],
+                                     centroids[flags],
+                                     spacing or (1., 1., 1.))
+                index.save(os.path.join(output_dir, INDEX_FNAME))
+                write_spatial_csv(spatial_table(index, radius,
+                                                cluster_distance),
+                                  os.path.join(output_dir, "spatial.csv"))
+
+        if colocalise:
+            with stage("colocalisation"):
+                write_colocalisation_csv(
+                    colocalisation_table(objects, stack.array, colocalise),
+                    kept, os.path.join(output_dir, "colocalisation.csv"))
+
+        table = None
+        if object_table:
+            with stage("object_table"):
+                table = make_object_table(statistics, objects, categories)
+
+        # Create annotated images.
+        if annotate_images:
+            shown = [kept, small, large] if annotate_removed else [kept]
+            with stage("preview") as preview_counts:
+                preview_counts["images"] = write_preview(
+                    stack, objects, shown, output_dir, preview_pyramid)
+        if annotate_images and annotate_slices:
+            segmentations = [(objects.select(kept), "plasmodesmata")]
+            if annotate_removed:
+                segmentations.append((objects.select(small), "small_removed"))
+                segmentations.append((objects.select(large), "large_removed"))
+            with stage("annotate") as annotate_counts:
+                colors = color_lookup(statistics.identifiers.tolist())
+                annotate3D(stack, segmentations, output_dir, colors,
+                           annotation_threads)
+                annotate_counts["images"] = len(stack.zslices) * len(
+                    segmentations)
+        if not slab_size and release_stack:
+            stack.release()
+
+        # Write out data to CSV files.
+        csv_fnames = ["plasmodesmata.csv",
+                      "small.removed.csv",
+                      "large.removed.csv"]
+        with stage("csv"):
+            for csv_fname, category in zip(csv_fnames, categories):
+                csv_fn = os.path.join(output_dir, csv_fname)
+                write_statistics_csv(statistics, category, csv_fn)
+    return table
+
+
+def add_analysis_arguments(parser):
+    """Add the optional arguments of :func:`plasmodesmata_analysis`."""
+    parser.add_argument("--skip-annotation", action="store_true",
+                        help="do not write annotated images")
+    parser.add_argument("--annotate-slices", action="store_true",
+                        help="also write annotated images of every z-slice")
+    parser.add_argument("--preview-pyramid", action="store_true",
+                        help="also write the preview as a pyramid of tiles")
+    parser.add_argument("--skip-removed-annotation", action="store_true",
+                        help="do not write annotated images of the small and "
+                             "large removed regions")
+    parser.add_argument("--annotation-threads", default=4, type=int,
+                        help="threads writing annotated images (default=4)")
+    parser.add_argument("--segmentation-threads", default=1, type=int,
+                        help="threads thresholding and labelling the "
+                             "z-stack (default=1)")
+    parser.add_argument("--threshold-method", default="abs", choices=METHODS,
+                        help="absolute threshold, or threshold corrected "
+                             "for the background in a window of each "
+                             "z-slice (default=abs)")
+    parser.add_argument("--local-window", default=WINDOW, type=int,
+                        help="width in pixels of the window of a local "
+                             "threshold (default={})".format(WINDOW))
+    parser.add_argument("--local-k", default=K, type=float,
+                        help="standard deviations above the window mean of "
+                             "the sigma threshold (default={})".format(K))
+    parser.add_argument("--slab-size", default=None, type=int,
+                        help="segment the z-stack out-of-core in slabs of "
+                             "this many z-slices")
+    parser.add_argument("--sweep-thresholds", default=None, type=int_list,
+                        help="comma separated thresholds to summarise in "
+                             "sweep.csv")
+    parser.add_argument("--sweep-min-voxels", default=None, type=int_list,
+                        help="comma separated minimum voxel volumes to "
+                             "summarise in sweep.csv")
+    parser.add_argument("--sweep-max-voxels", default=None, type=int_list,
+                        help="comma separated maximum voxel volumes to "
+                             "summarise in sweep.csv")
+    parser.add_argument("--spatial", action="store_true",
+                        help="write the nearest neighbour distance, density "
+                             "and cluster of each plasmodesma to "
+                             "spatial.csv")
+    parser.add_argument("--density-radius", default=2.0, type=float,
+                        help="radius in microns within which neighbours are "
+                             "counted (default=2.0)")
+    parser.add_argument("--cluster-distance", default=0.5, type=float,
+                        help="distance in microns below which plasmodesmata "
+                             "are clustered (default=0.5)")
+    parser.add_argument("--channels", default=None, type=channel_list,
+                        help="comma separated channels to segment, or all, "
+                             "measuring the other channels in their objects")
+    parser.add_argument("--timepoints", default=None, type=channel_list,
+                        help="comma separated time points to analyse, or "
+                             "all")
+    parser.add_argument("--result-store", action="store_true",
+                        help="append the table of all objects to {} in the "
+                             "output directory".format(RESULTS_FNAME))
+
+
+def int_list(text):
+    """Return list of integers from a comma separated string."""
+    try:
+        return [int(value) for value in text.split(",")]
+    except ValueError:
+        raise(argparse.ArgumentTypeError(
+            "invalid list of integers: {}".format(text)))
+
+
+def channel_list(text):
+    """Return list of integers from a comma separated string, or "all"."""
+    if text == "all":
+        return text
+    return int_list(text)
+
+
+def analysis_options(args):
+    """Return keyword arguments for :func:`plasmodesmata_analysis`."""
+    sweep = None
+    sweep_lists = [args.sweep_thresholds, args.sweep_min_voxels,
+                   args.sweep_max_voxels]
+    if any(values is not None for values in sweep_lists):
+        sweep = tuple(values or [] for values in sweep_lists)
+    local_threshold = None
+    if args.threshold_method != "abs":
+        local_threshold = (args.threshold_method, args.local_window,
+                           args.local_k)
+    spatial = None
+    if args.spatial:
+        spatial = (args.density_radius, args.cluster_distance)
+    return dict(annotate_images=not args.skip_annotation,
+                annotate_removed=not args.skip_removed_annotation,
+                annotation_threads=args.annotation_threads,
+                slab_size=args.slab_size, sweep=sweep,
+                object_table=args.result_store,
+                segmentation_threads=args.segmentation_threads,
+                spatial=spatial, annotate_slices=args.annotate_slices,
+                preview_pyramid=args.preview_pyramid,
+                local_threshold=local_threshold, channels=args.channels,
+                timepoints=args.timepoints)
 
 
 def main():
+    # The channels and time points are analysed, and the jobs submitted to
+    # the analysis service, by modules importing this one.
+    from multichannel import analyse_channels
+    from service import add_service_argument, submit_files
+
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("input_file", help="path to raw microscopy data")
     parser.add_argument("series", type=int,
@@ -171,6 +637,8 @@ def main():
                         help="Minimum voxel volume (default=2)")
     parser.add_argument("--max-voxel", default=50, type=int,
                         help="Maximum voxel volume (default=50)")
+    add_analysis_arguments(parser)
+    add_service_argument(parser)
     args = parser.parse_args()
 
     if not os.path.isfile(args.input_file):
@@ -178,11 +646,31 @@ def main():
 
     if not os.path.isdir(args.output_dir):
         os.mkdir(args.output_dir)
-    AutoName.directory = args.output_dir
+
+    options = analysis_options(args)
+    if args.service is not None:
+        logger = logging.getLogger(os.path.basename(__file__))
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(logging.StreamHandler())
+        failures = submit_files(args.service,
+                                [(args.input_file, args.output_dir)],
+                                args.threshold, args.min_voxel,
+                                args.max_voxel, logger, options,
+                                store=run_store(args.output_dir, options),
+                                series=args.series)
+        if failures:
+            parser.exit(1)
+        return
 
     microscopy_collection = get_microscopy_collection(args.input_file)
-    plasmodesmata_analysis(microscopy_collection, args.series, args.threshold,
-                           args.min_voxel, args.max_voxel)
+    tables = analyse_channels(microscopy_collection, args.series,
+                              args.threshold, args.min_voxel, args.max_voxel,
+                              args.output_dir, **options)
+    store = run_store(args.output_dir, options)
+    if store is not None:
+        for channel, timepoint, table in tables:
+            store.append(table, args.input_file, args.series, channel,
+                         timepoint)
 
 
 if __name__ == "__main__":
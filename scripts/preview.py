@@ -0,0 +1,143 @@
+"""Quick look previews of the segmentation of a series.
+
+The preview is a single image of the maximum intensity projection of the
+z-stack, with the outlines of the projected plasmodesmata, small removed and
+large removed regions drawn on it in a colour per category.
+
+The preview can also be written as a pyramid of tiles, for zooming into the
+full resolution image on demand. Level 0 holds the full resolution image and
+every following level halves the resolution, down to a level that fits in a
+single tile. The tiles of a level are named ``<level>/<row>_<col>.png``, and
+tiles.json describes the levels.
+"""
+
+import os
+import os.path
+import json
+
+import numpy as np
+import scipy.ndimage as nd
+
+from jicbioimage.core.util.array import normalise
+
+PREVIEW_FNAME = "preview.png"
+TILES_DIRNAME = "preview_tiles"
+TILE_SIZE = 256
+
+CROSS = nd.generate_binary_structure(2, 1)
+
+#: Outline colours of the plasmodesmata, small removed and large removed
+#: regions.
+CATEGORY_COLORS = [(0, 255, 0), (0, 160, 255), (255, 0, 255)]
+
+
+def max_projection(stack):
+    """Return the maximum intensity projection of a z-stack.
+
+    The z-slices are read one at a time, so that the stack can also be a
+    :class:`streaming.CollectionSlabReader`.
+    """
+    projection = None
+    for z in stack.zslices:
+        zslice = np.asarray(stack.zslice(z))
+        if projection is None:
+            projection = zslice.copy()
+        else:
+            np.maximum(projection, zslice, out=projection)
+    return projection
+
+
+def outline(mask):
+    """Return the outline of the mask dilated by one pixel."""
+    dilated = nd.binary_dilation(mask, structure=CROSS)
+    return np.logical_and(dilated,
+                          np.logical_not(nd.binary_erosion(dilated, CROSS)))
+
+
+def render(gray, masks):
+    """Return RGB array with the outlines of the masks drawn on the image.
+
+    :param gray: uint8 2D array
+    :param masks: list of (2D boolean array, colour) tuples; later masks are
+                  drawn on top of earlier ones
+    """
+    rgb = np.dstack([gray, gray, gray])
+    for mask, color in masks:
+        rgb[outline(mask)] = color
+    return rgb
+
+
+def _downsample(array, reduce_function):
+    """Return array halved in size by reducing blocks of 2x2 pixels."""
+    rows, cols = array.shape
+    array = np.pad(array, ((0, rows % 2), (0, cols % 2)), mode="edge")
+    blocks = array.reshape((array.shape[0] // 2, 2, array.shape[1] // 2, 2))
+    return reduce_function(reduce_function(blocks, axis=3), axis=1)
+
+
+def _png(rgb):
+    # Only import the illustration stack when images are written.
+    from jicbioimage.illustrate import AnnotatedImage
+    return rgb.view(AnnotatedImage).png()
+
+
+def write_tiles(gray, masks, directory):
+    """Write the tile pyramid of a preview to a directory.
+
+    :returns: number of tiles written
+    """
+    levels = []
+    num_tiles = 0
+    level = 0
+    while True:
+        rgb = render(gray, masks)
+        rows, cols = gray.shape
+        for row in range(0, rows, TILE_SIZE):
+            for col in range(0, cols, TILE_SIZE):
+                tile = np.ascontiguousarray(
+                    rgb[row:row + TILE_SIZE, col:col + TILE_SIZE])
+                level_dir = os.path.join(directory, str(level))
+                if not os.path.isdir(level_dir):
+                    os.makedirs(level_dir)
+                fname = "{}_{}.png".format(row // TILE_SIZE, col // TILE_SIZE)
+                with open(os.path.join(level_dir, fname), "wb") as fh:
+                    fh.write(_png(tile))
+                num_tiles += 1
+        levels.append(dict(level=level, rows=rows, cols=cols,
+                           scale=2 ** level))
+        if rows <= TILE_SIZE and cols <= TILE_SIZE:
+            break
+        # Average the intensities, but keep every region that covers any
+        # pixel of a block, so that small regions remain visible.
+        gray = _downsample(gray.astype(float), np.mean).round().astype(
+            np.uint8)
+        masks = [(_downsample(mask, np.max), color) for mask, color in masks]
+        level += 1
+
+    with open(os.path.join(directory, "tiles.json"), "w") as fh:
+        json.dump(dict(tile_size=TILE_SIZE, levels=levels), fh, indent=2)
+    return num_tiles
+
+
+def write_preview(stack, objects, categories, output_dir, pyramid=False):
+    """Write the preview of a series to the output directory.
+
+    :param stack: :class:`plasmodesmata_analysis.SeriesStack`
+    :param objects: :class:`sparse_objects.SparseObjects`
+    :param categories: list of boolean arrays indexed by identifier, of the
+                       plasmodesmata, small removed and large removed regions
+    :param pyramid: also write the tile pyramid of the preview
+    :returns: number of images written
+    """
+    gray = (normalise(max_projection(stack)) * 255).astype(np.uint8)
+    masks = [(objects.projection(keep), color)
+             for keep, color in zip(categories, CATEGORY_COLORS)]
+    # Draw the plasmodesmata on top of the removed regions.
+    masks.reverse()
+    with open(os.path.join(output_dir, PREVIEW_FNAME), "wb") as fh:
+        fh.write(_png(render(gray, masks)))
+    num_images = 1
+    if pyramid:
+        num_images += write_tiles(gray, masks,
+                                  os.path.join(output_dir, TILES_DIRNAME))
+    return num_images
@@ -0,0 +1,246 @@
+"""Consolidated table of the objects found in all series of a run.
+
+The objects of each (file, series, channel, time point) unit are appended to
+the store as soon as the unit is done, as an uncompressed NPZ file of arrays,
+one per column, ``unit-<n>.npz`` in the results.units directory next to the
+index of the store, results.npz, in the output directory of a run. The line,
+file, series, channel and time point of the unit are stored alongside its
+columns. Units of stores written before channels and time points were
+recorded are read as channel 0 at time point 0.
+
+The index lists the unit files in the order they were appended. Each append
+writes the new unit file, and then an updated copy of the index that
+replaces it, so that a run killed while appending leaves the store as it was
+before the append; the unit files are never rewritten. Stores written before
+the units had files of their own hold the units in the index, as groups of
+arrays named ``unit-<n>/<column>``; they are moved out to unit files by the
+first append.
+
+Reading the file with :func:`read_results` returns the rows of all units as
+one column oriented table. If a unit has been appended more than once, e.g.
+because a run was interrupted before it was marked done in the journal, only
+its last rows are returned.
+
+Running this script prints the number of objects in each category per unit
+of a results file.
+"""
+
+import io
+import os
+import os.path
+import zipfile
+import tempfile
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+from conversion_cache import _replace
+from object_statistics import object_geometry
+from sparse_objects import SparseObjects
+
+RESULTS_FNAME = "results.npz"
+
+#: Filter categories, stored by their index in the category column.
+CATEGORIES = ["plasmodesmata", "small_removed", "large_removed"]
+
+TAGS = ["line", "file", "series", "channel", "timepoint"]
+
+
+def object_table(statistics, segmentation3D, categories):
+    """Return the columns of the table of all objects in a segmentation.
+
+    :param statistics: :class:`object_statistics.ObjectStatistics`
+    :param segmentation3D: array of identifiers or
+                           :class:`sparse_objects.SparseObjects`
+    :param categories: kept, small and large boolean arrays indexed by
+                       identifier
+    :returns: ordered dictionary of column arrays
+    """
+    identifiers = statistics.identifiers
+    if isinstance(segmentation3D, SparseObjects):
+        centroids, lower, upper = segmentation3D.geometry()
+    else:
+        centroids, lower, upper = object_geometry(segmentation3D,
+                                                  identifiers)
+    category = np.zeros(len(identifiers), dtype=np.uint8)
+    for n, flags in enumerate(categories):
+        category[flags[identifiers]] = n
+
+    table = OrderedDict()
+    table["id"] = identifiers
+    table["category"] = category
+    table["voxels"] = statistics.voxels
+    table["sum"] = statistics.sum
+    table["min"] = statistics.min
+    table["max"] = statistics.max
+    table["mean"] = statistics.mean
+    for axis, name in enumerate(["row", "col", "z"]):
+        table["centroid_" + name] = centroids[:, axis]
+        table["bbox_{}_min".format(name)] = lower[:, axis]
+        table["bbox_{}_max".format(name)] = upper[:, axis]
+    return table
+
+
+def units_dir(fpath):
+    """Return the directory of the unit files of the store with an index."""
+    return os.path.splitext(fpath)[0] + ".units"
+
+
+def _write_npz(fpath, arrays):
+    """Write the (name, array) pairs to an NPZ file replacing fpath.
+
+    The file is written to a temporary file in the same directory first, so
+    that fpath is either left as it was or replaced by the complete file.
+    """
+    fd, tmp_fpath = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(fpath)),
+        prefix=".tmp-" + os.path.basename(fpath))
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            with zipfile.ZipFile(fh, "w", zipfile.ZIP_STORED) as zf:
+                for name, array in arrays:
+                    buf = io.BytesIO()
+                    np.lib.format.write_array(buf, np.asarray(array))
+                    zf.writestr("{}.npy".format(name), buf.getvalue())
+            fh.flush()
+            os.fsync(fh.fileno())
+        _replace(tmp_fpath, fpath)
+    except BaseException:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
+        raise
+
+
+def _read_index(fpath):
+    """Return the unit file names and the units held in an index.
+
+    :returns: list of file names and ordered dictionary of the columns of
+              the units held in the index itself, by unit name
+    """
+    fnames = []
+    groups = OrderedDict()
+    with np.load(fpath) as npz:
+        for name in sorted(npz.files):
+            if name == "units":
+                fnames = npz[name].tolist()
+                continue
+            unit, column = name.split("/")
+            groups.setdefault(unit, OrderedDict())[column] = npz[name]
+    return fnames, groups
+
+
+class ResultStore(object):
+    """Append only store of the object tables of a run.
+
+    The store is only written to by the main process of a run.
+    """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.units = []
+        self._held_units = OrderedDict()
+        if os.path.isfile(fpath):
+            self.units, self._held_units = _read_index(fpath)
+
+    @property
+    def num_units(self):
+        """Return the number of units appended to the store."""
+        return len(self.units) + len(self._held_units)
+
+    def _write_unit(self, n, arrays):
+        """Write the file of the n-th unit, returning its name."""
+        directory = units_dir(self.fpath)
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+        fname = "unit-{:06d}.npz".format(n)
+        _write_npz(os.path.join(directory, fname), arrays)
+        return fname
+
+    def append(self, table, input_file, series, channel=0, timepoint=0):
+        """Append the object table of a unit to the store."""
+        units = list(self.units)
+        # Units held in the index of an older store are moved out first.
+        for columns in self._held_units.values():
+            units.append(self._write_unit(len(units), columns.items()))
+        input_file = os.path.abspath(input_file)
+        tags = dict(line=os.path.basename(os.path.dirname(input_file)),
+                    file=input_file, series=series, channel=channel,
+                    timepoint=timepoint)
+        arrays = [(name, np.asarray(tags[name])) for name in TAGS]
+        arrays.extend(table.items())
+        units.append(self._write_unit(len(units), arrays))
+        # Unit files that are not in the index, e.g. of an interrupted
+        # append, are ignored and written over by the next append.
+        _write_npz(self.fpath, [("units", np.array(units))])
+        self.units = units
+        self._held_units = OrderedDict()
+
+
+def run_store(output_dir, options):
+    """Return the store of a run if the object tables are requested.
+
+    :param options: keyword arguments of
+                    :func:`plasmodesmata_analysis.plasmodesmata_analysis`
+    :returns: :class:`ResultStore` or None
+    """
+    if not options.get("object_table"):
+        return None
+    return ResultStore(os.path.join(output_dir, RESULTS_FNAME))
+
+
+def read_results(fpath):
+    """Return the rows of all units in a results file.
+
+    :returns: ordered dictionary of column arrays, including the line,
+              file, series, channel and time point of each row
+    """
+    units = OrderedDict()
+    fnames, groups = _read_index(fpath)
+    for fname in fnames:
+        with np.load(os.path.join(units_dir(fpath), fname)) as npz:
+            groups[fname] = OrderedDict((name, npz[name])
+                                        for name in npz.files)
+    for unit, columns in groups.items():
+        for tag in ["channel", "timepoint"]:
+            columns.setdefault(tag, np.asarray(0))
+        key = tuple(columns[tag].item() for tag in TAGS[1:])
+        # Later appends of the same unit replace earlier ones.
+        units.pop(key, None)
+        units[key] = columns
+
+    results = OrderedDict()
+    if not units:
+        return results
+    first = list(units.values())[0]
+    for column in first:
+        if column in TAGS:
+            continue
+        results[column] = np.concatenate([u[column] for u in units.values()])
+    num_rows = [len(u["id"]) for u in units.values()]
+    for tag in TAGS:
+        results[tag] = np.repeat([u[tag].item() for u in units.values()],
+                                 num_rows)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("results_file", help="path to a results.npz file")
+    args = parser.parse_args()
+
+    results = read_results(args.results_file)
+    if not results:
+        return
+    print("file,series,channel,timepoint,{}".format(",".join(CATEGORIES)))
+    keys = list(zip(*[results[tag].tolist() for tag in TAGS[1:]]))
+    for key in sorted(set(keys)):
+        in_unit = np.array([k == key for k in keys], dtype=bool)
+        counts = [np.sum(results["category"][in_unit] == n)
+                  for n in range(len(CATEGORIES))]
+        print("{},{},{},{},{}".format(*(list(key) + [
+            ",".join(str(c) for c in counts)])))
+
+
+if __name__ == "__main__":
+    main()
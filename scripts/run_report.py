@@ -0,0 +1,227 @@
+"""Summarise the run reports of an analysis.
+
+The analysis records the wall time, CPU time and memory use of every stage
+of the analysis of each file and series. The records are written as JSON
+lines to a report.jsonl file next to the log file of the analysis scripts.
+
+The operating system only keeps the peak memory use of a whole process, so
+each record holds the peak of the process so far, process_peak_rss, and by
+how much the stage raised it, peak_rss_growth. A stage with no growth may
+still have used a lot of memory, just not more than an earlier stage of the
+same process.
+
+Running this script summarises all the report files found in an output
+directory, e.g. that of an analyse_all_lines.py run, listing the time spent
+in each stage and the slowest files and series.
+"""
+
+import os
+import os.path
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows.
+    resource = None
+
+REPORT_FNAME = "report.jsonl"
+
+logger = logging.getLogger("run_report")
+logger.setLevel(logging.DEBUG)
+logger.propagate = False
+
+# Description of the unit of work of each thread, e.g. the file and series,
+# added to all the records emitted while it is set.
+_local = threading.local()
+
+
+def _context():
+    if not hasattr(_local, "context"):
+        _local.context = {}
+    return _local.context
+
+
+def peak_rss():
+    """Return the peak resident set size of the process so far in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+def cpu_time():
+    """Return the user and system time of the process in seconds."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def add_report_file(directory):
+    """Write the records to a report file in the directory."""
+    fh = logging.FileHandler(os.path.join(directory, REPORT_FNAME), mode="w")
+    fh.setLevel(logging.DEBUG)
+    fh.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(fh)
+
+
+def current_unit():
+    """Return the context added to the records emitted by this thread."""
+    return dict(_context())
+
+
+@contextmanager
+def unit(**context):
+    """Add the keyword arguments to the records emitted in the context."""
+    previous = _context().copy()
+    _context().update(context)
+    try:
+        yield
+    finally:
+        _context().clear()
+        _context().update(previous)
+
+
+@contextmanager
+def stage(name, **counts):
+    """Record the resources used by a stage of the analysis.
+
+    The context yields a dictionary of counts, e.g. of voxels and objects,
+    that can be updated in the stage and are added to the record.
+    """
+    record = dict(_context())
+    record["stage"] = name
+    record["start"] = time.time()
+    record["pid"] = os.getpid()
+    start_cpu = cpu_time()
+    start_peak = peak_rss()
+    status = "failed"
+    try:
+        yield counts
+        status = "ok"
+    finally:
+        record["wall"] = time.time() - record["start"]
+        record["cpu"] = cpu_time() - start_cpu
+        record["process_peak_rss"] = peak_rss()
+        record["peak_rss_growth"] = None
+        if start_peak is not None:
+            record["peak_rss_growth"] = record["process_peak_rss"] - start_peak
+        record["status"] = status
+        record.update(counts)
+        logger.info(json.dumps(record, sort_keys=True))
+
+
+def read_reports(directory):
+    """Return list of the records of all report files in the directory."""
+    records = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        if REPORT_FNAME not in files:
+            continue
+        with open(os.path.join(root, REPORT_FNAME)) as fh:
+            for line in fh:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def unit_name(record):
+    """Return description of the file and series of a record."""
+    name = os.path.basename(record.get("file", "?"))
+    if "series" in record:
+        name = "{} series {}".format(name, record["series"])
+    return name
+
+
+def process_peak(record):
+    """Return the peak memory use of the process at the end of a stage.
+
+    Reports written before the growth was recorded call it peak_rss.
+    """
+    return record.get("process_peak_rss", record.get("peak_rss"))
+
+
+def format_bytes(num_bytes):
+    """Return size in megabytes."""
+    if num_bytes is None:
+        return "-"
+    return "{:.0f}M".format(num_bytes / 1024. / 1024.)
+
+
+def summarise(records, top=10):
+    """Return lines summarising the records."""
+    lines = []
+    stages = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record)
+
+    row = "{:<12} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}"
+    lines.append(row.format("stage", "count", "wall", "cpu", "mean wall",
+                            "max wall", "proc peak", "max growth"))
+    order = sorted(stages, key=lambda s: -sum(r["wall"] for r in stages[s]))
+    for name in order:
+        stage_records = stages[name]
+        wall = [r["wall"] for r in stage_records]
+        peaks = [process_peak(r) for r in stage_records
+                 if process_peak(r) is not None]
+        growths = [r["peak_rss_growth"] for r in stage_records
+                   if r.get("peak_rss_growth") is not None]
+        lines.append(row.format(
+            name, len(stage_records),
+            "{:.1f}s".format(sum(wall)),
+            "{:.1f}s".format(sum(r["cpu"] for r in stage_records)),
+            "{:.1f}s".format(sum(wall) / len(wall)),
+            "{:.1f}s".format(max(wall)),
+            format_bytes(max(peaks) if peaks else None),
+            format_bytes(max(growths) if growths else None)))
+
+    for name, title in [("series", "Slowest series"),
+                        ("load", "Slowest file loads")]:
+        slowest = sorted(stages.get(name, []), key=lambda r: -r["wall"])
+        if not slowest:
+            continue
+        lines.append("")
+        lines.append("{}:".format(title))
+        for record in slowest[:top]:
+            counts = ""
+            if "objects" in record:
+                counts = "  {} objects".format(record["objects"])
+            lines.append("{:>10}  {:>8}  {}{}".format(
+                "{:.1f}s".format(record["wall"]),
+                format_bytes(process_peak(record)), unit_name(record),
+                counts))
+
+    failed = [r for r in records if r["status"] != "ok"]
+    if failed:
+        lines.append("")
+        lines.append("Failed stages:")
+        for record in failed:
+            lines.append("{}  {}".format(record["stage"], unit_name(record)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output_dir",
+                        help="output directory containing report files")
+    parser.add_argument("--top", default=10, type=int,
+                        help="number of slowest units to list (default=10)")
+    args = parser.parse_args()
+
+    records = read_reports(args.output_dir)
+    if not records:
+        parser.error("No {} files in: {}".format(REPORT_FNAME,
+                                                 args.output_dir))
+    for line in summarise(records, args.top):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
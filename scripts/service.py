@@ -0,0 +1,361 @@
+"""Long running analysis service with warm worker processes.
+
+The service keeps a pool of worker processes alive between jobs, so that the
+start-up and import costs are only paid once. The input files are unpacked
+into the shared conversion cache, see :mod:`conversion_cache`, so that files
+submitted again are not converted again.
+
+Jobs are submitted over a local socket, by default by the batch scripts when
+given the --service option. A job is a list of input files to analyse, with
+the analysis parameters and the directory holding the journal and result
+store of the run. The series of the files are scheduled onto the workers as
+in :mod:`batch`. The log records and run report records of the job are
+streamed back to the client as they arrive, followed by the list of failed
+work units.
+
+Start the service with::
+
+    python scripts/service.py --jobs 8
+
+The service listens on a Unix domain socket in a directory of the user
+running it, which only that user may enter, and clients authenticate with a
+secret key kept in the same directory, see :func:`service_directory`. Unix
+domain sockets are not available on Windows.
+"""
+
+import os
+import os.path
+import sys
+import stat
+import socket
+import logging
+import argparse
+import threading
+import importlib
+import traceback
+import multiprocessing
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+import run_report
+from batch import _RecordCollector, add_jobs_argument, analyse_files
+from journal import RunJournal
+from plasmodesmata_analysis import get_microscopy_collection, __version__
+from result_store import ResultStore
+
+#: Whether the platform has the Unix domain sockets used by the service.
+HAVE_UNIX_SOCKETS = hasattr(socket, "AF_UNIX")
+
+#: Name of the default socket in the service directory.
+SOCKET_FNAME = "service.sock"
+
+#: Name of the file holding the secret key in the service directory.
+AUTHKEY_FNAME = "authkey"
+
+logger = logging.getLogger(os.path.basename(__file__))
+logger.setLevel(logging.DEBUG)
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+logger.addHandler(ch)
+
+def _check_private(path, mode):
+    """Raise RuntimeError unless path belongs to the user and is private.
+
+    :param path: path of a file or directory
+    :param mode: permission bits that only the user may have
+    """
+    info = os.stat(path)
+    if info.st_uid != os.getuid():
+        raise(RuntimeError("{} belongs to another user".format(path)))
+    if stat.S_IMODE(info.st_mode) & ~mode:
+        raise(RuntimeError("{} is accessible by other users".format(path)))
+
+
+def service_directory():
+    """Return the directory of the service of the current user.
+
+    The directory is plasmodesmata in $XDG_RUNTIME_DIR, or ~/.plasmodesmata
+    if that is not set. It is created if needed, and only the user may enter
+    it.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        path = os.path.join(runtime_dir, "plasmodesmata")
+    else:
+        path = os.path.join(os.path.expanduser("~"), ".plasmodesmata")
+    try:
+        os.mkdir(path, 0o700)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    _check_private(path, 0o700)
+    return path
+
+
+def default_address():
+    """Return the path of the socket of the service of the current user."""
+    return os.path.join(service_directory(), SOCKET_FNAME)
+
+
+def authkey():
+    """Return the secret key shared by the service and its clients.
+
+    The key is generated on first use and kept in a file in the service
+    directory that only the user may read.
+    """
+    fpath = os.path.join(service_directory(), AUTHKEY_FNAME)
+    try:
+        fd = os.open(fpath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except OSError:
+        if not os.path.isfile(fpath):
+            raise
+    else:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(os.urandom(32))
+    _check_private(fpath, 0o600)
+    with open(fpath, "rb") as fh:
+        key = fh.read()
+    if not key:
+        raise(RuntimeError("Empty secret key in {}".format(fpath)))
+    return key
+
+
+def add_service_argument(parser):
+    """Add the --service option to an argument parser.
+
+    The option is only added on platforms with Unix domain sockets; on others
+    args.service is always None. Given without an address, args.service is
+    the empty string, standing for :func:`default_address`.
+    """
+    if not HAVE_UNIX_SOCKETS:
+        parser.set_defaults(service=None)
+        return
+    parser.add_argument("--service", nargs="?", default=None, const="",
+                        metavar="ADDRESS",
+                        help="run the analysis on the analysis service "
+                             "listening on this socket (default: "
+                             "service.sock in $XDG_RUNTIME_DIR/plasmodesmata "
+                             "or ~/.plasmodesmata)")
+
+
+class _ConnectionHandler(_RecordCollector):
+    """Logging handler sending the records to a client."""
+
+    def __init__(self, connection):
+        _RecordCollector.__init__(self)
+        self.connection = connection
+
+    def emit(self, record):
+        _RecordCollector.emit(self, record)
+        self.connection.send(("record", self.records.pop()))
+
+
+class AnalysisService(object):
+    """Service analysing the jobs submitted to it on a pool of workers.
+
+    :param address: path of the socket to listen on
+    :param jobs: number of worker processes
+    :param tasks_per_worker: number of work units after which a worker is
+                             replaced; None to keep the workers
+    """
+
+    def __init__(self, address, jobs, tasks_per_worker=None):
+        self.address = address
+        self.jobs = jobs
+        self.pool = multiprocessing.Pool(processes=jobs,
+                                         maxtasksperchild=tasks_per_worker)
+        self._run_locks = {}
+        self._run_locks_lock = threading.Lock()
+
+    def _run_lock(self, run_dir):
+        """Return the lock serialising the jobs of a run directory."""
+        with self._run_locks_lock:
+            return self._run_locks.setdefault(run_dir, threading.Lock())
+
+    def run_job(self, job, connection):
+        """Analyse the files of a job, streaming the records to the client.
+
+        :returns: list of descriptions of the failed work units
+        """
+        job_logger = logging.Logger("service")
+        job_logger.addHandler(_ConnectionHandler(connection))
+        with self._run_lock(job["run_dir"]):
+            journal = None
+            if job["journal_parameters"] is not None:
+                journal = RunJournal(job["run_dir"], job["journal_parameters"])
+            store = None
+            if job["store"] is not None:
+                store = ResultStore(job["store"])
+            load_collection = get_microscopy_collection
+            if job["load_collection"] is not None:
+                module_name, name = job["load_collection"]
+                load_collection = getattr(
+                    importlib.import_module(module_name), name)
+            return analyse_files(job["files"], load_collection,
+                                 job["threshold"], job["min_voxel"],
+                                 job["max_voxel"], self.jobs, job_logger,
+                                 job["options"], journal, store,
+                                 pool=self.pool, report_logger=job_logger,
+                                 series=job["series"])
+
+    def handle_connection(self, connection):
+        try:
+            job = connection.recv()
+            logger.info("Job of {} files in: {}".format(len(job["files"]),
+                                                        job["run_dir"]))
+            try:
+                failures = self.run_job(job, connection)
+            except Exception:
+                logger.exception("Job failed")
+                connection.send(("error", traceback.format_exc()))
+                return
+            connection.send(("done", failures))
+            logger.info("Job done with {} failures".format(len(failures)))
+        except (EOFError, IOError):
+            logger.warning("Lost connection to client")
+        finally:
+            connection.close()
+
+    def _listen(self):
+        """Return the listener on the socket of the service.
+
+        :raises: RuntimeError if the socket exists and belongs to another
+                 user
+        """
+        if os.path.lexists(self.address):
+            if os.lstat(self.address).st_uid != os.getuid():
+                raise(RuntimeError("{} belongs to another user".format(
+                    self.address)))
+            os.remove(self.address)
+        key = authkey()
+        # Jobs are unpickled, so only the current user may connect: clients
+        # must know the secret key, and the socket is created without
+        # permissions for others, rather than restricted after it has been
+        # bound.
+        umask = os.umask(0o177)
+        try:
+            return Listener(self.address, family="AF_UNIX", authkey=key)
+        finally:
+            os.umask(umask)
+
+    def serve_forever(self):
+        """Accept jobs until interrupted.
+
+        :raises: RuntimeError if the socket exists and belongs to another
+                 user
+        """
+        try:
+            listener = self._listen()
+            logger.info("Listening on: {}".format(self.address))
+            try:
+                while True:
+                    try:
+                        connection = listener.accept()
+                    except (AuthenticationError, EOFError, IOError) as e:
+                        logger.warning("Rejected connection: {}".format(e))
+                        continue
+                    thread = threading.Thread(target=self.handle_connection,
+                                              args=(connection,))
+                    thread.daemon = True
+                    thread.start()
+            finally:
+                listener.close()
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+
+
+def submit_files(address, files, threshold, min_voxel, max_voxel,
+                 main_logger, options=None, journal=None, store=None,
+                 load_collection=None, series=None):
+    """Analyse all series of the input files on the analysis service.
+
+    The arguments are those of :func:`batch.analyse_files`. The records of
+    the analysis are handled by the main logger and :data:`run_report.logger`
+    as they are streamed back from the service.
+
+    :param address: path of the socket of the service; the empty string for
+                    :func:`default_address`
+    :param load_collection: module level function returning the microscopy
+                            collection of an input file, which the service
+                            imports by name; None for the default
+                            :func:`get_microscopy_collection`
+    :returns: list of descriptions of the failed work units
+    """
+    if not address:
+        address = default_address()
+    if load_collection is not None:
+        # The function is sent by name, as the service imports the scripts
+        # as modules rather than running them as __main__.
+        module_name = load_collection.__module__
+        if module_name == "__main__":
+            module_name = os.path.splitext(os.path.basename(
+                sys.modules["__main__"].__file__))[0]
+        load_collection = (module_name, load_collection.__name__)
+    files = list(files)
+    run_dir = None
+    journal_parameters = None
+    if journal is not None:
+        run_dir = os.path.dirname(journal.fpath)
+        journal_parameters = journal.parameters
+    job = dict(files=files, threshold=threshold, min_voxel=min_voxel,
+               max_voxel=max_voxel, options=options or {}, run_dir=run_dir,
+               journal_parameters=journal_parameters,
+               store=store.fpath if store is not None else None,
+               load_collection=load_collection, series=series)
+    try:
+        # Only submit jobs to a service run by the current user.
+        if os.stat(address).st_uid != os.getuid():
+            raise(RuntimeError("The socket {} belongs to another "
+                               "user".format(address)))
+        connection = Client(address, family="AF_UNIX", authkey=authkey())
+    except (EnvironmentError, AuthenticationError) as e:
+        raise(RuntimeError("No analysis service at {}: {}".format(address,
+                                                                   e)))
+    try:
+        connection.send(job)
+        while True:
+            kind, content = connection.recv()
+            if kind == "record":
+                if content.name == run_report.logger.name:
+                    run_report.logger.handle(content)
+                else:
+                    main_logger.handle(content)
+            elif kind == "done":
+                return content
+            else:
+                raise(RuntimeError("Analysis service failed:\n{}".format(
+                    content)))
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default=None,
+                        help="path of the socket to listen on (default: "
+                             "service.sock in $XDG_RUNTIME_DIR/plasmodesmata "
+                             "or ~/.plasmodesmata)")
+    parser.add_argument("--tasks-per-worker", default=None, type=int,
+                        help="replace each worker process after this many "
+                             "work units (default: never)")
+    add_jobs_argument(parser)
+    args = parser.parse_args()
+    if not HAVE_UNIX_SOCKETS:
+        parser.error("The analysis service needs Unix domain sockets")
+
+    logger.info("Script version: {}".format(__version__))
+    service = AnalysisService(args.address or default_address(), args.jobs,
+                              args.tasks_per_worker)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        parser.exit(1, "{}\n".format(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Compact representation of the objects of a 3D segmentation.
+
+Plasmodesmata are small objects filling a tiny fraction of the z-stack. Rather
+than keeping the whole label volume, :class:`SparseObjects` keeps the flat
+indices of the voxels of each object, grouped by object, and the bounding box
+of each object. The statistics, the geometry and the z-slices of the
+segmentation needed for annotation are all computed from these arrays, so
+that the memory held is proportional to the size of the objects rather than
+to the size of the z-stack.
+"""
+
+import numpy as np
+
+from object_statistics import ObjectStatistics, _reduce_sorted
+
+
+class SparseObjects(object):
+    """Voxels and bounding boxes of the objects of a 3D segmentation.
+
+    The voxels of object n, with identifier identifiers[n], are
+    indices[offsets[n]:offsets[n + 1]], as flat indices into an array of the
+    shape of the segmentation. The bounding box of the object includes the
+    coordinates lower[n] up to and including upper[n].
+    """
+
+    __slots__ = ["shape", "identifiers", "offsets", "indices", "lower",
+                 "upper", "_labels", "_zslice_order", "_zslice_offsets"]
+
+    def __init__(self, shape, identifiers, offsets, indices):
+        self.shape = shape
+        self.identifiers = identifiers
+        self.offsets = offsets
+        self.indices = indices
+        coords = np.unravel_index(indices, shape)
+        starts = offsets[:-1]
+        if len(identifiers) > 0:
+            self.lower = np.column_stack([np.minimum.reduceat(c, starts)
+                                          for c in coords])
+            self.upper = np.column_stack([np.maximum.reduceat(c, starts)
+                                          for c in coords])
+        else:
+            self.lower = np.zeros((0, len(shape)), dtype=int)
+            self.upper = np.zeros((0, len(shape)), dtype=int)
+
+        # Identifier of every voxel and the voxels ordered by z-slice.
+        self._labels = np.repeat(identifiers, self.voxel_counts())
+        self._zslice_order = np.argsort(coords[2], kind="mergesort")
+        self._zslice_offsets = np.searchsorted(
+            coords[2][self._zslice_order], np.arange(shape[2] + 1))
+
+    @classmethod
+    def from_labels(cls, labels, slab_size=None):
+        """Return the objects of a label volume.
+
+        :param labels: 3D array of identifiers with z as the last axis; zero
+                       represents the background
+        :param slab_size: number of z-slices of the label volume read at a
+                          time, e.g. from a memory-mapped file; defaults to
+                          all of them
+        :returns: :class:`SparseObjects`
+        """
+        shape = labels.shape
+        if slab_size is None:
+            slab_size = shape[2]
+        indices = []
+        values = []
+        for start in range(0, shape[2], slab_size):
+            slab = np.asarray(labels[:, :, start:start + slab_size])
+            rows, cols, zs = np.nonzero(slab)
+            indices.append(np.ravel_multi_index((rows, cols, zs + start),
+                                                shape))
+            values.append(slab[rows, cols, zs])
+        indices = np.concatenate(indices)
+        values = np.concatenate(values)
+
+        order = np.lexsort((indices, values))
+        indices = indices[order]
+        values = values[order]
+        starts = np.flatnonzero(np.concatenate(
+            ([True], values[1:] != values[:-1])))[:values.size]
+        identifiers = values[starts]
+        offsets = np.append(starts, values.size)
+        return cls(shape, identifiers, offsets, indices)
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def voxel_counts(self):
+        """Return array with the number of voxels of each object."""
+        return np.diff(self.offsets)
+
+    def bounding_box(self, n):
+        """Return tuple of slices of the bounding box of object n."""
+        return tuple(slice(lo, hi + 1)
+                     for lo, hi in zip(self.lower[n], self.upper[n]))
+
+    def statistics(self, intensity):
+        """Return the :class:`ObjectStatistics` of the objects.
+
+        :param intensity: intensity array of the shape of the segmentation
+        """
+        values = np.asarray(intensity).ravel()[self.indices]
+        voxels = np.ones(values.size, dtype=int)
+        reductions = _reduce_sorted(self._labels, voxels, values, values,
+                                    values)
+        background_voxels = int(np.prod(self.shape)) - self.indices.size
+        return ObjectStatistics(*reductions,
+                                background_voxels=background_voxels)
+
+    def geometry(self):
+        """Return the centroids and bounding boxes of the objects.
+
+        :returns: (centroids, lower, upper) arrays of shape (n, 3), as
+                  :func:`object_statistics.object_geometry`
+        """
+        coords = np.unravel_index(self.indices, self.shape)
+        counts = self.voxel_counts().astype(float)
+        starts = self.offsets[:-1]
+        centroids = np.zeros((len(self), len(self.shape)))
+        if len(self) > 0:
+            for axis, c in enumerate(coords):
+                centroids[:, axis] = np.add.reduceat(c, starts) / counts
+        return centroids, self.lower, self.upper
+
+    def zslice(self, z, keep=None):
+        """Return the 2D labels of the objects in a z-slice.
+
+        :param keep: boolean array indexed by identifier; only the flagged
+                     objects are included
+        """
+        rows, cols = self.shape[:2]
+        order = self._zslice_order[self._zslice_offsets[z]:
+                                   self._zslice_offsets[z + 1]]
+        labels = self._labels[order]
+        pixels = self.indices[order] // self.shape[2]
+        if keep is not None:
+            flags = keep[labels]
+            labels = labels[flags]
+            pixels = pixels[flags]
+        zslice = np.zeros(rows * cols, dtype=self._labels.dtype)
+        zslice[pixels] = labels
+        return zslice.reshape((rows, cols))
+
+    def projection(self, keep):
+        """Return 2D boolean array of the pixels of the flagged objects.
+
+        A pixel is set if a flagged object covers it in any z-slice.
+
+        :param keep: boolean array indexed by identifier
+        """
+        rows, cols = self.shape[:2]
+        mask = np.zeros(rows * cols, dtype=bool)
+        mask[self.indices[keep[self._labels]] // self.shape[2]] = True
+        return mask.reshape((rows, cols))
+
+    def select(self, keep):
+        """Return the segmentation restricted to the flagged identifiers."""
+        return SparseSelection(self, keep)
+
+
+class SparseSelection(object):
+    """Segmentation of the selected :class:`SparseObjects`.
+
+    Supports basic indexing like that of a label array, e.g. the z-slice
+    indexing ``selection[:, :, z]`` used by
+    :func:`plasmodesmata_analysis.annotate3D`. Only the indexed z-slices are
+    rendered, so that ``selection[:]`` or ``selection[...]`` builds the whole
+    label volume.
+    """
+
+    def __init__(self, objects, keep):
+        self.objects = objects
+        self.keep = keep
+
+    @property
+    def shape(self):
+        return self.objects.shape
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        if Ellipsis in index:
+            n = index.index(Ellipsis)
+            fill = (slice(None),) * (len(self.shape) - len(index) + 1)
+            index = index[:n] + fill + index[n + 1:]
+        if len(index) > len(self.shape):
+            raise(IndexError("too many indices for a 3D segmentation"))
+        index = index + (slice(None),) * (len(self.shape) - len(index))
+        rows, cols, z = index
+        zslices = range(self.shape[2])
+        if isinstance(z, slice):
+            zslices = zslices[z]
+            volume = np.zeros(tuple(self.shape[:2]) + (len(zslices),),
+                              dtype=self.objects.identifiers.dtype)
+            for n, zslice in enumerate(zslices):
+                volume[:, :, n] = self.objects.zslice(zslice, self.keep)
+            return volume[rows, cols]
+        return self.objects.zslice(zslices[z], self.keep)[rows, cols]
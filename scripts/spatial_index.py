@@ -0,0 +1,161 @@
+"""Spatial index of the plasmodesmata of a series.
+
+The centroids of the plasmodesmata are scaled by the voxel spacing of the
+series, so that distances are in microns, and indexed in a KD-tree. The
+nearest neighbour distance, the number of neighbours within a radius and the
+local density, and the cluster of every object are then computed from the
+index, in O(n log n) time in the number of objects. Objects closer than the
+cluster distance to each other are in the same cluster.
+
+The identifiers, centroids and voxel spacing of the index are saved with the
+other output of the series, so that further queries do not need the label
+volume or the centroids to be computed again. The KD-tree itself is not
+saved, as a pickled tree would tie the file to the scipy version that wrote
+it; it is built again from the centroids when the index is loaded, in
+O(n log n) time. If the voxel spacing of a series is not known, the
+distances are in voxels.
+
+Running this script prints the number of objects within a radius of a point
+of a saved index.
+"""
+
+import math
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+INDEX_FNAME = "spatial_index.npz"
+SPATIAL_HEADER = ["id", "row", "col", "z", "nn_distance", "neighbours",
+                  "density", "cluster"]
+
+
+class SpatialIndex(object):
+    """KD-tree of the centroids of objects.
+
+    :param identifiers: array of the identifiers of the objects
+    :param centroids: array of shape (n, 3) of centroids in voxels
+    :param spacing: (row, column, z) voxel spacing
+    """
+
+    def __init__(self, identifiers, centroids, spacing=(1., 1., 1.)):
+        self.identifiers = np.asarray(identifiers)
+        self.spacing = np.asarray(spacing, dtype=float)
+        self.points = np.asarray(centroids, dtype=float).reshape(
+            (-1, 3)) * self.spacing
+        self.tree = None
+        if len(self.points) > 0:
+            self.tree = cKDTree(self.points)
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def save(self, fpath):
+        """Save the identifiers, centroids and spacing to a .npz file."""
+        np.savez(fpath, identifiers=self.identifiers,
+                 centroids=self.points / self.spacing, spacing=self.spacing)
+
+    @classmethod
+    def load(cls, fpath):
+        """Return an index saved with :meth:`save`.
+
+        The KD-tree is built again from the saved centroids.
+        """
+        with np.load(fpath) as npz:
+            return cls(npz["identifiers"], npz["centroids"], npz["spacing"])
+
+    def nearest_neighbour_distances(self):
+        """Return array with the distance of each object to its nearest one.
+
+        The distance is infinite for an object without neighbours.
+        """
+        if len(self) < 2:
+            return np.repeat(np.inf, len(self))
+        distances, indices = self.tree.query(self.points, k=2)
+        return distances[:, 1]
+
+    def neighbour_counts(self, radius):
+        """Return array with the number of other objects within the radius."""
+        if len(self) == 0:
+            return np.zeros(0, dtype=int)
+        neighbours = self.tree.query_ball_point(self.points, radius)
+        return np.array([len(n) - 1 for n in neighbours], dtype=int)
+
+    def within(self, point, radius):
+        """Return the identifiers of the objects within radius of a point."""
+        if len(self) == 0:
+            return self.identifiers
+        return self.identifiers[sorted(self.tree.query_ball_point(point,
+                                                                  radius))]
+
+    def clusters(self, distance):
+        """Return array with the cluster of each object.
+
+        Objects closer than the distance to each other are in the same
+        cluster. The clusters are numbered from zero in the order of their
+        first object.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=int)
+        pairs = np.array(sorted(self.tree.query_pairs(distance)),
+                         dtype=int).reshape((-1, 2))
+        graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                           shape=(len(self), len(self)))
+        num_clusters, labels = connected_components(graph, directed=False)
+        return labels
+
+
+def spatial_table(index, radius, cluster_distance):
+    """Return the columns of the spatial statistics of the indexed objects.
+
+    The density is the number of neighbours within the radius divided by the
+    volume of the sphere of that radius.
+
+    :returns: ordered dictionary of column arrays
+    """
+    neighbours = index.neighbour_counts(radius)
+    centroids = index.points / index.spacing
+    table = OrderedDict()
+    table["id"] = index.identifiers
+    for axis, name in enumerate(["row", "col", "z"]):
+        table[name] = centroids[:, axis]
+    table["nn_distance"] = index.nearest_neighbour_distances()
+    table["neighbours"] = neighbours
+    table["density"] = neighbours / (4. / 3. * math.pi * radius ** 3)
+    table["cluster"] = index.clusters(cluster_distance)
+    return table
+
+
+def write_spatial_csv(table, fname):
+    """Write out a csv file with the spatial statistics of the objects."""
+    row = "{:d},{:.3f},{:.3f},{:.3f},{:.4f},{:d},{:.4g},{:d}\n"
+    with open(fname, "w") as fh:
+        fh.write("{}\n".format(",".join(SPATIAL_HEADER)))
+        for values in zip(*[table[name].tolist() for name in SPATIAL_HEADER]):
+            fh.write(row.format(*values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("index_file", help="path to a {} file".format(
+        INDEX_FNAME))
+    parser.add_argument("row", type=float, help="row of the point in voxels")
+    parser.add_argument("col", type=float,
+                        help="column of the point in voxels")
+    parser.add_argument("z", type=float, help="z-slice of the point")
+    parser.add_argument("radius", type=float,
+                        help="radius in the units of the index")
+    args = parser.parse_args()
+
+    index = SpatialIndex.load(args.index_file)
+    point = np.array([args.row, args.col, args.z]) * index.spacing
+    identifiers = index.within(point, args.radius)
+    print("{} objects: {}".format(len(identifiers),
+                                  " ".join(str(i) for i in identifiers)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Out-of-core segmentation of z-stacks that do not fit in memory.
+
+The z-stack is read in slabs of consecutive z-slices. Each slab is thresholded
+and labelled on its own and the partial object statistics of the slab are
+recorded. Objects that touch across the boundary between two slabs are then
+joined using a union-find over the labels of the boundary faces.
+
+The label volume is written to a memory-mapped file on disk, so that the peak
+memory use is bounded by the slab size rather than by the size of the stack.
+The objects and their statistics are the same as those of labelling the whole
+stack at once, but the identifiers may be numbered differently.
+"""
+
+import numpy as np
+import scipy.ndimage as nd
+
+from local_threshold import foreground
+from object_statistics import (
+    ObjectStatistics,
+    labelled_reductions,
+    combine_reductions,
+)
+
+#: Connectivity used by :func:`jicbioimage.segment.connected_components`.
+STRUCTURE = nd.generate_binary_structure(3, 2)
+
+#: In-plane offsets of the voxels connected to a voxel in the next z-slice.
+BOUNDARY_OFFSETS = [(0, 0), (1, 0), (-1, 0), (0, 1), (0, -1)]
+
+
+class CollectionSlabReader(object):
+    """Read z-slabs of a series one z-slice at a time.
+
+    Only the z-slices of the requested slab are held in memory.
+    """
+
+    def __init__(self, microscopy_collection, series, channel=0, timepoint=0):
+        self.proxy_images = list(microscopy_collection.zstack_proxy_iterator(
+            s=series, c=channel, t=timepoint))
+        self._shape = None
+
+    @property
+    def shape(self):
+        if self._shape is None:
+            rows, cols = self.zslice(0).shape
+            self._shape = (rows, cols, len(self.proxy_images))
+        return self._shape
+
+    @property
+    def zslices(self):
+        """Return list of z-slice indices."""
+        return list(range(len(self.proxy_images)))
+
+    def zslice(self, z):
+        """Return the 2D image of the z-slice."""
+        return self.proxy_images[z].image
+
+    def slab(self, start, stop):
+        """Return the z-slices from start up to stop as a 3D array."""
+        return np.dstack([self.zslice(z) for z in range(start, stop)])
+
+
+class UnionFind(object):
+    """Disjoint sets of the integers 0 up to size."""
+
+    def __init__(self, size):
+        self.parent = np.arange(size)
+
+    def find(self, i):
+        """Return the root of the set containing i."""
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        """Merge the sets containing i and j."""
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def roots(self):
+        """Return array with the root of every element."""
+        parent = self.parent
+        while True:
+            grand_parent = parent[parent]
+            if np.array_equal(grand_parent, parent):
+                return parent
+            parent = grand_parent
+
+
+def boundary_pairs(upper, lower):
+    """Return unique pairs of labels connected across a z-slice boundary.
+
+    :param upper: labels of the last z-slice of a slab
+    :param lower: labels of the first z-slice of the next slab
+    :returns: array of shape (n, 2)
+    """
+    rows, cols = upper.shape
+
+    def bounds(offset, size):
+        if offset >= 0:
+            return slice(0, size - offset), slice(offset, size)
+        return slice(-offset, size), slice(0, size + offset)
+
+    pairs = []
+    for dr, dc in BOUNDARY_OFFSETS:
+        upper_rows, lower_rows = bounds(dr, rows)
+        upper_cols, lower_cols = bounds(dc, cols)
+        a = upper[upper_rows, upper_cols]
+        b = lower[lower_rows, lower_cols]
+        touching = np.logical_and(a != 0, b != 0)
+        pairs.append(np.column_stack((a[touching], b[touching])))
+    pairs = np.concatenate(pairs)
+    if pairs.size == 0:
+        return pairs
+    base = int(lower.max()) + 1
+    unique_keys = np.unique(pairs[:, 0].astype(np.int64) * base + pairs[:, 1])
+    return np.column_stack((unique_keys // base, unique_keys % base))
+
+
+def segment_slabs(reader, threshold, slab_size, labels_fpath, local=None):
+    """Return labels and object statistics computed slab by slab.
+
+    :param reader: object with ``shape`` and ``slab(start, stop)``, e.g.
+                   :class:`CollectionSlabReader`
+    :param threshold: intensity cutoff
+    :param slab_size: number of z-slices per slab
+    :param labels_fpath: path of the .npy file to memory-map the labels to
+    :param local: (method, window, k) tuple of a local threshold, see
+                  :mod:`local_threshold`, or None for the absolute threshold
+    :returns: (labels memory-map, :class:`ObjectStatistics`)
+    """
+    shape = reader.shape
+    labels = np.lib.format.open_memmap(labels_fpath, mode="w+",
+                                       dtype=np.int32, shape=shape)
+
+    partial = []
+    pairs = []
+    background_voxels = 0
+    offset = 0
+    previous = None
+    for start in range(0, shape[2], slab_size):
+        stop = min(start + slab_size, shape[2])
+        intensity = reader.slab(start, stop)
+        slab_labels, num = nd.label(foreground(intensity, threshold, local),
+                                    structure=STRUCTURE, output=np.int32)
+        slab_labels[slab_labels != 0] += offset
+        labels[:, :, start:stop] = slab_labels
+
+        reductions = labelled_reductions(slab_labels, intensity)
+        partial.append(reductions)
+        background_voxels += slab_labels.size - np.sum(reductions[1])
+        if previous is not None:
+            pairs.append(boundary_pairs(previous, slab_labels[:, :, 0]))
+        previous = slab_labels[:, :, -1].copy()
+        offset += num
+        del intensity, slab_labels
+
+    # Join the objects touching across slab boundaries.
+    union_find = UnionFind(offset + 1)
+    for a, b in np.concatenate(pairs + [np.zeros((0, 2), dtype=int)]):
+        union_find.union(int(a), int(b))
+    roots = union_find.roots()
+    unique_roots, compact = np.unique(roots[1:], return_inverse=True)
+    lookup = np.zeros(offset + 1, dtype=np.int32)
+    lookup[1:] = compact + 1
+
+    if len(unique_roots) != offset:
+        for start in range(0, shape[2], slab_size):
+            stop = min(start + slab_size, shape[2])
+            labels[:, :, start:stop] = lookup[labels[:, :, start:stop]]
+    labels.flush()
+
+    identifiers, voxels, sums, mins, maxs = [
+        np.concatenate(column) for column in zip(*partial)]
+    reductions = combine_reductions(lookup[identifiers], voxels, sums,
+                                    mins, maxs)
+    return labels, ObjectStatistics(*reductions,
+                                    background_voxels=background_voxels)
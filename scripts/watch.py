@@ -0,0 +1,104 @@
+"""Watch acquisition directories for new images.
+
+The input directories are polled for image files. A file is only analysed
+once its size and modification time have not changed for the settle time, so
+that files still being written by the microscope are not picked up. A file
+that changes after it was analysed is analysed again once it is stable. Files
+whose series are all done according to the journal of the run are skipped,
+as in a single run.
+"""
+
+import os
+import time
+
+#: Seconds between polls of the input directories.
+POLL_INTERVAL = 10
+
+#: Seconds for which the size of a file must be unchanged.
+SETTLE_TIME = 30
+
+
+def add_watch_arguments(parser):
+    """Add the --watch options to an argument parser."""
+    parser.add_argument("--watch", action="store_true",
+                        help="keep analysing new images as they appear in "
+                             "the input directory, until interrupted")
+    parser.add_argument("--poll-interval", default=POLL_INTERVAL, type=float,
+                        help="seconds between looking for new images "
+                             "(default={})".format(POLL_INTERVAL))
+    parser.add_argument("--settle-time", default=SETTLE_TIME, type=float,
+                        help="seconds for which an image must be unchanged "
+                             "before it is analysed "
+                             "(default={})".format(SETTLE_TIME))
+
+
+class StableFiles(object):
+    """Files whose size and modification time have settled.
+
+    :param settle_time: seconds for which a file must be unchanged
+    """
+
+    def __init__(self, settle_time):
+        self.settle_time = settle_time
+        self._seen = {}
+        self._handled = {}
+
+    def update(self, fpaths, now=None):
+        """Return the files that have become stable since the last update.
+
+        :param fpaths: paths of all the files currently present
+        :param now: time of the update, by default the current time
+        """
+        if now is None:
+            now = time.time()
+        seen = {}
+        stable = []
+        for fpath in fpaths:
+            try:
+                stat = os.stat(fpath)
+            except OSError:
+                # The file has been removed since it was listed.
+                continue
+            state = (stat.st_size, stat.st_mtime)
+            previous_state, since = self._seen.get(fpath, (None, now))
+            if previous_state != state:
+                since = now
+            seen[fpath] = (state, since)
+            if (now - since >= self.settle_time
+                    and self._handled.get(fpath) != state):
+                self._handled[fpath] = state
+                stable.append(fpath)
+        self._seen = seen
+        return stable
+
+
+def watch_images(list_images, analyse, journal, poll_interval, settle_time,
+                 main_logger):
+    """Analyse the images as they appear, until interrupted.
+
+    :param list_images: function returning the (input file, output
+                        directory) tuples of all the images present
+    :param analyse: function analysing a list of such tuples
+    :param journal: :class:`journal.RunJournal` of the run
+    :param poll_interval: seconds between calls to list_images
+    :param settle_time: seconds for which an image must be unchanged
+    :param main_logger: logger reporting the new images
+    """
+    stable_files = StableFiles(settle_time)
+    main_logger.info("Watching for new images")
+    while True:
+        images = dict(list_images())
+        ready = []
+        for fpath in stable_files.update(images):
+            journal.refresh(fpath)
+            if journal.file_done(fpath):
+                continue
+            main_logger.info("New image: {}".format(fpath))
+            ready.append((fpath, images[fpath]))
+        if ready:
+            # Keep watching if the analysis of the new images fails.
+            try:
+                analyse(sorted(ready))
+            except Exception:
+                main_logger.exception("Failed to analyse new images")
+        time.sleep(poll_interval)
@@ -0,0 +1,85 @@
+"""Stand-ins for the bftools command line programs used by the tests.
+
+The microscopy files of the tests are NumPy .npy files of uint8 images with
+the shape (series, channels, time points, z-slices, rows, columns). The fake
+bfconvert writes their images to TIFF files named like those of the real one,
+and the fake showinf prints their dimensions in the format of the real one.
+"""
+
+import os
+import os.path
+import sys
+import stat
+
+import numpy as np
+
+BFCONVERT = '''#!{python}
+import sys
+import numpy as np
+from PIL import Image
+
+args = sys.argv[1:]
+if args == ["-version"]:
+    print("Version: fake")
+    sys.exit(0)
+options = {{}}
+while args[0].startswith("-"):
+    if args[0] == "-nolookup":
+        args = args[1:]
+        continue
+    options[args[0]] = int(args[1])
+    args = args[2:]
+input_file, pattern = args
+data = np.load(input_file)
+for s in range(data.shape[0]):
+    if options.get("-series", s) != s:
+        continue
+    for c in range(data.shape[1]):
+        if options.get("-channel", c) != c:
+            continue
+        for t in range(data.shape[2]):
+            for z in range(data.shape[3]):
+                fpath = pattern
+                for key, value in [("%s", s), ("%c", c), ("%z", z),
+                                   ("%t", t)]:
+                    fpath = fpath.replace(key, str(value))
+                Image.fromarray(data[s, c, t, z]).save(fpath)
+'''
+
+SHOWINF = '''#!{python}
+import sys
+import numpy as np
+
+data = np.load(sys.argv[-1])
+for s in range(data.shape[0]):
+    print("Series #{{}} :".format(s))
+    print("\\tSizeZ = {{}}".format(data.shape[3]))
+    print("\\tSizeT = {{}}".format(data.shape[2]))
+    print("\\tSizeC = {{}}".format(data.shape[1]))
+print('<OME>' + ''.join(
+    '<Image><Pixels PhysicalSizeX="0.1" PhysicalSizeY="0.1" '
+    'PhysicalSizeZ="0.5"/></Image>' for s in range(data.shape[0])) +
+    '</OME>')
+'''
+
+
+def install(bin_dir):
+    """Write the fake programs to a directory and return the new PATH."""
+    for name, template in [("bfconvert", BFCONVERT), ("showinf", SHOWINF)]:
+        fpath = os.path.join(bin_dir, name)
+        with open(fpath, "w") as fh:
+            fh.write(template.format(python=sys.executable))
+        os.chmod(fpath, os.stat(fpath).st_mode | stat.S_IEXEC)
+    return os.pathsep.join([bin_dir, os.environ.get("PATH", "")])
+
+
+def microscopy_file(fpath, shape, seed=0):
+    """Write a fake microscopy file and return its images.
+
+    :param shape: (series, channels, time points, z-slices, rows, columns)
+    """
+    data = np.random.RandomState(seed).randint(0, 256, shape).astype(
+        np.uint8)
+    with open(fpath, "wb") as fh:
+        np.save(fh, data)
+    return data
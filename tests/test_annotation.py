@@ -0,0 +1,88 @@
+"""Equivalence tests of the annotated images.
+
+The outlines of all objects in a z-slice are drawn at once by
+:func:`plasmodesmata_analysis.object_borders`. They are compared with those
+drawn one region at a time, as done by the original annotate transformation.
+"""
+
+import os
+import os.path
+import sys
+import unittest
+
+import numpy as np
+import scipy.ndimage as nd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+import plasmodesmata_analysis  # NOQA
+from plasmodesmata_analysis import (  # NOQA
+    annotation_array,
+    color_lookup,
+    grayscale,
+    object_borders,
+)
+from jicbioimage.illustrate import AnnotatedImage  # NOQA
+from jicbioimage.segment import SegmentedImage, connected_components  # NOQA
+
+THRESHOLD = 150
+
+
+def reference_annotation(gray, zslice):
+    """Return the annotation drawn as by the original annotate."""
+    annotation = AnnotatedImage.from_grayscale(gray)
+    segmentation = SegmentedImage.from_array(zslice)
+    for i in segmentation.identifiers:
+        region = segmentation.region_by_identifier(i)
+        annotation.mask_region(region.dilate(1).border,
+                               color=plasmodesmata_analysis.pretty_color(i))
+    return np.asarray(annotation)
+
+
+class ObjectBordersTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(1)
+        noise = nd.gaussian_filter(random.normal(size=(30, 25, 6)), 1.)
+        noise = (noise - noise.min()) / (noise.max() - noise.min())
+        self.intensity = (noise * 255).astype(np.uint16)
+        self.labels = np.asarray(connected_components(
+            self.intensity > THRESHOLD, background=0))
+
+    def test_has_overlapping_outlines(self):
+        # Some outlines overlap, so the order in which they are drawn matters.
+        overlaps = 0
+        for z in range(self.labels.shape[2]):
+            segmentation = SegmentedImage.from_array(self.labels[:, :, z])
+            count = np.zeros(segmentation.shape, dtype=int)
+            for i in segmentation.identifiers:
+                region = segmentation.region_by_identifier(i)
+                count += np.asarray(region.dilate(1).border)
+            overlaps += np.sum(count > 1)
+        self.assertTrue(self.labels.max() > 10)
+        self.assertTrue(overlaps > 0)
+
+    def test_borders_of_each_region(self):
+        for z in range(self.labels.shape[2]):
+            zslice = self.labels[:, :, z]
+            expected = np.zeros(zslice.shape, dtype=zslice.dtype)
+            segmentation = SegmentedImage.from_array(zslice)
+            for i in segmentation.identifiers:
+                region = segmentation.region_by_identifier(i)
+                expected[np.asarray(region.dilate(1).border)] = i
+            self.assertTrue(np.array_equal(object_borders(zslice), expected),
+                            z)
+
+    def test_annotation_identical(self):
+        colors = color_lookup(np.unique(self.labels).tolist())
+        for z in range(self.labels.shape[2]):
+            gray = grayscale(self.intensity[:, :, z])
+            zslice = self.labels[:, :, z]
+            self.assertTrue(np.array_equal(
+                annotation_array(gray, zslice, colors),
+                reference_annotation(gray, zslice)), z)
+
+
+if __name__ == "__main__":
+    unittest.main()
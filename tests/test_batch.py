@@ -0,0 +1,72 @@
+"""Tests of the scheduling of the work units on a pool of processes."""
+
+import os
+import os.path
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from batch import _RecordCollector, analyse_files  # NOQA
+
+
+class _Collection(object):
+    series = []
+
+
+def _load_collection(fpath):
+    return _Collection()
+
+
+class AnalyseFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.collector = _RecordCollector()
+        self.logger = logging.Logger("batch-test")
+        self.logger.addHandler(self.collector)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def loaded(self):
+        return [r for r in self.collector.records
+                if r.getMessage().startswith("Analysing image")]
+
+    def test_files_taken_as_loads_are_handled(self):
+        jobs = 2
+        handled = []
+
+        def files():
+            for n in range(8):
+                # Only jobs loads are submitted ahead of those handled.
+                handled.append(len(self.loaded()))
+                self.assertTrue(handled[-1] >= n - jobs, handled)
+                fname = "image{}".format(n)
+                yield (os.path.join(self.tmp_dir, fname + ".lif"),
+                       os.path.join(self.tmp_dir, fname))
+
+        failures = analyse_files(files(), _load_collection, 100, 1, 10, jobs,
+                                 self.logger)
+        self.assertEqual(failures, [])
+        self.assertEqual(len(handled), 8)
+        self.assertEqual(len(self.loaded()), 8)
+
+    def test_failing_iterable(self):
+
+        def files():
+            yield (os.path.join(self.tmp_dir, "image.lif"),
+                   os.path.join(self.tmp_dir, "image"))
+            raise(ValueError("no more files"))
+
+        self.assertRaises(ValueError, analyse_files, files(),
+                          _load_collection, 100, 1, 10, 2, self.logger)
+        self.assertEqual(len(self.loaded()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""Tests of the co-localisation and of the analysis of several channels."""
+
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import numpy as np
+import scipy.ndimage as nd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from colocalisation import (  # NOQA
+    colocalisation_table,
+    write_colocalisation_csv,
+)
+from multichannel import analyse_channels, channel_dirname  # NOQA
+from sparse_objects import SparseObjects  # NOQA
+
+
+class ColocalisationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        random = np.random.RandomState(6)
+        shape = (30, 25, 8)
+        noise = nd.gaussian_filter(random.normal(size=shape), 1.)
+        noise = (noise - noise.min()) / (noise.max() - noise.min())
+        self.reference = (noise * 255).astype(np.uint16)
+        # A correlated and an unrelated channel.
+        self.correlated = (self.reference * 2 + random.randint(
+            0, 60, size=shape)).astype(np.uint16)
+        self.unrelated = random.randint(0, 255, size=shape).astype(np.uint16)
+        self.labels, num = nd.label(self.reference > 160)
+        self.objects = SparseObjects.from_labels(self.labels)
+        self.others = [(1, self.correlated), (2, self.unrelated)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_statistics_of_each_object(self):
+        table = colocalisation_table(self.objects, self.reference,
+                                     self.others)
+        self.assertEqual(table["id"].tolist(),
+                         np.unique(self.labels)[1:].tolist())
+        num_correlated = 0
+        for n, i in enumerate(table["id"]):
+            region = self.labels == i
+            x = self.reference[region].astype(float)
+            for channel, intensity in self.others:
+                y = intensity[region].astype(float)
+                name = "c{}_".format(channel)
+                self.assertEqual(table[name + "sum"][n], np.sum(y))
+                self.assertAlmostEqual(table[name + "mean"][n], np.mean(y))
+                pearson = table[name + "pearson"][n]
+                if len(x) < 2:
+                    self.assertTrue(np.isnan(pearson))
+                    continue
+                self.assertAlmostEqual(pearson, np.corrcoef(x, y)[0, 1])
+                if channel == 1 and pearson > 0.5:
+                    num_correlated += 1
+        self.assertTrue(num_correlated > 0)
+
+    def test_constant_channel(self):
+        constant = np.full(self.reference.shape, 7, dtype=np.uint16)
+        table = colocalisation_table(self.objects, self.reference,
+                                     [(1, constant)])
+        self.assertTrue(np.all(np.isnan(table["c1_pearson"])))
+        self.assertTrue(np.all(table["c1_mean"] == 7))
+
+    def test_no_objects(self):
+        objects = SparseObjects.from_labels(np.zeros((4, 4, 2), dtype=int))
+        table = colocalisation_table(objects, self.reference[:4, :4, :2],
+                                     [(1, self.correlated[:4, :4, :2])])
+        self.assertEqual([len(column) for column in table.values()],
+                         [0, 0, 0, 0])
+
+    def test_csv(self):
+        table = colocalisation_table(self.objects, self.reference,
+                                     self.others)
+        keep = np.zeros(self.labels.max() + 1, dtype=bool)
+        keep[table["id"][::2]] = True
+        fpath = os.path.join(self.tmp_dir, "colocalisation.csv")
+        write_colocalisation_csv(table, keep, fpath)
+        with open(fpath) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines[0].split(","), list(table.keys()))
+        self.assertEqual([int(line.split(",")[0]) for line in lines[1:]],
+                         table["id"][::2].tolist())
+
+
+class _Collection(object):
+
+    def channels(self, series):
+        return [0, 1, 2]
+
+    def timepoints(self, series):
+        return [0, 1]
+
+
+class _Stack(object):
+
+    def __init__(self, collection, series, channel, timepoint):
+        self.array = np.full((2, 2, 2), 10 * timepoint + channel)
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+class AnalyseChannelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def analyse(self, **kwargs):
+        calls = []
+
+        def analysis(collection, series, threshold, min_voxel, max_voxel,
+                     output_dir, stack=None, colocalise=None, **options):
+            channel = int(stack.array.flat[0]) % 10
+            calls.append((os.path.basename(output_dir), channel,
+                          [(c, int(a.flat[0])) for c, a in colocalise]))
+            return "table"
+        with mock.patch("multichannel.SeriesStack", _Stack), \
+                mock.patch("multichannel.plasmodesmata_analysis", analysis):
+            results = analyse_channels(_Collection(), 0, 100, 2, 50,
+                                       self.tmp_dir, **kwargs)
+        return results, sorted(calls)
+
+    def test_other_channels_measured(self):
+        results, calls = self.analyse(channels=[0, 2], timepoints=[1])
+        self.assertEqual(sorted(results), [(0, 1, "table"), (2, 1, "table")])
+        self.assertEqual(calls, [
+            (channel_dirname(0, 1), 0, [(1, 11), (2, 12)]),
+            (channel_dirname(2, 1), 2, [(0, 10), (1, 11)]),
+        ])
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp_dir, "c2_t1")))
+
+    def test_all_channels_and_timepoints(self):
+        results, calls = self.analyse(channels="all", timepoints="all")
+        self.assertEqual(sorted((c, t) for c, t, table in results),
+                         [(c, t) for c in range(3) for t in range(2)])
+
+    def test_missing_channel(self):
+        self.assertRaises(ValueError, self.analyse, channels=[3])
+
+    def test_slabs_refused(self):
+        self.assertRaises(ValueError, self.analyse, channels=[0],
+                          slab_size=4)
+
+
+if __name__ == "__main__":
+    unittest.main()
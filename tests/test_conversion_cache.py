@@ -0,0 +1,143 @@
+"""Tests of the conversion cache, run with a fake bfconvert."""
+
+import os
+import os.path
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+import conversion_cache  # NOQA
+from conversion_cache import ConversionCache, unpacked_collection  # NOQA
+import fake_bftools  # NOQA
+
+
+@unittest.skipIf(sys.platform == "win32", "the fake bftools need a shebang")
+class UnpackedCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.tmp_dir, "bin")
+        os.mkdir(bin_dir)
+        self.path = os.environ.get("PATH")
+        os.environ["PATH"] = fake_bftools.install(bin_dir)
+        conversion_cache._converter_version = None
+        self.input_file = os.path.join(self.tmp_dir, "leaf.lif")
+        # More than ten z-slices, so that they need sorting numerically.
+        self.data = fake_bftools.microscopy_file(self.input_file,
+                                                 (2, 2, 1, 11, 6, 5))
+        self.cache = ConversionCache(os.path.join(self.tmp_dir, "cache"))
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        conversion_cache._converter_version = None
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reads_images(self):
+        collection = unpacked_collection(self.input_file, self.cache)
+        self.assertEqual(collection.series, [0, 1])
+        self.assertEqual(collection.channels(1), [0, 1])
+        for s in range(2):
+            for c in range(2):
+                zstack = collection.zstack_array(s=s, c=c)
+                expected = np.dstack(list(self.data[s, c, 0]))
+                self.assertTrue(np.array_equal(zstack, expected))
+
+    def test_manifest_filenames_relative_to_entry(self):
+        collection = unpacked_collection(self.input_file, self.cache)
+        entry_dir = os.path.dirname(collection[0].fpath)
+        self.assertEqual(os.path.dirname(entry_dir), self.cache.directory)
+        with open(os.path.join(entry_dir, "manifest.json")) as fh:
+            for entry in json.load(fh):
+                self.assertEqual(entry["filename"],
+                                 os.path.basename(entry["filename"]))
+        for proxy_image in collection:
+            self.assertTrue(os.path.isfile(proxy_image.fpath))
+
+    def test_entry_reused(self):
+        first = unpacked_collection(self.input_file, self.cache)
+        second = unpacked_collection(self.input_file, self.cache)
+        self.assertEqual([p.fpath for p in first], [p.fpath for p in second])
+        self.assertEqual(len(self.cache.entries()), 1)
+
+
+def _write_copy(input_file, output_dir):
+    with open(input_file, "rb") as fh:
+        data = fh.read()
+    with open(os.path.join(output_dir, "copy"), "wb") as fh:
+        fh.write(data)
+
+
+@unittest.skipIf(sys.platform == "win32", "the fake bftools need a shebang")
+class CacheEntryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.tmp_dir, "bin")
+        os.mkdir(bin_dir)
+        self.path = os.environ.get("PATH")
+        os.environ["PATH"] = fake_bftools.install(bin_dir)
+        conversion_cache._converter_version = None
+        self.input_files = []
+        for n in range(3):
+            fpath = os.path.join(self.tmp_dir, "{}.lif".format(n))
+            with open(fpath, "wb") as fh:
+                fh.write(os.urandom(1000))
+            self.input_files.append(fpath)
+        self.cache = ConversionCache(os.path.join(self.tmp_dir, "cache"))
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        conversion_cache._converter_version = None
+        shutil.rmtree(self.tmp_dir)
+
+    def test_entry_locked_until_released(self):
+        entry = self.cache.get(self.input_files[0], "copy", _write_copy)
+        self.assertEqual(self.cache.evict(0), [])
+        entry.release()
+        self.assertEqual(len(self.cache.evict(0)), 1)
+        self.assertFalse(os.path.isdir(entry.directory))
+
+    def test_with_block_releases_entry(self):
+        with self.cache.get(self.input_files[0], "copy",
+                            _write_copy) as entry_dir:
+            self.assertTrue(os.path.isfile(os.path.join(entry_dir, "copy")))
+            self.assertEqual(self.cache.evict(0), [])
+        self.assertEqual(len(self.cache.evict(0)), 1)
+
+    def test_size_recorded(self):
+        with self.cache.get(self.input_files[0], "copy", _write_copy):
+            pass
+        entry, = self.cache.entries()
+        self.assertEqual(entry["size"], 1000)
+
+    def test_cap_evicts_least_recently_used(self):
+        for fpath in self.input_files[:2]:
+            with self.cache.get(fpath, "copy", _write_copy):
+                pass
+        size = self.cache.entries()[0]["size"]
+        self.cache.max_bytes = 2 * size
+        with self.cache.get(self.input_files[2], "copy", _write_copy):
+            pass
+        sources = [e["source"] for e in self.cache.entries()]
+        self.assertEqual(sources, self.input_files[1:])
+
+    def test_eviction_prunes_hashes(self):
+        for fpath in self.input_files[:2]:
+            with self.cache.get(fpath, "copy", _write_copy):
+                pass
+        self.cache.evict(self.cache.entries()[0]["size"])
+        with open(os.path.join(self.cache.directory, "hashes.json")) as fh:
+            memo = json.load(fh)
+        self.assertEqual(list(memo.values()),
+                         [self.cache.content_hash(self.input_files[1])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests of the on demand unpacking of series, run with fake bftools."""
+
+import os
+import os.path
+import sys
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+import conversion_cache  # NOQA
+from conversion_cache import ConversionCache  # NOQA
+from lazy_collection import LazyCollection  # NOQA
+import fake_bftools  # NOQA
+
+
+@unittest.skipIf(sys.platform == "win32", "the fake bftools need a shebang")
+class LazyCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.tmp_dir, "bin")
+        os.mkdir(bin_dir)
+        self.path = os.environ.get("PATH")
+        os.environ["PATH"] = fake_bftools.install(bin_dir)
+        conversion_cache._converter_version = None
+        self.input_file = os.path.join(self.tmp_dir, "leaf.lif")
+        self.data = fake_bftools.microscopy_file(self.input_file,
+                                                 (3, 2, 2, 4, 6, 5))
+        self.cache = ConversionCache(os.path.join(self.tmp_dir, "cache"))
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        conversion_cache._converter_version = None
+        shutil.rmtree(self.tmp_dir)
+
+    def test_dimensions_without_unpacking(self):
+        collection = LazyCollection(self.input_file, self.cache)
+        self.assertEqual(collection.series, [0, 1, 2])
+        self.assertEqual(collection.channels(1), [0, 1])
+        self.assertEqual(collection.timepoints(1), [0, 1])
+        self.assertEqual(collection.zslices(1), [0, 1, 2, 3])
+        self.assertEqual(collection.voxel_spacing(1), (0.1, 0.1, 0.5))
+        self.assertEqual([e["kind"] for e in self.cache.entries()],
+                         ["series"])
+
+    def test_collection_reads_images(self):
+        collection = LazyCollection(self.input_file, self.cache)
+        image = collection.image(s=2, c=1, z=3, t=1)
+        self.assertTrue(np.array_equal(image, self.data[2, 1, 1, 3]))
+        zstack = collection.zstack_array(s=1, c=0, t=1)
+        self.assertTrue(np.array_equal(zstack,
+                                       np.dstack(list(self.data[1, 0, 1]))))
+        kinds = sorted(e["kind"] for e in self.cache.entries())
+        self.assertEqual(kinds, ["series", "unpacked-s1-c0",
+                                 "unpacked-s2-c1"])
+
+    def test_pickled_collection_reads_images(self):
+        collection = LazyCollection(self.input_file, self.cache)
+        collection.image(s=0, c=0)
+        collection = pickle.loads(pickle.dumps(collection))
+        image = collection.image(s=0, c=0, z=2, t=0)
+        self.assertTrue(np.array_equal(image, self.data[0, 0, 0, 2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
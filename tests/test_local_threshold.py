@@ -0,0 +1,123 @@
+"""Tests of the thresholds corrected for the local background.
+
+The chunks of rows of the multi-threaded segmentation and the slabs of the
+slab-wise segmentation are thresholded with the rows and z-slices they need
+from their neighbours, so their labels are compared with those of the whole
+z-stack thresholded at once.
+"""
+
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.ndimage as nd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from local_threshold import foreground, halo  # NOQA
+from parallel_segmentation import parallel_label  # NOQA
+from streaming import STRUCTURE, segment_slabs  # NOQA
+
+#: (method, window, k) tuples and the thresholds used with them.
+LOCAL_THRESHOLDS = [
+    (("mean", 9, 3.0), 20),
+    (("tophat", 9, 3.0), 40),
+    (("sigma", 7, 1.0), 100),
+]
+
+
+def canonical(labels):
+    """Return labels renumbered in the order of the first voxel of each object.
+
+    Two label arrays hold the same objects if their canonical labels are
+    equal.
+    """
+    labels = np.asarray(labels)
+    identifiers, first = np.unique(labels.ravel(), return_index=True)
+    first = first[identifiers != 0]
+    identifiers = identifiers[identifiers != 0]
+    lookup = np.zeros(int(labels.max()) + 1, dtype=int)
+    lookup[identifiers[np.argsort(first)]] = np.arange(1, len(identifiers) + 1)
+    return lookup[labels]
+
+
+class _ArrayReader(object):
+
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+
+    def slab(self, start, stop):
+        return self.array[:, :, start:stop]
+
+
+class LocalThresholdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        random = np.random.RandomState(2)
+        noise = nd.gaussian_filter(random.normal(size=(40, 30, 8)), 1.)
+        noise = (noise - noise.min()) / (noise.max() - noise.min())
+        # A bright gradient across the rows, as of an unevenly lit tile.
+        gradient = np.linspace(0, 60, 40)[:, np.newaxis, np.newaxis]
+        self.intensity = (noise * 195 + gradient).astype(np.uint16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def whole_stack_labels(self, threshold, local):
+        labels, num = nd.label(foreground(self.intensity, threshold, local),
+                               structure=STRUCTURE)
+        self.assertTrue(num > 5, local)
+        return labels
+
+    def test_halo(self):
+        self.assertEqual(halo(None), 0)
+        self.assertEqual(halo(("abs", 9, 3.0)), 0)
+        self.assertEqual(halo(("mean", 9, 3.0)), 4)
+        self.assertEqual(halo(("tophat", 9, 3.0)), 8)
+
+    def test_mean(self):
+        image = self.intensity[:, :, 0].astype(float)
+        mean = nd.uniform_filter(image, size=9, mode="reflect")
+        self.assertTrue(np.array_equal(
+            foreground(self.intensity[:, :, 0], 20, ("mean", 9, 3.0)),
+            image - mean > 20))
+
+    def test_slices_thresholded_separately(self):
+        for local, threshold in LOCAL_THRESHOLDS:
+            mask = foreground(self.intensity, threshold, local)
+            for z in range(self.intensity.shape[2]):
+                self.assertTrue(np.array_equal(
+                    mask[:, :, z],
+                    foreground(self.intensity[:, :, z], threshold, local)))
+
+    def test_chunked_labels_identical(self):
+        # With 13 threads the chunks of three or four rows are narrower
+        # than the halo of the windows.
+        for local, threshold in LOCAL_THRESHOLDS:
+            expected = self.whole_stack_labels(threshold, local)
+            for threads in [1, 4, 13]:
+                labels = parallel_label(self.intensity, threshold, threads,
+                                        local)
+                self.assertTrue(np.array_equal(labels, expected),
+                                (local, threads))
+
+    def test_slab_labels_same_objects(self):
+        for local, threshold in LOCAL_THRESHOLDS:
+            expected = canonical(self.whole_stack_labels(threshold, local))
+            for slab_size in [1, 3, 8]:
+                labels, statistics = segment_slabs(
+                    _ArrayReader(self.intensity), threshold, slab_size,
+                    os.path.join(self.tmp_dir, "labels.npy"), local)
+                self.assertTrue(np.array_equal(canonical(labels), expected),
+                                (local, slab_size))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Tests of the handling of images that fail to convert to OME-TIF."""
+
+import os
+import os.path
+import sys
+import shutil
+import argparse
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+import nikon_analyse_all_images  # NOQA
+from journal import FAILED  # NOQA
+
+
+class FailedConversionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmp_dir, "input")
+        os.mkdir(self.input_dir)
+        self.fpaths = []
+        for name in ["broken.nd2", "leaf.nd2"]:
+            self.fpaths.append(os.path.join(self.input_dir, name))
+            open(self.fpaths[-1], "w").close()
+        self.args = argparse.Namespace(
+            input_dir=self.input_dir,
+            output_dir=os.path.join(self.tmp_dir, "output"), threshold=500,
+            min_voxel=2, max_voxel=50, jobs=1, converters=1, service=None)
+        os.mkdir(self.args.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sequential_run_continues(self):
+        def convert(fpath, cache=None):
+            if fpath == self.fpaths[0]:
+                raise(RuntimeError("bfconvert failed"))
+            return mock.Mock()
+
+        journal = mock.Mock()
+        journal.file_done.return_value = False
+        module = "nikon_analyse_all_images."
+        with mock.patch(module + "convert", convert), \
+                mock.patch(module + "analysis_options", return_value={}), \
+                mock.patch(module + "load_microscopy_collection"), \
+                mock.patch(module + "analyse_all") as analyse_all:
+            nikon_analyse_all_images.analyse_dir(self.args, journal,
+                                                 mock.Mock())
+        journal.record.assert_called_once_with(self.fpaths[0], None, FAILED)
+        self.assertEqual(analyse_all.call_count, 1)
+        self.assertEqual(analyse_all.call_args[0][6], self.fpaths[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
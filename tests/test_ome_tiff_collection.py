@@ -0,0 +1,94 @@
+"""Tests of the collection served from an OME-TIF file."""
+
+import os
+import os.path
+import sys
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import tifffile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from ome_tiff_collection import OmeTiffCollection  # NOQA
+
+OME_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06">'
+    '<Image ID="Image:0"><Pixels ID="Pixels:0" DimensionOrder="XYCZT" '
+    'Type="uint16" SizeX="{cols}" SizeY="{rows}" SizeC="{channels}" '
+    'SizeZ="{zslices}" SizeT="1" PhysicalSizeX="0.1" PhysicalSizeY="0.1" '
+    'PhysicalSizeZ="0.5">{channel_elements}'
+    '<TiffData IFD="0" PlaneCount="{planes}"/></Pixels></Image></OME>')
+
+
+def write_ome_tiff(fpath, data, compression=None):
+    """Write a (z-slices, channels, rows, columns) array as bfconvert does.
+
+    Each plane is written as a page with its directory in front of its image
+    data, so that the image data of the pages is not contiguous.
+    """
+    zslices, channels, rows, cols = data.shape
+    channel_elements = "".join(
+        '<Channel ID="Channel:0:{}" SamplesPerPixel="1"/>'.format(c)
+        for c in range(channels))
+    description = OME_XML.format(cols=cols, rows=rows, channels=channels,
+                                 zslices=zslices, planes=zslices * channels,
+                                 channel_elements=channel_elements)
+    with tifffile.TiffWriter(fpath) as tif:
+        for n, plane in enumerate(data.reshape((-1, rows, cols))):
+            tif.write(plane, contiguous=False, metadata=None,
+                      compression=compression,
+                      description=description if n == 0 else None)
+
+
+class OmeTiffCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.tmp_dir, "converted.ome.tif")
+        random = np.random.RandomState(0)
+        self.data = random.randint(0, 4096, (4, 2, 7, 5)).astype(np.uint16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertPlanes(self, collection):
+        self.assertEqual(collection.zslices(), [0, 1, 2, 3])
+        self.assertEqual(collection.channels(), [0, 1])
+        for c in range(2):
+            for z in range(4):
+                self.assertTrue(np.array_equal(collection.plane(c, z),
+                                               self.data[z, c]))
+            self.assertTrue(np.array_equal(
+                collection.zstack_array(c=c),
+                np.dstack(list(self.data[:, c]))))
+
+    def test_pages_separated_by_directories(self):
+        write_ome_tiff(self.fpath, self.data)
+        self.assertRaises(ValueError, tifffile.memmap, self.fpath, mode="r")
+        collection = OmeTiffCollection(self.fpath)
+        self.assertTrue(all(layout is not None
+                            for layout in collection.layouts))
+        self.assertPlanes(collection)
+        self.assertEqual(collection.voxel_spacing(), (0.1, 0.1, 0.5))
+
+    def test_compressed_pages(self):
+        write_ome_tiff(self.fpath, self.data, compression="zlib")
+        collection = OmeTiffCollection(self.fpath)
+        self.assertTrue(all(layout is None for layout in collection.layouts))
+        self.assertPlanes(collection)
+
+    def test_pickled_collection(self):
+        write_ome_tiff(self.fpath, self.data)
+        collection = OmeTiffCollection(self.fpath)
+        collection.plane(0, 0)
+        self.assertPlanes(pickle.loads(pickle.dumps(collection)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Tests of the parameter sweep against a segmentation at each threshold."""
+
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.ndimage as nd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from plasmodesmata_analysis import size_categories  # NOQA
+from jicbioimage.segment import connected_components  # NOQA
+from object_statistics import ObjectStatistics  # NOQA
+from parameter_sweep import (  # NOQA
+    SWEEP_HEADER,
+    sweep_rows,
+    threshold_statistics,
+    write_sweep_csv,
+)
+
+THRESHOLDS = [120, 150, 160, 200]
+MIN_VOXELS = [1, 3]
+MAX_VOXELS = [10, 50]
+
+
+def object_rows(statistics):
+    """Return the sorted (voxels, sum, min, max) rows of the objects."""
+    return sorted(zip(statistics.voxels.tolist(), statistics.sum.tolist(),
+                      statistics.min.tolist(), statistics.max.tolist()))
+
+
+class ParameterSweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        random = np.random.RandomState(3)
+        noise = nd.gaussian_filter(random.normal(size=(30, 25, 10)), 1.)
+        noise = (noise - noise.min()) / (noise.max() - noise.min())
+        self.intensity = (noise * 255).astype(np.uint16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def segmentation_statistics(self, threshold):
+        labels = np.asarray(connected_components(self.intensity > threshold,
+                                                 background=0))
+        return ObjectStatistics.from_segmentation(labels, self.intensity)
+
+    def test_statistics_at_each_threshold(self):
+        thresholds = []
+        for threshold, statistics in threshold_statistics(self.intensity,
+                                                          THRESHOLDS):
+            thresholds.append(threshold)
+            expected = self.segmentation_statistics(threshold)
+            self.assertTrue(len(expected.identifiers) > 0, threshold)
+            self.assertEqual(object_rows(statistics), object_rows(expected),
+                             threshold)
+            self.assertEqual(statistics.background_voxels,
+                             expected.background_voxels)
+        self.assertEqual(thresholds, sorted(THRESHOLDS, reverse=True))
+
+    def test_counts_at_each_threshold(self):
+        rows = list(sweep_rows(self.intensity, THRESHOLDS, MIN_VOXELS,
+                               MAX_VOXELS))
+        self.assertEqual(len(rows),
+                         len(THRESHOLDS) * len(MIN_VOXELS) * len(MAX_VOXELS))
+        merged = 0
+        for row in rows:
+            statistics = self.segmentation_statistics(row["threshold"])
+            kept, small, large = [
+                category[statistics.identifiers] for category in
+                size_categories(statistics.voxel_counts(), row["min_voxel"],
+                                row["max_voxel"])]
+            self.assertEqual(row["plasmodesmata"], np.sum(kept), row)
+            self.assertEqual(row["small_removed"], np.sum(small), row)
+            self.assertEqual(row["large_removed"], np.sum(large), row)
+            self.assertEqual(row["voxels"],
+                             np.sum(statistics.voxels[kept]), row)
+            self.assertEqual(row["max_intensity"],
+                             np.max(statistics.max[kept]), row)
+            merged += row["large_removed"]
+        # Objects grow and merge as the threshold goes down.
+        self.assertTrue(merged > 0)
+
+    def test_csv(self):
+        fpath = os.path.join(self.tmp_dir, "sweep.csv")
+        write_sweep_csv(self.intensity, THRESHOLDS, MIN_VOXELS, MAX_VOXELS,
+                        fpath)
+        with open(fpath) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines[0], ",".join(SWEEP_HEADER))
+        keys = [tuple(int(v) for v in line.split(",")[:3])
+                for line in lines[1:]]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+
+
+if __name__ == "__main__":
+    unittest.main()
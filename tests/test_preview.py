@@ -0,0 +1,148 @@
+"""Tests of the projection previews and their tile pyramids."""
+
+import os
+import os.path
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import numpy as np
+import scipy.ndimage as nd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+import preview  # NOQA
+from preview import (  # NOQA
+    CATEGORY_COLORS,
+    PREVIEW_FNAME,
+    TILE_SIZE,
+    TILES_DIRNAME,
+    max_projection,
+    outline,
+    render,
+    write_preview,
+    write_tiles,
+)
+from jicbioimage.segment import Region  # NOQA
+from sparse_objects import SparseObjects  # NOQA
+
+
+class _Stack(object):
+
+    def __init__(self, array):
+        self.array = array
+        self.zslices = range(array.shape[2])
+
+    def zslice(self, z):
+        return self.array[:, :, z]
+
+
+class PreviewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.images = {}
+        random = np.random.RandomState(5)
+        noise = nd.gaussian_filter(random.normal(size=(40, 30, 6)), 1.)
+        noise = (noise - noise.min()) / (noise.max() - noise.min())
+        self.intensity = (noise * 255).astype(np.uint16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def png(self, rgb):
+        """Keep the images written rather than encoding them."""
+        self.images[len(self.images)] = rgb.copy()
+        return str(len(self.images) - 1).encode("ascii")
+
+    def read_image(self, fpath):
+        with open(fpath, "rb") as fh:
+            return self.images[int(fh.read())]
+
+    def test_max_projection(self):
+        self.assertTrue(np.array_equal(max_projection(_Stack(self.intensity)),
+                                       self.intensity.max(axis=2)))
+
+    def test_outline(self):
+        mask = self.intensity.max(axis=2) > 180
+        self.assertTrue(np.any(mask))
+        expected = np.asarray(Region(mask).dilate(1).border)
+        self.assertTrue(np.array_equal(outline(mask), expected))
+
+    def test_later_masks_on_top(self):
+        gray = np.zeros((9, 9), dtype=np.uint8)
+        first = np.zeros((9, 9), dtype=bool)
+        first[2:5, 2:5] = True
+        second = np.zeros((9, 9), dtype=bool)
+        second[4:7, 4:7] = True
+        rgb = render(gray, [(first, (255, 0, 0)), (second, (0, 0, 255))])
+        both = np.logical_and(outline(first), outline(second))
+        self.assertTrue(np.any(both))
+        self.assertTrue(np.all(rgb[both] == (0, 0, 255)))
+        only_first = np.logical_and(outline(first), np.logical_not(both))
+        self.assertTrue(np.all(rgb[only_first] == (255, 0, 0)))
+        self.assertTrue(np.all(rgb[np.logical_not(
+            np.logical_or(outline(first), outline(second)))] == 0))
+
+    def test_tiles(self):
+        rows, cols = 2 * TILE_SIZE + 40, TILE_SIZE + 10
+        gray = (np.arange(rows * cols) % 251).astype(np.uint8).reshape(
+            (rows, cols))
+        # A single pixel region stays visible at every level.
+        mask = np.zeros((rows, cols), dtype=bool)
+        mask[rows - 1, 3] = True
+        masks = [(mask, (255, 0, 0))]
+        directory = os.path.join(self.tmp_dir, TILES_DIRNAME)
+        with mock.patch("preview._png", self.png):
+            num_tiles = write_tiles(gray, masks, directory)
+        with open(os.path.join(directory, "tiles.json")) as fh:
+            description = json.load(fh)
+        self.assertEqual(description["tile_size"], TILE_SIZE)
+        self.assertEqual(
+            [(level["level"], level["rows"], level["cols"], level["scale"])
+             for level in description["levels"]],
+            [(0, rows, cols, 1), (1, (rows + 1) // 2, (cols + 1) // 2, 2),
+             (2, (rows + 3) // 4, (cols + 3) // 4, 4)])
+        self.assertEqual(num_tiles, 3 * 2 + 2 * 1 + 1)
+
+        # The tiles of level 0 make up the full resolution preview.
+        level_dir = os.path.join(directory, "0")
+        tiles = [[self.read_image(os.path.join(level_dir,
+                                               "{}_{}.png".format(r, c)))
+                  for c in range(2)] for r in range(3)]
+        self.assertTrue(np.array_equal(np.vstack([np.hstack(t)
+                                                  for t in tiles]),
+                                       render(gray, masks)))
+        top = self.read_image(os.path.join(directory, "2", "0_0.png"))
+        self.assertTrue(np.any(np.all(top == (255, 0, 0), axis=2)))
+
+    def test_write_preview(self):
+        labels, num = nd.label(self.intensity > 170)
+        objects = SparseObjects.from_labels(labels)
+        identifiers = np.arange(num + 1)
+        categories = [identifiers % 3 == n for n in range(3)]
+        for category in categories:
+            category[0] = False
+        with mock.patch("preview._png", self.png):
+            num_images = write_preview(_Stack(self.intensity), objects,
+                                       categories, self.tmp_dir)
+        self.assertEqual(num_images, 1)
+        rgb = self.read_image(os.path.join(self.tmp_dir, PREVIEW_FNAME))
+        self.assertEqual(rgb.shape, self.intensity.shape[:2] + (3,))
+        kept = np.zeros(num + 1, dtype=bool)
+        kept[categories[0]] = True
+        projection = np.any(kept[labels], axis=2)
+        self.assertTrue(np.all(rgb[outline(projection)] ==
+                               CATEGORY_COLORS[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
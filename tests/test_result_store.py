@@ -0,0 +1,136 @@
+"""Tests of the store of the object tables of a run."""
+
+import io
+import os
+import os.path
+import sys
+import shutil
+import zipfile
+import tempfile
+import unittest
+from collections import OrderedDict
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from result_store import ResultStore, read_results, units_dir  # NOQA
+
+
+def _table(identifiers):
+    table = OrderedDict()
+    table["id"] = np.array(identifiers)
+    table["voxels"] = np.array(identifiers) * 10
+    return table
+
+
+def _interrupted(n):
+    """Return write_array raising KeyboardInterrupt on the n-th call."""
+    write_array = np.lib.format.write_array
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        calls.append(None)
+        if len(calls) == n:
+            raise KeyboardInterrupt()
+        return write_array(*args, **kwargs)
+    return interrupted
+
+
+class ResultStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.tmp_dir, "results.npz")
+        self.input_file = os.path.join(self.tmp_dir, "line", "leaf.lif")
+        self.units_dir = units_dir(self.fpath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_append_and_read(self):
+        store = ResultStore(self.fpath)
+        store.append(_table([1, 2]), self.input_file, 0)
+        store.append(_table([3]), self.input_file, 1, channel=1)
+        store = ResultStore(self.fpath)
+        self.assertEqual(store.num_units, 2)
+        results = read_results(self.fpath)
+        self.assertEqual(results["id"].tolist(), [1, 2, 3])
+        self.assertEqual(results["series"].tolist(), [0, 0, 1])
+        self.assertEqual(results["channel"].tolist(), [0, 0, 1])
+        self.assertEqual(results["line"].tolist(), ["line"] * 3)
+
+    def test_units_not_rewritten(self):
+        store = ResultStore(self.fpath)
+        store.append(_table([1, 2]), self.input_file, 0)
+        fpath = os.path.join(self.units_dir, "unit-000000.npz")
+        before = os.stat(fpath)
+        store.append(_table([3]), self.input_file, 1)
+        after = os.stat(fpath)
+        self.assertEqual((after.st_ino, after.st_mtime),
+                         (before.st_ino, before.st_mtime))
+        self.assertEqual(sorted(os.listdir(self.units_dir)),
+                         ["unit-000000.npz", "unit-000001.npz"])
+
+    def test_interrupted_append_leaves_store_intact(self):
+        store = ResultStore(self.fpath)
+        store.append(_table([1, 2]), self.input_file, 0)
+        with open(self.fpath, "rb") as fh:
+            before = fh.read()
+        with mock.patch("numpy.lib.format.write_array", _interrupted(3)):
+            self.assertRaises(KeyboardInterrupt, store.append,
+                              _table([3]), self.input_file, 1)
+        with open(self.fpath, "rb") as fh:
+            self.assertEqual(fh.read(), before)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ["results.npz", "results.units"])
+        self.assertEqual(os.listdir(self.units_dir), ["unit-000000.npz"])
+        self.assertEqual(read_results(self.fpath)["id"].tolist(), [1, 2])
+
+    def test_interrupted_index_update(self):
+        store = ResultStore(self.fpath)
+        store.append(_table([1, 2]), self.input_file, 0)
+        # The unit file is written, but not the index listing it.
+        with mock.patch("numpy.lib.format.write_array", _interrupted(8)):
+            self.assertRaises(KeyboardInterrupt, store.append,
+                              _table([3]), self.input_file, 1)
+        self.assertEqual(os.listdir(self.tmp_dir).count("results.npz"), 1)
+        self.assertEqual(read_results(self.fpath)["id"].tolist(), [1, 2])
+        store = ResultStore(self.fpath)
+        self.assertEqual(store.num_units, 1)
+        store.append(_table([4]), self.input_file, 2)
+        self.assertEqual(read_results(self.fpath)["id"].tolist(), [1, 2, 4])
+
+    def test_units_held_in_index(self):
+        # Store written before the units had files of their own, and before
+        # channels and time points were recorded.
+        with zipfile.ZipFile(self.fpath, "w") as zf:
+            columns = [("line", "line"), ("file", self.input_file),
+                       ("series", 0)]
+            columns.extend(_table([1, 2]).items())
+            for name, array in columns:
+                buf = io.BytesIO()
+                np.lib.format.write_array(buf, np.asarray(array))
+                zf.writestr("unit-000000/{}.npy".format(name),
+                            buf.getvalue())
+        store = ResultStore(self.fpath)
+        self.assertEqual(store.num_units, 1)
+        self.assertEqual(read_results(self.fpath)["id"].tolist(), [1, 2])
+        store.append(_table([3]), self.input_file, 1, channel=1)
+        self.assertEqual(ResultStore(self.fpath).num_units, 2)
+        results = read_results(self.fpath)
+        self.assertEqual(results["id"].tolist(), [1, 2, 3])
+        self.assertEqual(results["voxels"].tolist(), [10, 20, 30])
+        self.assertEqual(results["channel"].tolist(), [0, 0, 1])
+        self.assertEqual(sorted(os.listdir(self.units_dir)),
+                         ["unit-000000.npz", "unit-000001.npz"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+"""Equivalence tests of the segmentation and object statistics.
+
+The multi-threaded segmentation labels the same objects as
+:func:`jicbioimage.segment.connected_components`, with the same identifiers.
+The slab-wise segmentation may number them differently, so its labels are
+compared up to a relabelling. The CSV files written from the statistics
+computed in one pass are compared with those of the original per region
+implementation.
+"""
+
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.ndimage as nd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+import plasmodesmata_analysis  # NOQA
+from plasmodesmata_analysis import (  # NOQA
+    segment3D,
+    size_categories,
+    write_csv,
+)
+from jicbioimage.segment import SegmentedImage, connected_components  # NOQA
+from object_statistics import ObjectStatistics, write_statistics_csv  # NOQA
+from parallel_segmentation import (  # NOQA
+    connected_components_numbering,
+    parallel_label,
+)
+from streaming import segment_slabs  # NOQA
+
+THRESHOLD = 160
+
+
+def canonical(labels):
+    """Return labels renumbered in the order of the first voxel of each object.
+
+    Two label arrays hold the same objects if their canonical labels are
+    equal.
+    """
+    labels = np.asarray(labels)
+    identifiers, first = np.unique(labels.ravel(), return_index=True)
+    first = first[identifiers != 0]
+    identifiers = identifiers[identifiers != 0]
+    lookup = np.zeros(int(labels.max()) + 1, dtype=int)
+    lookup[identifiers[np.argsort(first)]] = np.arange(1, len(identifiers) + 1)
+    return lookup[labels]
+
+
+def reference_csv(labels, intensity, fname):
+    """Write the CSV file as the original per region write_csv did."""
+    header = ["id", "rgb", "voxels", "sum", "min", "max", "mean"]
+    row = '{id:d},"{rgb}",{voxels:d},{sum:d},{min:d},{max:d},{mean:.3f}\n'
+    with open(fname, "w") as fh:
+        fh.write("{}\n".format(",".join(header)))
+        for i in SegmentedImage.from_array(labels).identifiers:
+            region = labels == i
+            values = intensity[region]
+            data = dict(id=int(i),
+                        rgb=str(plasmodesmata_analysis.pretty_color(i)),
+                        voxels=int(np.sum(region)), sum=int(np.sum(values)),
+                        min=int(np.min(values)), max=int(np.max(values)),
+                        mean=float(np.mean(values)))
+            fh.write(row.format(**data))
+
+
+def skimage_0_11_numbering(labels):
+    """Return labels numbered as connected_components with scikit-image 0.11.
+
+    scikit-image 0.11 numbered the objects from zero in the order of their
+    first voxel and labelled the background -1; connected_components then
+    moved the first object after the last one.
+    """
+    ar = np.array(labels) - 1
+    if np.min(ar) == -1:
+        ar[np.where(ar == 0)] = np.max(ar) + 1
+        ar[np.where(ar == -1)] = 0
+    return ar
+
+
+class _Stack(object):
+
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+
+
+class _ArrayReader(object):
+
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+
+    def slab(self, start, stop):
+        return self.array[:, :, start:stop]
+
+
+class SegmentationEquivalenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        random = np.random.RandomState(0)
+        # Blobs of all sizes, many of them crossing the chunk and slab seams.
+        noise = nd.gaussian_filter(random.normal(size=(40, 30, 12)), 1.)
+        noise = (noise - noise.min()) / (noise.max() - noise.min())
+        self.intensity = (noise * 255).astype(np.uint16)
+        self.labels = np.asarray(connected_components(
+            self.intensity > THRESHOLD, background=0))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, fname):
+        with open(os.path.join(self.tmp_dir, fname)) as fh:
+            return fh.read()
+
+    def test_has_objects(self):
+        self.assertTrue(self.labels.max() > 10)
+
+    def test_segment3D_labels_identical(self):
+        for threads in [1, 3, 7]:
+            segmentation = segment3D(_Stack(self.intensity), THRESHOLD,
+                                     threads)
+            self.assertTrue(np.array_equal(segmentation, self.labels),
+                            threads)
+
+    def test_numbering_before_skimage_0_12(self):
+        labels = parallel_label(self.intensity, THRESHOLD, 3)
+        expected = skimage_0_11_numbering(labels)
+        self.assertEqual(int(expected[labels == 1][0]), labels.max())
+        connected_components_numbering(labels, first_object_last=True)
+        self.assertTrue(np.array_equal(labels, expected))
+
+    def test_numbering_without_background(self):
+        labels = np.array([[1, 1, 2], [3, 3, 2]], dtype=np.int32)
+        expected = skimage_0_11_numbering(labels)
+        connected_components_numbering(labels, first_object_last=True)
+        self.assertTrue(np.array_equal(labels, expected))
+        self.assertTrue(np.array_equal(
+            connected_components_numbering(labels.copy(), False), labels))
+
+    def test_parallel_labels_identical_to_single_threaded(self):
+        single = parallel_label(self.intensity, THRESHOLD, 1)
+        for threads in [3, 7]:
+            labels = parallel_label(self.intensity, THRESHOLD, threads)
+            self.assertTrue(np.array_equal(labels, single))
+
+    def test_slab_labels_same_objects(self):
+        for slab_size in [1, 5, 12]:
+            labels, statistics = segment_slabs(
+                _ArrayReader(self.intensity), THRESHOLD, slab_size,
+                os.path.join(self.tmp_dir, "labels.npy"))
+            self.assertTrue(np.array_equal(canonical(labels),
+                                           canonical(self.labels)))
+
+    def test_slab_statistics_identical(self):
+        labels, statistics = segment_slabs(
+            _ArrayReader(self.intensity), THRESHOLD, 5,
+            os.path.join(self.tmp_dir, "labels.npy"))
+        expected = ObjectStatistics.from_segmentation(np.array(labels),
+                                                      self.intensity)
+        for name in ["identifiers", "voxels", "sum", "min", "max", "mean"]:
+            self.assertTrue(np.array_equal(getattr(statistics, name),
+                                           getattr(expected, name)), name)
+        self.assertEqual(statistics.background_voxels,
+                         expected.background_voxels)
+
+    def test_csv_identical(self):
+        write_csv(self.labels, self.intensity,
+                  os.path.join(self.tmp_dir, "new.csv"))
+        reference_csv(self.labels, self.intensity,
+                      os.path.join(self.tmp_dir, "reference.csv"))
+        self.assertEqual(self.read("new.csv"), self.read("reference.csv"))
+
+    def test_category_csvs_identical(self):
+        statistics = ObjectStatistics.from_segmentation(self.labels,
+                                                        self.intensity)
+        categories = size_categories(statistics.voxel_counts(), 3, 20)
+        for n, keep in enumerate(categories):
+            self.assertTrue(np.any(keep[1:]))
+            write_statistics_csv(statistics, keep,
+                                 os.path.join(self.tmp_dir, "new.csv"))
+            reference_csv(np.where(keep[self.labels], self.labels, 0),
+                          self.intensity,
+                          os.path.join(self.tmp_dir, "reference.csv"))
+            self.assertEqual(self.read("new.csv"), self.read("reference.csv"),
+                             n)
+
+
+if __name__ == "__main__":
+    unittest.main()
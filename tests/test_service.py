@@ -0,0 +1,154 @@
+"""Tests of the jobs of the analysis service and its access control."""
+
+import os
+import os.path
+import sys
+import stat
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+import service  # NOQA
+import result_store  # NOQA
+from service import (  # NOQA
+    AnalysisService,
+    authkey,
+    default_address,
+    service_directory,
+    submit_files,
+)
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def _owned_by_other_user(function, path):
+    """Return function reporting path to belong to another user."""
+
+    def other_user(p, *args, **kwargs):
+        result = function(p, *args, **kwargs)
+        if p != path:
+            return result
+        return mock.Mock(st_uid=os.getuid() + 1, st_mode=result.st_mode)
+    return other_user
+
+
+@unittest.skipUnless(service.HAVE_UNIX_SOCKETS, "needs Unix domain sockets")
+class ServiceAccessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+        os.environ["XDG_RUNTIME_DIR"] = self.tmp_dir
+        self.directory = os.path.join(self.tmp_dir, "plasmodesmata")
+
+    def tearDown(self):
+        if self.runtime_dir is None:
+            del os.environ["XDG_RUNTIME_DIR"]
+        else:
+            os.environ["XDG_RUNTIME_DIR"] = self.runtime_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def test_private_directory(self):
+        self.assertEqual(service_directory(), self.directory)
+        self.assertEqual(_mode(self.directory), 0o700)
+        self.assertEqual(os.path.dirname(default_address()), self.directory)
+
+    def test_shared_directory_refused(self):
+        os.mkdir(self.directory)
+        os.chmod(self.directory, 0o755)
+        self.assertRaises(RuntimeError, service_directory)
+
+    def test_private_authkey(self):
+        key = authkey()
+        self.assertEqual(len(key), 32)
+        self.assertEqual(authkey(), key)
+        self.assertEqual(_mode(os.path.join(self.directory,
+                                            service.AUTHKEY_FNAME)), 0o600)
+
+    def test_socket_of_other_user_refused(self):
+        address = default_address()
+        open(address, "w").close()
+        with mock.patch("os.stat", _owned_by_other_user(os.stat, address)):
+            self.assertRaises(RuntimeError, submit_files, address, [], 100,
+                              1, 10, None)
+
+    def test_serve_with_socket_of_other_user(self):
+        address = default_address()
+        open(address, "w").close()
+        analysis_service = AnalysisService(address, 1)
+        with mock.patch("os.lstat", _owned_by_other_user(os.lstat, address)):
+            self.assertRaises(RuntimeError, analysis_service.serve_forever)
+        self.assertTrue(os.path.exists(address))
+
+    def test_clients_authenticate(self):
+        analysis_service = AnalysisService(default_address(), 1)
+        listener = analysis_service._listen()
+        accepted = []
+
+        def accept():
+            for n in range(2):
+                try:
+                    accepted.append(listener.accept())
+                except AuthenticationError:
+                    pass
+        thread = threading.Thread(target=accept)
+        thread.start()
+        try:
+            self.assertEqual(_mode(default_address()) & 0o077, 0)
+            self.assertRaises(AuthenticationError, Client, default_address(),
+                              family="AF_UNIX", authkey=b"wrong key")
+            connection = Client(default_address(), family="AF_UNIX",
+                                authkey=authkey())
+            connection.send("job")
+            thread.join()
+            self.assertEqual(len(accepted), 1)
+            self.assertEqual(accepted[0].recv(), "job")
+            connection.close()
+        finally:
+            listener.close()
+            analysis_service.pool.terminate()
+            analysis_service.pool.join()
+
+    def test_job_loader_and_series(self):
+        analysis_service = AnalysisService(default_address(), 1)
+        listener = analysis_service._listen()
+
+        def serve():
+            analysis_service.handle_connection(listener.accept())
+        thread = threading.Thread(target=serve)
+        thread.start()
+        try:
+            with mock.patch("service.analyse_files",
+                            return_value=["failed"]) as analyse_files:
+                failures = submit_files(
+                    default_address(), [("leaf.lif", "out")], 100, 1, 10,
+                    None, load_collection=result_store.read_results,
+                    series=2)
+                thread.join()
+            self.assertEqual(failures, ["failed"])
+            args, kwargs = analyse_files.call_args
+            self.assertEqual(args[0], [("leaf.lif", "out")])
+            self.assertTrue(args[1] is result_store.read_results)
+            self.assertEqual(kwargs["series"], 2)
+        finally:
+            listener.close()
+            analysis_service.pool.terminate()
+            analysis_service.pool.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Tests of the sparse representation of the objects of a segmentation."""
+
+import os
+import os.path
+import sys
+import unittest
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from sparse_objects import SparseObjects  # NOQA
+
+
+class SparseSelectionTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.labels = random.randint(0, 6, (7, 5, 4))
+        self.keep = np.array([False, True, False, True, True, False])
+        self.expected = np.where(self.keep[self.labels], self.labels, 0)
+        objects = SparseObjects.from_labels(self.labels)
+        self.selection = objects.select(self.keep)
+
+    def assertIndexed(self, index):
+        self.assertTrue(np.array_equal(self.selection[index],
+                                       self.expected[index]), index)
+
+    def test_zslice(self):
+        for z in range(4):
+            self.assertIndexed((slice(None), slice(None), z))
+        self.assertIndexed((slice(None), slice(None), -1))
+        self.assertIndexed((slice(1, 3), 2, 0))
+
+    def test_full_volume(self):
+        self.assertIndexed(slice(None))
+        self.assertIndexed(Ellipsis)
+        self.assertEqual(self.selection[:].shape, self.labels.shape)
+
+    def test_partial_indices(self):
+        self.assertIndexed((Ellipsis, 2))
+        self.assertIndexed((3,))
+        self.assertIndexed((slice(None), slice(None), slice(1, None, 2)))
+
+    def test_unique_identifiers(self):
+        self.assertEqual(np.unique(self.selection[:]).tolist(), [0, 1, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
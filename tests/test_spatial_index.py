@@ -0,0 +1,115 @@
+"""Tests of the spatial statistics against brute force distances."""
+
+import os
+import os.path
+import sys
+import math
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from spatial_index import INDEX_FNAME, SpatialIndex, spatial_table  # NOQA
+
+SPACING = (0.1, 0.1, 0.5)
+RADIUS = 1.
+CLUSTER_DISTANCE = 0.6
+
+
+def brute_force_clusters(distances, distance):
+    """Return the clusters numbered in the order of their first object."""
+    clusters = -np.ones(len(distances), dtype=int)
+    num_clusters = 0
+    for start in range(len(distances)):
+        if clusters[start] >= 0:
+            continue
+        clusters[start] = num_clusters
+        stack = [start]
+        while stack:
+            n = stack.pop()
+            for m in np.flatnonzero(distances[n] <= distance):
+                if clusters[m] < 0:
+                    clusters[m] = num_clusters
+                    stack.append(m)
+        num_clusters += 1
+    return clusters
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        random = np.random.RandomState(4)
+        self.identifiers = np.arange(1, 81) * 3
+        self.centroids = random.uniform(0, 1, size=(80, 3)) * [60, 50, 8]
+        self.index = SpatialIndex(self.identifiers, self.centroids, SPACING)
+        points = self.centroids * SPACING
+        differences = points[:, np.newaxis, :] - points[np.newaxis, :, :]
+        self.distances = np.sqrt(np.sum(differences ** 2, axis=2))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_nearest_neighbour_distances(self):
+        distances = self.distances + np.diag(np.repeat(np.inf, 80))
+        self.assertTrue(np.allclose(self.index.nearest_neighbour_distances(),
+                                    distances.min(axis=1)))
+
+    def test_neighbour_counts(self):
+        counts = np.sum(self.distances <= RADIUS, axis=1) - 1
+        self.assertTrue(np.any(counts > 0))
+        self.assertEqual(self.index.neighbour_counts(RADIUS).tolist(),
+                         counts.tolist())
+
+    def test_clusters(self):
+        clusters = brute_force_clusters(self.distances, CLUSTER_DISTANCE)
+        self.assertTrue(1 < clusters.max() + 1 < 80)
+        self.assertEqual(self.index.clusters(CLUSTER_DISTANCE).tolist(),
+                         clusters.tolist())
+
+    def test_within(self):
+        point = self.centroids[10] * SPACING
+        expected = self.identifiers[self.distances[10] <= RADIUS]
+        self.assertEqual(self.index.within(point, RADIUS).tolist(),
+                         sorted(expected.tolist()))
+
+    def test_table(self):
+        table = spatial_table(self.index, RADIUS, CLUSTER_DISTANCE)
+        self.assertEqual(table["id"].tolist(), self.identifiers.tolist())
+        self.assertTrue(np.allclose(
+            np.column_stack([table["row"], table["col"], table["z"]]),
+            self.centroids))
+        volume = 4. / 3. * math.pi * RADIUS ** 3
+        self.assertTrue(np.allclose(table["density"] * volume,
+                                    table["neighbours"]))
+
+    def test_save_and_load(self):
+        fpath = os.path.join(self.tmp_dir, INDEX_FNAME)
+        self.index.save(fpath)
+        index = SpatialIndex.load(fpath)
+        self.assertEqual(index.identifiers.tolist(),
+                         self.identifiers.tolist())
+        self.assertTrue(np.allclose(index.points, self.index.points))
+        self.assertEqual(index.spacing.tolist(), list(SPACING))
+        self.assertEqual(index.clusters(CLUSTER_DISTANCE).tolist(),
+                         self.index.clusters(CLUSTER_DISTANCE).tolist())
+
+    def test_few_objects(self):
+        empty = SpatialIndex([], np.zeros((0, 3)), SPACING)
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(len(empty.nearest_neighbour_distances()), 0)
+        self.assertEqual(len(empty.clusters(CLUSTER_DISTANCE)), 0)
+        self.assertEqual(len(empty.within([0, 0, 0], RADIUS)), 0)
+        single = SpatialIndex([7], [[1, 2, 3]], SPACING)
+        self.assertEqual(single.nearest_neighbour_distances().tolist(),
+                         [np.inf])
+        self.assertEqual(single.neighbour_counts(RADIUS).tolist(), [0])
+        self.assertEqual(single.clusters(CLUSTER_DISTANCE).tolist(), [0])
+
+
+if __name__ == "__main__":
+    unittest.main()
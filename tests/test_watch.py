@@ -0,0 +1,122 @@
+"""Tests of watching the input directories for new images."""
+
+import os
+import os.path
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+
+from watch import StableFiles, watch_images  # NOQA
+
+
+class _Stop(Exception):
+    pass
+
+
+class StableFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.tmp_dir, "leaf.lif")
+        self.write(b"header")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, data, mtime=1000):
+        with open(self.fpath, "ab") as fh:
+            fh.write(data)
+        os.utime(self.fpath, (mtime, mtime))
+
+    def test_settled_once(self):
+        stable_files = StableFiles(30)
+        self.assertEqual(stable_files.update([self.fpath], now=0), [])
+        self.assertEqual(stable_files.update([self.fpath], now=29), [])
+        self.assertEqual(stable_files.update([self.fpath], now=30),
+                         [self.fpath])
+        self.assertEqual(stable_files.update([self.fpath], now=100), [])
+
+    def test_growing_file(self):
+        stable_files = StableFiles(30)
+        stable_files.update([self.fpath], now=0)
+        # Still being written: the settle time starts again.
+        self.write(b"more data", mtime=1020)
+        self.assertEqual(stable_files.update([self.fpath], now=20), [])
+        self.assertEqual(stable_files.update([self.fpath], now=40), [])
+        self.assertEqual(stable_files.update([self.fpath], now=50),
+                         [self.fpath])
+
+    def test_changed_after_analysis(self):
+        stable_files = StableFiles(0)
+        self.assertEqual(stable_files.update([self.fpath], now=0),
+                         [self.fpath])
+        self.write(b"more data", mtime=2000)
+        self.assertEqual(stable_files.update([self.fpath], now=10),
+                         [self.fpath])
+
+    def test_removed_file(self):
+        stable_files = StableFiles(0)
+        missing = os.path.join(self.tmp_dir, "missing.lif")
+        self.assertEqual(stable_files.update([missing, self.fpath], now=0),
+                         [self.fpath])
+
+
+class WatchImagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.images = []
+        for name in ["b", "a", "done"]:
+            fpath = os.path.join(self.tmp_dir, name + ".lif")
+            open(fpath, "w").close()
+            self.images.append((fpath, os.path.join(self.tmp_dir, name)))
+        self.journal = mock.Mock()
+        self.journal.file_done.side_effect = lambda f: f.endswith("done.lif")
+        self.logger = logging.Logger("watch-test")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def watch(self, list_images, analyse, polls):
+        sleep = mock.Mock(side_effect=[None] * (polls - 1) + [_Stop()])
+        with mock.patch("time.sleep", sleep):
+            self.assertRaises(_Stop, watch_images, list_images, analyse,
+                              self.journal, 5, 0, self.logger)
+        sleep.assert_called_with(5)
+
+    def test_new_images_analysed_once(self):
+        analysed = []
+        self.watch(lambda: self.images, analysed.append, 3)
+        self.assertEqual(analysed, [sorted(self.images[:2])])
+        self.assertEqual(self.journal.refresh.call_count, 3)
+
+    def test_failed_analysis_keeps_watching(self):
+        fpath = os.path.join(self.tmp_dir, "c.lif")
+        new_image = (fpath, os.path.join(self.tmp_dir, "c"))
+        polls = []
+
+        def list_images():
+            polls.append(None)
+            if len(polls) == 1:
+                return self.images
+            open(fpath, "a").close()
+            return self.images + [new_image]
+        analyse = mock.Mock(side_effect=[RuntimeError("failed"), None])
+        self.watch(list_images, analyse, 3)
+        self.assertEqual(analyse.call_args_list,
+                         [mock.call(sorted(self.images[:2])),
+                          mock.call([new_image])])
+
+
+if __name__ == "__main__":
+    unittest.main()